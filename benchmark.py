@@ -0,0 +1,157 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+from aqs import calculate_aqs
+from csv_export import export_records_to_csv
+from history import compute_crc8_maxim, read_history_file
+from history_generator import parse_mix, write_archive
+from history_scan import scan_file
+
+DEFAULT_SIZES = "10000,50000"
+DEFAULT_MIXES = "default;default=0.7,ext_pm_gps=0.3;all"
+DEFAULT_THRESHOLD = 0.2
+
+
+def _stage_crc(path, records, is_new_pm_format):
+    with open(path, "rb") as f:
+        raw = f.read()
+    offset = 0
+    for record in records:
+        length = record["_total_length"]
+        compute_crc8_maxim(raw[offset:offset + length - 1])
+        offset += length
+
+
+def _stage_parse(path, records, is_new_pm_format):
+    # read_history_file prints a line for the truncated tail, keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        read_history_file(path, is_new_pm_format)
+
+
+def _stage_scan(path, records, is_new_pm_format):
+    scan_file(path)
+
+
+def _stage_aqs(path, records, is_new_pm_format):
+    for r in records:
+        calculate_aqs(co2=r.get("co2_ppm"), pm1=r.get("pm1_ug_m3"), pm25=r.get("pm25_ug_m3"),
+                      pm10=r.get("pm10_ug_m3"), voc_index=r.get("voc_index"), nox_index=r.get("nox_index"))
+
+
+def _stage_export(path, records, is_new_pm_format):
+    with contextlib.redirect_stdout(io.StringIO()):
+        export_records_to_csv(records, path + ".csv")
+
+
+STAGES = {
+    "crc": _stage_crc,
+    "parse": _stage_parse,
+    "scan": _stage_scan,
+    "aqs": _stage_aqs,
+    "export": _stage_export,
+}
+
+
+def measure(stage, path: str, records: list[dict], is_new_pm_format: bool, repeat: int) -> tuple[float, int]:
+    """Best wall time of repeat runs, then the peak traced memory of one more run (tracemalloc slows it down)."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        stage(path, records, is_new_pm_format)
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        stage(path, records, is_new_pm_format)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmarks(sizes: list[int], mixes: list[str], stages: list[str], repeat: int = 3,
+                   is_new_pm_format: bool = True, seed: int = 0) -> list[dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for mix in mixes:
+            for count in sizes:
+                path = os.path.join(tmp, "history.bin")
+                write_archive(path, count, mix=parse_mix(mix), is_new_pm_format=is_new_pm_format, seed=seed)
+                size = os.path.getsize(path)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    records = read_history_file(path, is_new_pm_format)
+                for name in stages:
+                    seconds, peak = measure(STAGES[name], path, records, is_new_pm_format, repeat)
+                    result = {
+                        "name": f"{name}/{mix}/{count}",
+                        "stage": name,
+                        "mix": mix,
+                        "records": count,
+                        "bytes": size,
+                        "seconds": seconds,
+                        "records_per_sec": count / seconds,
+                        # always relative to the archive size so stages can be compared
+                        "mb_per_sec": size / seconds / 1e6,
+                        "peak_memory_bytes": peak,
+                    }
+                    print(f"{result['name']:<45} {result['records_per_sec']:>12,.0f} rec/s "
+                          f"{result['mb_per_sec']:>8.2f} MB/s {peak / 1e6:>8.1f} MB peak")
+                    results.append(result)
+    return results
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float = DEFAULT_THRESHOLD) -> list[str]:
+    """Benchmarks slower or bigger than the baseline by more than threshold (0.2 = 20 %)."""
+    previous = {r["name"]: r for r in baseline}
+    regressions = []
+    for r in results:
+        old = previous.get(r["name"])
+        if old is None:
+            continue
+        if r["records_per_sec"] < old["records_per_sec"] * (1 - threshold):
+            regressions.append(f"{r['name']}: {r['records_per_sec']:,.0f} rec/s, "
+                               f"baseline {old['records_per_sec']:,.0f} rec/s")
+        if r["peak_memory_bytes"] > old["peak_memory_bytes"] * (1 + threshold):
+            regressions.append(f"{r['name']}: {r['peak_memory_bytes'] / 1e6:.1f} MB peak, "
+                               f"baseline {old['peak_memory_bytes'] / 1e6:.1f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark history decoding, AQS and CSV export")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated record counts")
+    parser.add_argument("--mixes", default=DEFAULT_MIXES, help="semicolon separated layout mixes, see history_generator")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma separated stages")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark, the fastest counts")
+    parser.add_argument("--old-pm-format", action="store_true")
+    parser.add_argument("--save", help="write the results as JSON")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --save, exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed slowdown, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    results = run_benchmarks([int(s) for s in args.sizes.split(",")], args.mixes.split(";"),
+                             args.stages.split(","), args.repeat, not args.old_pm_format)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "created": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results}, f, indent=2)
+        print(f"Saved results to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            raise SystemExit(1)
+        print(f"No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
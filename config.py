@@ -1,5 +1,8 @@
 import json
+
+from device_config import get_device_config, invalidate_device_config
 from mcumgr_wrapper import run_mcumgr_shell_command
+from scheduler import PRIORITY_CONFIG
 
 
 class ConfigError(Exception):
@@ -17,7 +20,15 @@ def load_config(path: str) -> dict:
     """
     with open(path, 'r') as f:
         config = json.load(f)
+    return validate_config(config)
+
+
+def validate_config(config: dict) -> dict:
+    """
+    Validate a configuration dictionary, see load_config.
 
+    :raises ConfigError: If required fields are missing or values are invalid
+    """
     # Define valid options for each field
     valid = {
         'pm': {
@@ -67,65 +78,112 @@ def load_config(path: str) -> dict:
     return config
 
 
-def apply_config(device_path: str, config: dict) -> None:
-    """
-    Apply the configuration settings to the device via McuMgrClient commands.
+class ConfigChange:
+    """One set command of a configuration. current is the device value, None when it can't be read."""
 
-    :param config: Configuration dictionary
-    :param client: Initialized McuMgrClient instance
-    """
+    def __init__(self, name: str, cmd: str, args: list[str], current: list[str] | None = None):
+        self.name = name
+        self.cmd = cmd
+        self.args = args
+        self.current = current
+
+    def __str__(self):
+        current = " ".join(self.current) if self.current is not None else "?"
+        return f"{self.name}: {current} -> {' '.join(self.args)}"
+
+
+def config_commands(config: dict) -> list[ConfigChange]:
+    """The shell commands that set config, in the order they are sent."""
     pm = config['pm']
     mode = ('on_demand', 'always_on', '15_min', '10_min', '5_min').index(pm['mode'])
     charging_mode = ('off', 'on').index(pm['charging_mode'])
-    response, error, raw = run_mcumgr_shell_command(device_path, "pm mode", [str(mode), str(charging_mode)])
-    if error:
-        raise RuntimeError(f"Failed to set PM mode: {error}")
-    pm_limit = pm['limit']
-    response, error, raw = run_mcumgr_shell_command(device_path, "pm limit", [str(pm_limit)])
-    if error:
-        raise RuntimeError(f"Failed to set PM limit: {error}")
-
     history_mode = ('default', 'ext_pm', 'ext_gps', 'ext_pm_gps').index(config['history']['mode'])
-    response, error, raw = run_mcumgr_shell_command(device_path, "history mode", [str(history_mode)])
-    if error:
-        raise RuntimeError(f"Failed to set history mode: {error}")
-
     gps = config['gps']
     gps_mode = ('always_off', 'timer', 'always_on').index(gps['mode'])
-    response, error, raw = run_mcumgr_shell_command(device_path, "gnss mode", [str(gps_mode)])
-    if error:
-        raise RuntimeError(f"Failed to set GPS mode: {error}")
-
-    gps_timer = gps['timer']
-    response, error, raw = run_mcumgr_shell_command(device_path, "gnss timer", [str(gps_timer)])
-    if error:
-        raise RuntimeError(f"Failed to set GPS timer: {error}")
-
     interval = config['interval']
-    interval_seconds = interval['seconds']
     interval_mode = ('average', 'median', 'min', 'max').index(interval['mode'])
-    response, error, raw = run_mcumgr_shell_command(device_path, "interval", [str(interval_seconds), str(interval_mode)])
-    if error:
-        raise RuntimeError(f"Failed to set interval: {error}")
-
     button = config['button']
     button_mode = ('off', 'aqs', 'co2', 'tvoc', 'nox', 'pm').index(button['mode'])
     pm_mode = ('off', 'on').index(button['pm_mode'])
-    response, error, raw = run_mcumgr_shell_command(device_path, "button mode", [str(button_mode), str(pm_mode)])
-    if error:
-        raise RuntimeError(f"Failed to set button mode: {error}")
+    voc_mode = ('off', 'always_on').index(config['voc']['mode'])
+    calibration = config['calibration']
+    return [
+        ConfigChange("PM mode", "pm mode", [str(mode), str(charging_mode)]),
+        ConfigChange("PM limit", "pm limit", [str(pm['limit'])]),
+        ConfigChange("history mode", "history mode", [str(history_mode)]),
+        ConfigChange("GPS mode", "gnss mode", [str(gps_mode)]),
+        ConfigChange("GPS timer", "gnss timer", [str(gps['timer'])]),
+        ConfigChange("interval", "interval", [str(interval['seconds']), str(interval_mode)]),
+        ConfigChange("button mode", "button mode", [str(button_mode), str(pm_mode)]),
+        ConfigChange("VOC mode", "voc mode", [str(voc_mode)]),
+        ConfigChange("calibration", "calibration", [str(calibration['t']), str(calibration['h'])]),
+    ]
+
+
+def read_current_config(device_path: str) -> dict[str, list[str] | None]:
+    """
+    Current arguments of each set command, read from the device rather than the cached DeviceConfig,
+    since another tool or a direct shell command may have changed a setting since it was cached.
+    None for settings the device can't report (GPS) or that failed to read.
+    """
+    state = get_device_config(device_path, max_age=0)
+    pm_status, interval, button, calibration = state.pm_status, state.interval, state.button, state.calibration
+    return {
+        "pm mode": [str(int(pm_status.mode)), str(int(pm_status.charging))] if pm_status else None,
+        "pm limit": [str(state.pm_limit)] if state.pm_limit is not None else None,
+        "history mode": [str(int(state.history_mode))] if state.history_mode is not None else None,
+        "gnss mode": None,
+        "gnss timer": None,
+        "interval": [str(interval.seconds), str(int(interval.mode))] if interval else None,
+        "button mode": [str(int(button.mode)), str(int(button.pm_mode))] if button else None,
+        "voc mode": [str(int(state.voc_mode))] if state.voc_mode is not None else None,
+        "calibration": [str(calibration.temperature_offset), str(calibration.humidity_offset)]
+        if calibration else None,
+    }
 
-    voc = config['voc']
-    voc_mode = ('off', 'always_on').index(voc['mode'])
-    response, error, raw = run_mcumgr_shell_command(device_path, "voc mode", [str(voc_mode)])
-    if error:
-        raise RuntimeError(f"Failed to set VOC mode: {error}")
 
-    calibration = config['calibration']
-    t = calibration['t']
-    h = calibration['h']
-    response, error, raw = run_mcumgr_shell_command(device_path, "calibration", [str(t), str(h)])
-    if error:
-        raise RuntimeError(f"Failed to set calibration: {error}")
+def _same_args(a: list[str], b: list[str]) -> bool:
+    # numeric compare, the device prints "0.0" for a configured "0"
+    try:
+        return [float(x) for x in a] == [float(x) for x in b]
+    except ValueError:
+        return a == b
+
 
-    print("Configuration applied successfully.")
\ No newline at end of file
+def plan_config(device_path: str, config: dict) -> list[ConfigChange]:
+    """The set commands whose value differs from the device, or whose value can't be read."""
+    current = read_current_config(device_path)
+    changes = []
+    for change in config_commands(config):
+        change.current = current.get(change.cmd)
+        if change.current is None or not _same_args(change.current, change.args):
+            changes.append(change)
+    return changes
+
+
+def apply_config(device_path: str, config: dict, diff: bool = True, dry_run: bool = False) -> list[ConfigChange]:
+    """
+    Apply the configuration settings to the device via shell commands.
+
+    With diff the device state is read first and only differing settings are sent. With dry_run
+    nothing is sent. Returns the changes that were (or would be) sent.
+
+    :param device_path: Serial port of the device
+    :param config: Configuration dictionary from load_config
+    """
+    changes = plan_config(device_path, config) if diff else config_commands(config)
+    if not dry_run:
+        send_config_changes(device_path, changes)
+    return changes
+
+
+def send_config_changes(device_path: str, changes: list[ConfigChange]) -> None:
+    try:
+        for change in changes:
+            response, error, raw = run_mcumgr_shell_command(device_path, change.cmd, change.args,
+                                                            priority=PRIORITY_CONFIG)
+            if error:
+                raise RuntimeError(f"Failed to set {change.name}: {error}")
+    finally:
+        # even a partly applied config makes the cached snapshot stale
+        invalidate_device_config(device_path)
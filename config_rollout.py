@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import ConfigError, apply_config, load_config, plan_config, validate_config
+from hotplug import HotplugWatcher
+from mcumgr_wrapper import run_mcumgr_shell_command
+
+DEFAULT_PARALLEL = 8
+
+
+class Rollout:
+    """
+    Named config profiles and the rules that pick one for a device.
+
+    The rollout file looks like:
+
+        {
+          "profiles": {"indoor": "config.json", "outdoor": {... same layout as config.json ...}},
+          "tags": {"roof": ["C0:FF:EE:00:00:01", "SN0000002"]},
+          "assign": {"C0:FF:EE:00:00:03": "outdoor", "tag:roof": "outdoor"},
+          "default": "indoor"
+        }
+
+    A device gets the profile assigned to its MAC, else its serial number, else the first tag listing
+    it, else the default. Profiles given as paths are relative to the rollout file.
+    """
+
+    def __init__(self, profiles: dict[str, dict], assign: dict[str, str], tags: dict[str, list[str]],
+                 default: str | None = None):
+        self.profiles = profiles
+        self.assign = {key.upper(): name for key, name in assign.items()}
+        self.tags = {tag.lower(): {member.upper() for member in members} for tag, members in tags.items()}
+        self.default = default
+
+    def profile_for(self, mac: str | None, serial: str | None) -> str | None:
+        for key in (mac, serial):
+            if key and key.upper() in self.assign:
+                return self.assign[key.upper()]
+        for key, name in self.assign.items():
+            if key.startswith("TAG:"):
+                members = self.tags.get(key[4:].lower(), set())
+                if mac and mac.upper() in members or serial and serial.upper() in members:
+                    return name
+        return self.default
+
+
+def load_rollout(path: str) -> Rollout:
+    """Read a rollout file and validate every profile once. Raises ConfigError."""
+    with open(path) as f:
+        data = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    profiles = {}
+    for name, profile in data.get("profiles", {}).items():
+        try:
+            if isinstance(profile, str):
+                profiles[name] = load_config(os.path.join(base, profile))
+            else:
+                profiles[name] = validate_config(profile)
+        except (OSError, ValueError, ConfigError) as e:
+            raise ConfigError(f"Profile '{name}': {e}") from e
+    tags = {tag.lower(): members for tag, members in data.get("tags", {}).items()}
+    assign = data.get("assign", {})
+    default = data.get("default")
+    for name in list(assign.values()) + ([default] if default else []):
+        if name not in profiles:
+            raise ConfigError(f"Unknown profile '{name}'")
+    for key in assign:
+        if key.lower().startswith("tag:") and key[4:].lower() not in tags:
+            raise ConfigError(f"Unknown tag '{key[4:]}'")
+    return Rollout(profiles, assign, tags, default)
+
+
+def read_identity(device: str) -> tuple[str | None, str | None]:
+    """(MAC, serial number) of a device, None for what could not be read."""
+    mac, stderr, raw = run_mcumgr_shell_command(device, "mac")
+    mac = None if stderr or not mac else mac
+    identity, stderr, raw = run_mcumgr_shell_command(device, "identity")
+    parts = identity.split(" ") if identity and not stderr else []
+    return mac, parts[4] if len(parts) > 4 else None
+
+
+def rollout_device(device: str, rollout: Rollout, dry_run: bool = False) -> dict:
+    """Apply the device's profile and read it back. Returns the summary entry of the device."""
+    started = time.monotonic()
+    result = {"device": device, "mac": None, "serial": None, "profile": None, "status": "failed",
+              "changes": [], "unverified": [], "error": ""}
+    try:
+        result["mac"], result["serial"] = read_identity(device)
+        if result["mac"] is None and result["serial"] is None:
+            raise RuntimeError("device does not answer")
+        profile = rollout.profile_for(result["mac"], result["serial"])
+        result["profile"] = profile
+        if profile is None:
+            result["status"] = "no profile"
+            return result
+        config = rollout.profiles[profile]
+        changes = apply_config(device, config, dry_run=dry_run)
+        result["changes"] = [str(change) for change in changes]
+        if dry_run:
+            result["status"] = "planned"
+            return result
+        # read back, settings without a read command can only be trusted
+        remaining = plan_config(device, config)
+        result["unverified"] = [str(change) for change in remaining if change.current is None]
+        mismatched = [str(change) for change in remaining if change.current is not None]
+        if mismatched:
+            result["status"] = "mismatch"
+            result["error"] = "; ".join(mismatched)
+        else:
+            result["status"] = "applied" if changes else "unchanged"
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        result["seconds"] = round(time.monotonic() - started, 3)
+    return result
+
+
+def rollout_fleet(devices: list[str], rollout: Rollout, parallel: int = DEFAULT_PARALLEL,
+                  dry_run: bool = False) -> dict:
+    """Roll the profiles out to up to parallel devices at a time and summarize."""
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, parallel), thread_name_prefix="config-rollout") as executor:
+        results = list(executor.map(lambda device: rollout_device(device, rollout, dry_run), devices))
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    return {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "dry_run": dry_run,
+            "seconds": round(time.monotonic() - started, 3), "counts": counts, "devices": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply named configuration profiles to many devices")
+    parser.add_argument("rollout", help="rollout file with profiles and device assignments")
+    parser.add_argument("--devices", nargs="*", help="serial ports, default all connected devices")
+    parser.add_argument("--parallel", type=int, default=DEFAULT_PARALLEL, help="devices configured at the same time")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be sent")
+    parser.add_argument("--output", help="write the JSON summary to this file instead of stdout")
+    args = parser.parse_args()
+
+    try:
+        rollout = load_rollout(args.rollout)
+    except (OSError, ValueError, ConfigError) as e:
+        print(f"Invalid rollout file: {e}", file=sys.stderr)
+        raise SystemExit(2)
+    devices = args.devices or HotplugWatcher().poll()[0]
+    summary = rollout_fleet(devices, rollout, args.parallel, args.dry_run)
+    text = json.dumps(summary, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    if any(r["status"] in ("failed", "mismatch") for r in summary["devices"]):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
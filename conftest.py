@@ -0,0 +1,33 @@
+import pytest
+
+import mcumgr_wrapper
+from device_config import invalidate_device_config
+from retry import reset_breaker
+from scheduler import close_scheduler
+from simulator import SimulatedDevice, Simulator
+
+
+def start_simulator(**kwargs) -> Simulator:
+    simulator = Simulator(SimulatedDevice(history_files=2, records_per_file=60), **kwargs)
+    simulator.start()
+    return simulator
+
+
+def stop_simulator(simulator: Simulator):
+    close_scheduler(simulator.port)
+    reset_breaker(simulator.port)
+    invalidate_device_config(simulator.port)
+    simulator.stop()
+
+
+@pytest.fixture(autouse=True)
+def native_smp(monkeypatch):
+    # the simulator answers SMP frames, there is no ./mcumgr here
+    monkeypatch.setattr(mcumgr_wrapper, "USE_NATIVE_SMP", True)
+
+
+@pytest.fixture
+def simulator():
+    simulator = start_simulator(reboot_time=0.3)
+    yield simulator
+    stop_simulator(simulator)
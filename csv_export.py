@@ -1,4 +1,5 @@
 import csv
+from typing import Callable, Iterable
 
 from history import FIELDS_MAPPING
 
@@ -38,4 +39,32 @@ def export_records_to_csv(records: list[dict], path: str):
             row = [record.get(k, "") for k in non_empty_fields]
             writer.writerow(row)
 
-    print(f"Exported {len(clean_records)} records to {path} with {len(non_empty_fields)} columns")
\ No newline at end of file
+    print(f"Exported {len(clean_records)} records to {path} with {len(non_empty_fields)} columns")
+
+
+def export_record_stream_to_csv(make_records: Callable[[], Iterable[dict]], path: str) -> int:
+    """
+    Like export_records_to_csv for more records than fit in memory. make_records is called twice,
+    once to find the non-empty columns and once to write the rows. Returns the number of rows.
+    """
+    fieldnames = list(FIELDS_MAPPING.keys())
+    non_empty = set()
+    for r in make_records():
+        if r.get("crc_valid"):
+            non_empty.update(k for k in fieldnames if r.get(k) not in ("", None))
+    non_empty_fields = [k for k in fieldnames if k in non_empty]
+    if not non_empty_fields:
+        print("No valid records to export.")
+        return 0
+
+    count = 0
+    with open(path, "w", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow([FIELDS_MAPPING[k] for k in non_empty_fields])
+        for r in make_records():
+            if r.get("crc_valid"):
+                writer.writerow([r.get(k, "") for k in non_empty_fields])
+                count += 1
+
+    print(f"Exported {count} records to {path} with {len(non_empty_fields)} columns")
+    return count
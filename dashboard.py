@@ -0,0 +1,375 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import struct
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from device_config import get_device_config, invalidate_device_config
+from history import check_fw_new
+from hotplug import HotplugWatcher
+from mcumgr_wrapper import run_mcumgr_shell_command
+from retry import RetryPolicy
+from telemetry import DEFAULT_INTERVAL, DeviceStream
+from timeseries import STORE, TimeSeriesStore
+
+DEFAULT_PORT = 8080
+HOTPLUG_INTERVAL = 2.0
+# seconds a response is reused for all viewers
+LIVE_TTL = 0.5
+CONFIG_TTL = 30
+AQS_MINUTES = 60
+# samples a slow WebSocket viewer may lag behind before the oldest are dropped
+CLIENT_QUEUE = 100
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# delays between reads of device info that failed, and between restarts of a poller that crashed
+POLLER_POLICY = RetryPolicy(base_delay=1.0, max_delay=30.0)
+
+INDEX_HTML = b"""<!doctype html>
+<html><head><meta charset="utf-8"><title>Atmotube PRO 2</title></head>
+<body><h1>Atmotube PRO 2</h1><pre id="out"></pre>
+<script>
+const latest = {};
+const ws = new WebSocket(`ws://${location.host}/ws`);
+ws.onmessage = (event) => {
+  const sample = JSON.parse(event.data);
+  latest[sample.id] = sample;
+  document.getElementById("out").textContent = JSON.stringify(latest, null, 2);
+};
+</script></body></html>
+"""
+
+
+class ResponseCache:
+    """
+    Serialized responses by key, reused for ttl seconds. Concurrent misses of the same key wait for one
+    producer, so any number of viewers cause at most one device read per key and ttl.
+    """
+
+    def __init__(self):
+        self._entries: dict[str, tuple[float, bytes]] = {}
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def get(self, key: str, ttl: float, produce) -> bytes:
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            body = json.dumps(await produce()).encode()
+            self._entries[key] = (time.monotonic() + ttl, body)
+            future.set_result(body)
+        except BaseException as e:
+            future.set_exception(e)
+            # nobody else may be waiting, do not leave an unretrieved exception behind
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        return body
+
+    def invalidate(self, prefix: str = ""):
+        for key in [k for k in self._entries if k.startswith(prefix)]:
+            del self._entries[key]
+
+
+def device_id(device: str) -> str:
+    """URL-friendly name of a port, ttyACM0 for /dev/ttyACM0, COM3 for COM3."""
+    return os.path.basename(device)
+
+
+def read_device_info(device: str) -> dict:
+    """MAC, firmware and serial number of a device, read once when it attaches."""
+    info = {"id": device_id(device), "device": device, "mac": None, "fw": None, "serial": None}
+    mac, stderr, raw = run_mcumgr_shell_command(device, "mac")
+    if not stderr and mac:
+        info["mac"] = mac
+    fw, stderr, raw = run_mcumgr_shell_command(device, "version app")
+    if not stderr and fw:
+        info["fw"] = fw
+    identity, stderr, raw = run_mcumgr_shell_command(device, "identity")
+    parts = identity.split(" ") if identity and not stderr else []
+    if len(parts) > 4:
+        info["serial"] = parts[4]
+    return info
+
+
+def _ws_frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    length = len(payload)
+    if length < 126:
+        header = struct.pack(">BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def _read_ws_frame(reader: asyncio.StreamReader) -> tuple[int, bytes]:
+    first, second = await reader.readexactly(2)
+    length = second & 0x7f
+    if length == 126:
+        length = struct.unpack(">H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", await reader.readexactly(8))[0]
+    mask = await reader.readexactly(4) if second & 0x80 else b"\0\0\0\0"
+    payload = await reader.readexactly(length)
+    return first & 0x0f, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+
+class Dashboard:
+    """
+    Local HTTP server with the state of every attached device:
+
+        GET /                       minimal page following the WebSocket
+        GET /api/devices            MAC, firmware, serial and latest reading per device
+        GET /api/devices/<id>       one device, <id> is the port name, e.g. ttyACM0
+        GET /api/devices/<id>/live  latest reading
+        GET /api/devices/<id>/config       settings snapshot
+        GET /api/devices/<id>/aqs?minutes=N  AQS readings and min/max/mean of the last N minutes
+        GET /ws                     WebSocket, every new reading as a JSON text message
+
+    Each device is polled by one task regardless of the number of viewers, readings go to the
+    time-series store and the API answers from there. Device info is read once per attach, again until
+    MAC and firmware are known, config snapshots come from the config cache, responses are shared
+    through a ResponseCache. A poller that fails unexpectedly is logged and restarted.
+    """
+
+    def __init__(self, devices: list[str] | None = None, interval: float = DEFAULT_INTERVAL,
+                 store: TimeSeriesStore = STORE):
+        self.fixed_devices = devices
+        self.interval = interval
+        self.store = store
+        self.info: dict[str, dict] = {}          # device id -> info
+        self.cache = ResponseCache()
+        self._pollers: dict[str, asyncio.Task] = {}
+        self._clients: set[asyncio.Queue] = set()
+        self._watcher = HotplugWatcher()
+
+    # devices
+
+    async def _watch_devices(self):
+        if self.fixed_devices is not None:
+            for device in self.fixed_devices:
+                self._attach(device)
+            return
+        while True:
+            attached, detached = await asyncio.to_thread(self._watcher.poll)
+            for device in detached:
+                self._detach(device)
+            for device in attached:
+                self._attach(device)
+            await asyncio.sleep(HOTPLUG_INTERVAL)
+
+    def _attach(self, device: str):
+        self._pollers[device] = asyncio.create_task(self._poll_device(device))
+
+    def _detach(self, device: str):
+        task = self._pollers.pop(device, None)
+        if task:
+            task.cancel()
+        self.info.pop(device_id(device), None)
+        self.store.forget(device)
+        invalidate_device_config(device)
+        self.cache.invalidate(f"/api/devices/{device_id(device)}")
+
+    async def _poll_device(self, device: str):
+        """Poll a device until it detaches, restarting after unexpected errors."""
+        failures = 0
+        while True:
+            try:
+                await self._poll_loop(device)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                print(f"Poller for {device} failed, restarting: {e!r}")
+                await asyncio.sleep(POLLER_POLICY.backoff(failures))
+
+    async def _read_info(self, device: str) -> dict:
+        """Device info, read again until MAC and firmware are known. The firmware picks the PM format."""
+        attempt = 0
+        while True:
+            info = await asyncio.to_thread(read_device_info, device)
+            self.info[info["id"]] = info
+            if info["fw"] is not None and info["mac"] is not None:
+                return info
+            attempt += 1
+            await asyncio.sleep(POLLER_POLICY.backoff(attempt))
+
+    async def _poll_loop(self, device: str):
+        info = await self._read_info(device)
+        stream = DeviceStream(device, self.interval, check_fw_new((3, 0, 17), info["fw"]), info["mac"])
+        while True:
+            await asyncio.sleep(stream.next_delay())
+            sample = await asyncio.to_thread(stream.poll)
+            if sample is None:
+                continue
+            self.store.append(device, sample)
+            sample["id"] = info["id"]
+            self._broadcast(json.dumps(sample).encode())
+
+    def _broadcast(self, message: bytes):
+        for queue in self._clients:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    # API
+
+    def _device_state(self, info: dict) -> dict:
+        return dict(info, latest=self.store.series(info["device"]).latest())
+
+    async def _route(self, path: str, query: dict) -> tuple[int, bytes]:
+        if path == "/api/devices":
+            async def devices():
+                return [self._device_state(info) for info in sorted(self.info.values(), key=lambda i: i["id"])]
+            return 200, await self.cache.get(path, LIVE_TTL, devices)
+
+        parts = path.strip("/").split("/")
+        if len(parts) < 3 or parts[:2] != ["api", "devices"] or parts[2] not in self.info or len(parts) > 4:
+            return 404, b'{"error": "not found"}'
+        info = self.info[parts[2]]
+        device = info["device"]
+        view = parts[3] if len(parts) == 4 else ""
+
+        if view == "":
+            async def state():
+                return self._device_state(info)
+            return 200, await self.cache.get(path, LIVE_TTL, state)
+        if view == "live":
+            async def live():
+                return self.store.series(device).latest()
+            return 200, await self.cache.get(path, LIVE_TTL, live)
+        if view == "config":
+            async def config():
+                snapshot = await asyncio.to_thread(get_device_config, device)
+                return dict(snapshot.to_dict(), complete=snapshot.complete)
+            return 200, await self.cache.get(path, CONFIG_TTL, config)
+        if view == "aqs":
+            try:
+                minutes = float(query.get("minutes", [AQS_MINUTES])[0])
+            except ValueError:
+                return 400, b'{"error": "minutes must be a number"}'
+
+            async def aqs():
+                series = self.store.series(device)
+                times, columns = series.window(minutes * 60)
+                return {"minutes": minutes, "times": times,
+                        "aqs": [None if v != v else v for v in columns["aqs"]],
+                        "stats": series.stats(minutes * 60, ("aqs",)).get("aqs")}
+            return 200, await self.cache.get(f"{path}?minutes={minutes:g}", LIVE_TTL, aqs)
+        return 404, b'{"error": "not found"}'
+
+    # HTTP / WebSocket
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            lines = request.decode("latin-1").split("\r\n")
+            method, target, _ = lines[0].split(" ", 2)
+            headers = {}
+            for line in lines[1:]:
+                if ":" in line:
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+            url = urlsplit(target)
+            path = unquote(url.path)
+            if method != "GET":
+                return await self._respond(writer, 405, b'{"error": "only GET"}')
+            if path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+                return await self._websocket(reader, writer, headers)
+            if path == "/":
+                return await self._respond(writer, 200, INDEX_HTML, "text/html; charset=utf-8")
+            status, body = await self._route(path.rstrip("/"), parse_qs(url.query))
+            await self._respond(writer, status, body)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, body: bytes,
+                       content_type: str = "application/json"):
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}.get(status, "")
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n"
+                     .encode() + body)
+        await writer.drain()
+
+    async def _websocket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, headers: dict):
+        key = headers.get("sec-websocket-key")
+        if not key:
+            return await self._respond(writer, 400, b'{"error": "missing Sec-WebSocket-Key"}')
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        writer.write(f"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                     f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode())
+        queue = asyncio.Queue(maxsize=CLIENT_QUEUE)
+        # start with the latest reading of every device
+        for info in self.info.values():
+            latest = self.store.series(info["device"]).latest()
+            if latest:
+                queue.put_nowait(json.dumps(dict(latest, id=info["id"])).encode())
+        self._clients.add(queue)
+
+        async def receive():
+            while True:
+                opcode, payload = await _read_ws_frame(reader)
+                if opcode == 0x8:
+                    writer.write(_ws_frame(payload[:2], 0x8))
+                    return
+                if opcode == 0x9:
+                    writer.write(_ws_frame(payload, 0xa))
+
+        receiver = asyncio.create_task(receive())
+        try:
+            while not receiver.done():
+                getter = asyncio.create_task(queue.get())
+                await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    break
+                writer.write(_ws_frame(getter.result()))
+                await writer.drain()
+        finally:
+            self._clients.discard(queue)
+            receiver.cancel()
+            if receiver.done() and not receiver.cancelled():
+                receiver.exception()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT, started: asyncio.Future | None = None):
+        server = await asyncio.start_server(self._handle, host, port)
+        watcher = asyncio.create_task(self._watch_devices())
+        if started is not None:
+            started.set_result(server.sockets[0].getsockname()[1])
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+            for task in self._pollers.values():
+                task.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve live readings of the attached Atmotube PRO 2 devices")
+    parser.add_argument("--devices", nargs="*", help="serial ports, default all connected devices as they attach")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="seconds between polls of a device")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    print(f"Dashboard on http://{args.host}:{args.port}/")
+    try:
+        asyncio.run(Dashboard(args.devices, args.interval).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+import zlib
+from array import array
+
+from history import DECODER_VERSION, read_history_file
+
+DEFAULT_CACHE_DIR = os.path.join(os.getcwd(), "cache", "decoded")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+MAGIC = b"ADC1"
+HASH_CHUNK = 1024 * 1024
+COMPRESS_LEVEL = 6
+# downloads are decoded through the cache when set to 1
+CACHE_ENV = "ATMOTUBE_DECODE_CACHE"
+
+_ABSENT = object()
+
+
+def _content_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _column_type(values: list) -> str:
+    kinds = {type(v) for v in values}
+    if kinds == {bool}:
+        return "bool"
+    if kinds == {int}:
+        return "int"
+    if kinds == {float}:
+        return "float"
+    if kinds == {str}:
+        return "str"
+    return "json"
+
+
+def encode_columns(records: list[dict]) -> bytes:
+    """
+    Records as columns: per key a presence map, unless every record has the key, and the present values
+    as a typed array (int, float, bool), NUL separated text or, for mixed columns such as temperature
+    with "" for missing, JSON. The whole is zlib compressed.
+    """
+    names = list(dict.fromkeys(key for record in records for key in record))
+    header = {"count": len(records), "columns": []}
+    blobs = []
+    for name in names:
+        present = bytes(name in record for record in records)
+        values = [record[name] for record in records if name in record]
+        kind = _column_type(values)
+        if kind == "int":
+            low, high = min(values), max(values)
+            typecode = next((code for code in "bhiq" if -2 ** (8 * array(code).itemsize - 1) <= low
+                             and high < 2 ** (8 * array(code).itemsize - 1)), None)
+            kind = f"int:{typecode}" if typecode else "json"
+        if kind.startswith("int:"):
+            data = array(kind[4:], values).tobytes()
+        elif kind == "float":
+            data = array("d", values).tobytes()
+        elif kind == "bool":
+            data = bytes(values)
+        elif kind == "str":
+            data = "\0".join(values).encode()
+        else:
+            data = json.dumps(values).encode()
+        full = len(values) == len(records)
+        header["columns"].append({"name": name, "type": kind, "full": full, "values": len(values), "size": len(data)})
+        blobs.append(data if full else present + data)
+    header_data = json.dumps(header).encode()
+    return MAGIC + zlib.compress(struct.pack("<I", len(header_data)) + header_data + b"".join(blobs), COMPRESS_LEVEL)
+
+
+def decode_columns(data: bytes) -> tuple[int, dict[str, tuple[bytes | None, list]]]:
+    """(record count, {name: (presence map or None when every record has it, values)}) of encode_columns data."""
+    if data[:4] != MAGIC:
+        raise ValueError("not a decode cache entry")
+    body = zlib.decompress(data[4:])
+    header_size = struct.unpack_from("<I", body)[0]
+    header = json.loads(body[4:4 + header_size])
+    count = header["count"]
+    offset = 4 + header_size
+    columns = {}
+    for column in header["columns"]:
+        present = None
+        if not column["full"]:
+            present = body[offset:offset + count]
+            offset += count
+        data = body[offset:offset + column["size"]]
+        offset += column["size"]
+        kind = column["type"]
+        if kind.startswith("int:"):
+            values = array(kind[4:], data).tolist()
+        elif kind == "float":
+            values = array("d", data).tolist()
+        elif kind == "bool":
+            values = [bool(b) for b in data]
+        elif kind == "str":
+            values = data.decode().split("\0") if column["values"] else []
+        else:
+            values = json.loads(data)
+        columns[column["name"]] = (present, values)
+    return count, columns
+
+
+def columns_to_records(count: int, columns: dict[str, tuple[bytes | None, list]]) -> list[dict]:
+    expanded = []
+    for present, values in columns.values():
+        if present is None:
+            expanded.append(values)
+        else:
+            it = iter(values)
+            expanded.append([next(it) if flag else _ABSENT for flag in present])
+    names = list(columns)
+    if not names:
+        return [{} for _ in range(count)]
+    return [{k: v for k, v in zip(names, row) if v is not _ABSENT} for row in zip(*expanded)]
+
+
+class DecodeCache:
+    """
+    Decoded history files on disk, keyed by (content hash, is_new_pm_format, DECODER_VERSION), so
+    exporting the same raw data again skips parsing and a decoder change invalidates old entries.
+    Entries are columnar (see encode_columns); the least recently used ones are removed once the
+    cache grows beyond max_bytes.
+    """
+
+    def __init__(self, root: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def entry_path(self, content_hash: str, is_new_pm_format: bool) -> str:
+        return os.path.join(self.root, f"{content_hash}-{int(is_new_pm_format)}-v{DECODER_VERSION}.adc")
+
+    def read_columns(self, path: str, is_new_pm_format: bool) -> tuple[int, dict]:
+        """Decoded columns of a raw history file, see decode_columns."""
+        entry = self.entry_path(_content_hash(path), is_new_pm_format)
+        try:
+            with open(entry, "rb") as f:
+                data = f.read()
+            result = decode_columns(data)
+            os.utime(entry)   # mtime is the last use
+            self.hits += 1
+            return result
+        except (OSError, ValueError, zlib.error):
+            pass
+        self.misses += 1
+        data = encode_columns(read_history_file(path, is_new_pm_format))
+        tmp_path = f"{entry}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, entry)
+        self.evict()
+        return decode_columns(data)
+
+    def read(self, path: str, is_new_pm_format: bool) -> list[dict]:
+        """Same records as read_history_file, from the cache when this content was decoded before."""
+        return columns_to_records(*self.read_columns(path, is_new_pm_format))
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.root):
+                if not name.endswith(".adc"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.root, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except OSError:
+                    pass
+                total -= size
+
+    def clear(self):
+        with self._lock:
+            for name in os.listdir(self.root):
+                if name.endswith(".adc"):
+                    os.remove(os.path.join(self.root, name))
+
+
+DECODE_CACHE = None
+
+
+def get_decode_cache() -> DecodeCache:
+    global DECODE_CACHE
+    if DECODE_CACHE is None:
+        DECODE_CACHE = DecodeCache()
+    return DECODE_CACHE
+
+
+def cache_enabled() -> bool:
+    return os.environ.get(CACHE_ENV) == "1"
+
+
+def read_history(path: str, is_new_pm_format: bool) -> list[dict]:
+    """read_history_file, through the decode cache when it is enabled."""
+    if cache_enabled():
+        return get_decode_cache().read(path, is_new_pm_format)
+    return read_history_file(path, is_new_pm_format)
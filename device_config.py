@@ -1,6 +1,11 @@
-from mcumgr_wrapper import run_mcumgr_shell_command
+import threading
+import time
+from dataclasses import dataclass, field
 from enum import IntEnum
 
+from mcumgr_wrapper import run_mcumgr_shell_command, run_shell_batch
+from scheduler import PRIORITY_CONFIG
+
 
 class PMState(IntEnum):
     OFF = 0
@@ -51,6 +56,14 @@ class ButtonMode(IntEnum):
         return self.name.replace('_', ' ').title().lower()
 
 
+class VOCMode(IntEnum):
+    OFF = 0
+    ALWAYS_ON = 1
+
+    def __str__(self):
+        return self.name.replace('_', ' ').title().lower()
+
+
 class ButtonPMMode(IntEnum):
     OFF = 0
     ON = 1
@@ -107,98 +120,168 @@ class Button:
         return f"Button Mode: {self.mode} | pm = {self.pm_mode}"
 
 
-def get_pm_status(device: str) -> PmStatus | None:
-    pm_status_str, stderr, raw = run_mcumgr_shell_command(device, "pm status")
-    if stderr:
-        return None
-    try:
-        parts = pm_status_str.strip().split(" ")
+def _parse_pm_status(text: str) -> PmStatus:
+    parts = text.strip().split(" ")
+    return PmStatus(PMState(int(parts[0])), PMMode(int(parts[1])), PMChargingMode(int(parts[2])), parts[3])
 
-        state = PMState(int(parts[0]))
-        mode = PMMode(int(parts[1]))
-        charging = PMChargingMode(int(parts[2]))
-        timer = parts[3]
 
-        result = PmStatus(state, mode, charging, timer)
-        return result
+def _parse_pm_limit(text: str) -> int:
+    return int(text.strip())
 
-    except:
-        return None
 
+def _parse_history_mode(text: str) -> HistoryMode:
+    return HistoryMode(int(text))
 
-def get_pm_limit(device: str) -> int | None:
-    pm_limit, stderr, raw = run_mcumgr_shell_command(device, "pm limit")
-    if stderr:
-        return False
-    try:
-        return int(pm_limit.strip())
-    except:
-        return None
 
+def _parse_interval(text: str) -> Interval:
+    parts = text.strip().split(" ")
+    if len(parts) != 2:
+        raise ValueError(f"Unexpected interval {text!r}")
+    return Interval(int(parts[0]), IntervalMode(int(parts[1])))
 
-def get_history_mode(device: str) -> HistoryMode | None:
-    history_mode_str, stderr, raw = run_mcumgr_shell_command(device, "history mode")
-    if stderr:
+
+def _parse_calibration(text: str) -> CalibrationData:
+    parts = text.split(" ")
+    return CalibrationData(float(parts[0]), float(parts[1]))
+
+
+def _parse_button_mode(text: str) -> Button:
+    parts = text.strip().split(" ")
+    return Button(ButtonMode(int(float(parts[0]))), ButtonPMMode(int(float(parts[1]))))
+
+
+def _parse_voc_mode(text: str) -> VOCMode:
+    return VOCMode(int(text))
+
+
+# shell command -> (DeviceConfig field, parser)
+CONFIG_READS = {
+    "pm status": ("pm_status", _parse_pm_status),
+    "pm limit": ("pm_limit", _parse_pm_limit),
+    "history mode": ("history_mode", _parse_history_mode),
+    "interval": ("interval", _parse_interval),
+    "calibration": ("calibration", _parse_calibration),
+    "button mode": ("button", _parse_button_mode),
+    "voc mode": ("voc_mode", _parse_voc_mode),
+}
+
+
+def _read(device: str, cmd: str):
+    text, stderr, raw = run_mcumgr_shell_command(device, cmd)
+    if stderr or text is None:
         return None
     try:
-        mode = HistoryMode(int(history_mode_str))
-        return mode
-    except:
+        return CONFIG_READS[cmd][1](text)
+    except (ValueError, IndexError, AttributeError):
         return None
 
 
+def get_pm_status(device: str) -> PmStatus | None:
+    return _read(device, "pm status")
+
+
+def get_pm_limit(device: str) -> int | None:
+    return _read(device, "pm limit")
+
+
+def get_history_mode(device: str) -> HistoryMode | None:
+    return _read(device, "history mode")
+
+
 def get_interval(device: str) -> Interval | None:
-    interval_str, stderr, raw = run_mcumgr_shell_command(device, "interval")
-    if stderr:
-        return None
-    try:
-        parts = interval_str.strip().split(" ")
-        if len(parts) != 2:
-            return None
-        interval_seconds = int(parts[0])
-        interval_mode = IntervalMode(int(parts[1]))
-        return Interval(interval_seconds, interval_mode)
-    except:
-        return None
+    return _read(device, "interval")
 
 
 def get_calibration(device: str) -> CalibrationData | None:
-    calibration_data, stderr, raw = run_mcumgr_shell_command(device, "calibration")
-    if stderr:
-        return None
-    try:
-        calibration_data = calibration_data.split(" ")
-        t = float(calibration_data[0])
-        h = float(calibration_data[1])
-        data = CalibrationData(t, h)
-        return data
-    except:
-        return None
+    return _read(device, "calibration")
 
 
 def get_button_mode(device: str) -> Button | None:
-    button_mode_raw, stderr, raw = run_mcumgr_shell_command(device, "button mode")
-    if stderr:
-        return None
-    try:
-        parts = button_mode_raw.strip().split(" ")
-        mode = ButtonMode(int(float(parts[0])))
-        pm_mode = ButtonPMMode(int(float(parts[1])))
+    return _read(device, "button mode")
 
-        button = Button(mode, pm_mode)
-        return button
 
-    except:
-        print("Failed to parse button mode output:", button_mode_raw)
-        return None
+def get_voc_mode(device: str) -> VOCMode | None:
+    return _read(device, "voc mode")
+
+
+@dataclass(slots=True)
+class DeviceConfig:
+    """Snapshot of the readable settings of a device, None for what failed to read."""
+    pm_status: PmStatus | None = None
+    pm_limit: int | None = None
+    history_mode: HistoryMode | None = None
+    interval: Interval | None = None
+    calibration: CalibrationData | None = None
+    button: Button | None = None
+    voc_mode: VOCMode | None = None
+    read_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def complete(self) -> bool:
+        return all(getattr(self, name) is not None for name, _ in CONFIG_READS.values())
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.read_at
+
+    def to_dict(self) -> dict:
+        """Settings as text, None for what failed to read."""
+        return {name: None if getattr(self, name) is None else str(getattr(self, name))
+                for name, _ in CONFIG_READS.values()}
+
+    def __str__(self):
+        return "\n".join([
+            "=" * 60,
+            str(self.pm_status),
+            f"PM limit: {self.pm_limit}",
+            f"History mode: {self.history_mode}",
+            str(self.interval),
+            str(self.calibration),
+            str(self.button),
+            f"VOC mode: {self.voc_mode}",
+            "=" * 60,
+        ])
+
+
+def read_device_config(device: str) -> DeviceConfig:
+    """Read all settings in one batch on the device connection."""
+    values = {}
+    for cmd, (text, stderr, raw) in run_shell_batch(device, list(CONFIG_READS), priority=PRIORITY_CONFIG).items():
+        name, parse = CONFIG_READS[cmd]
+        if stderr or text is None:
+            continue
+        try:
+            values[name] = parse(text)
+        except (ValueError, IndexError, AttributeError):
+            continue
+    return DeviceConfig(**values)
+
+
+# for showing settings; apply_config always reads the device. Callers that change settings or reset
+# the device invalidate the cached snapshot.
+CONFIG_CACHE_TTL = 300
+_CONFIG_CACHE: dict[str, DeviceConfig] = {}
+_CONFIG_CACHE_LOCK = threading.Lock()
+
+
+def get_device_config(device: str, max_age: float = CONFIG_CACHE_TTL) -> DeviceConfig:
+    """Cached DeviceConfig of a device, read again when older than max_age seconds or invalidated."""
+    with _CONFIG_CACHE_LOCK:
+        cached = _CONFIG_CACHE.get(device)
+    if cached is not None and cached.age <= max_age:
+        return cached
+    config = read_device_config(device)
+    # a partial read (device busy or rebooting) is returned but not kept
+    if config.complete:
+        with _CONFIG_CACHE_LOCK:
+            _CONFIG_CACHE[device] = config
+    return config
+
+
+def invalidate_device_config(device: str):
+    with _CONFIG_CACHE_LOCK:
+        _CONFIG_CACHE.pop(device, None)
 
 
 def print_device_config(device):
-    print("=" * 60)
-    print(get_pm_status(device))
-    print(f"PM limit: {get_pm_limit(device)}")
-    print(f"History mode: {get_history_mode(device)}")
-    print(get_interval(device))
-    print(get_calibration(device))
-    print(get_button_mode(device))
-    print("=" * 60)
+    print(get_device_config(device))
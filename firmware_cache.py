@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+
+from ota import SESSION
+
+DEFAULT_CACHE_DIR = os.path.join(os.getcwd(), "fw")
+# a cached version is not asked about again within this many seconds
+REVALIDATE_AFTER = 300
+DOWNLOAD_CHUNK = 64 * 1024
+
+
+class FirmwareCacheError(Exception):
+    pass
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FirmwareCache:
+    """
+    Firmware images stored by content hash, objects/<sha256>.bin, with index.json mapping a version to
+    its hash, source url and the ETag / Last-Modified of the download.
+
+    A cached version is revalidated with a conditional request at most every revalidate_after
+    seconds and used as is when the server is unreachable. Concurrent requests for the same version
+    share one download.
+    """
+
+    def __init__(self, root: str = DEFAULT_CACHE_DIR, session: requests.Session | None = None,
+                 revalidate_after: float = REVALIDATE_AFTER):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.index_path = os.path.join(root, "index.json")
+        self.session = session or SESSION
+        self.revalidate_after = revalidate_after
+        self.downloads = 0   # full downloads, for tests and statistics
+        self._lock = threading.Lock()
+        self._inflight: dict[str, Future] = {}
+        self._checked: dict[str, float] = {}
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, index: dict):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def object_path(self, sha256: str) -> str:
+        return os.path.join(self.objects_dir, f"{sha256}.bin")
+
+    def cached(self, version: str) -> str | None:
+        """Path of a verified cached image of version, without any network access."""
+        with self._lock:
+            entry = self._load_index().get(version)
+        if not entry:
+            return None
+        path = self.object_path(entry["sha256"])
+        if not os.path.exists(path) or file_sha256(path) != entry["sha256"]:
+            return None
+        return path
+
+    def get(self, update_info: dict) -> str:
+        """
+        Path of the image for an OTA answer ({"ver", "url", optionally "sha256"}), downloaded if needed.
+        Raises FirmwareCacheError when there is neither a cached copy nor a verified download.
+        """
+        version = update_info["ver"]
+        with self._lock:
+            future = self._inflight.get(version)
+            owner = future is None
+            if owner:
+                future = self._inflight[version] = Future()
+        if not owner:
+            return future.result()
+        try:
+            future.set_result(self._fetch(update_info))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight.pop(version, None)
+        return future.result()
+
+    def _fetch(self, update_info: dict) -> str:
+        version = update_info["ver"]
+        url = update_info.get("url")
+        expected = (update_info.get("sha256") or "").lower() or None
+        with self._lock:
+            entry = self._load_index().get(version)
+            checked = self._checked.get(version)
+        path = self.cached(version)
+        if path and expected and entry["sha256"] != expected:
+            path = None
+        if path and (not url or checked is not None and time.monotonic() - checked < self.revalidate_after):
+            return path
+        if not url:
+            raise FirmwareCacheError(f"Firmware {version} is not cached and has no download url")
+
+        headers = {}
+        if path and entry.get("url") == url:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            response = self.session.get(url, headers=headers, stream=True, timeout=10)
+            with response:
+                if response.status_code == 304 and path:
+                    with self._lock:
+                        self._checked[version] = time.monotonic()
+                    return path
+                response.raise_for_status()
+                sha256 = self._store(response, expected)
+        except requests.RequestException as e:
+            if path:
+                print(f"Could not revalidate firmware {version}, using the cached copy: {e}")
+                return path
+            raise FirmwareCacheError(f"Failed to download firmware {version}: {e}") from e
+
+        with self._lock:
+            index = self._load_index()
+            index[version] = {"sha256": sha256, "url": url, "etag": response.headers.get("ETag"),
+                              "last_modified": response.headers.get("Last-Modified"),
+                              "size": os.path.getsize(self.object_path(sha256)),
+                              "downloaded": time.strftime("%Y-%m-%d %H:%M:%S")}
+            self._save_index(index)
+            self.downloads += 1
+            self._checked[version] = time.monotonic()
+        return self.object_path(sha256)
+
+    def _store(self, response: requests.Response, expected: str | None) -> str:
+        """Stream the body to a temporary file, verify it and move it to its content address."""
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.objects_dir, f".download-{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            length = response.headers.get("Content-Length")
+            if length is not None and int(length) != size and not response.headers.get("Content-Encoding"):
+                raise FirmwareCacheError(f"Firmware download incomplete: {size} of {length} bytes")
+            sha256 = digest.hexdigest()
+            if expected and sha256 != expected:
+                raise FirmwareCacheError(f"Firmware hash mismatch: got {sha256}, expected {expected}")
+            os.replace(tmp_path, self.object_path(sha256))
+            return sha256
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def prune(self, keep: int = 5):
+        """Drop all but the keep most recently downloaded versions and unreferenced objects."""
+        with self._lock:
+            index = self._load_index()
+            versions = sorted(index, key=lambda v: index[v].get("downloaded", ""), reverse=True)
+            for version in versions[keep:]:
+                del index[version]
+            self._save_index(index)
+            referenced = {entry["sha256"] for entry in index.values()}
+        for name in os.listdir(self.objects_dir):
+            if name.endswith(".bin") and name[:-4] not in referenced:
+                os.remove(os.path.join(self.objects_dir, name))
+
+
+FIRMWARE_CACHE = None
+
+
+def get_firmware_cache() -> FirmwareCache:
+    global FIRMWARE_CACHE
+    if FIRMWARE_CACHE is None:
+        FIRMWARE_CACHE = FirmwareCache()
+    return FIRMWARE_CACHE
@@ -0,0 +1,218 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from device_config import invalidate_device_config
+from hotplug import HotplugWatcher
+from mcumgr_wrapper import UploadProgress, run_mcumgr_image_confirm_command, run_mcumgr_image_state_command, \
+    run_mcumgr_image_upload_command, run_mcumgr_reset_command, run_mcumgr_shell_command
+from retry import REBOOT_POLICY, reset_breaker
+from scheduler import release_device
+
+DEFAULT_PARALLEL = 4
+# the device still answers for a moment after the reset request
+REBOOT_SETTLE = 1.0
+REBOOT_PROBE_TIMEOUT = 1
+# upload progress is printed in steps of this many percent per device
+PROGRESS_STEP = 25
+
+_print_lock = threading.Lock()
+
+
+def _log(device: str, message: str):
+    with _print_lock:
+        print(f"[{device}] {message}")
+
+
+class DeviceUpdateResult:
+    def __init__(self, device: str, target_version: str):
+        self.device = device
+        self.target_version = target_version
+        self.from_version = None
+        self.version = None
+        self.status = "pending"     # updated, up to date or failed
+        self.failed_step = None
+        self.error = ""
+        self.timings: dict[str, float] = {}
+        self.upload_bytes_per_sec = 0.0
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    def __str__(self):
+        total = sum(self.timings.values())
+        detail = f"failed at {self.failed_step}: {self.error}" if self.status == "failed" else \
+            f"{self.from_version} -> {self.version}"
+        return f"{self.device:<20} {self.status:<10} {total:>6.1f}s  {detail}"
+
+
+def wait_for_reboot(device: str) -> str | None:
+    """Poll the device until it answers again after a reset. Returns its firmware version, None on REBOOT_POLICY's deadline."""
+    time.sleep(REBOOT_SETTLE)
+
+    def probe():
+        # the device is expected to be silent for a while, the breaker would only delay noticing it is back
+        reset_breaker(device)
+        release_device(device)
+        return run_mcumgr_shell_command(device, "version app", timeout=REBOOT_PROBE_TIMEOUT)
+
+    version, stderr, raw = REBOOT_POLICY.call(probe, lambda result: bool(result[1]) or not result[0])
+    return None if stderr else version
+
+
+def _find_uploaded_image(images: list[dict], version: str) -> dict | None:
+    candidates = [image for image in images if not image.get("active")]
+    for image in candidates:
+        if str(image.get("version", "")).startswith(version):
+            return image
+    # MCUboot versions can differ from the release name, a single other slot is the upload
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def update_one(device: str, fw_file: str, version: str, progress=None) -> DeviceUpdateResult:
+    """
+    Upload, confirm, reset, wait for the reboot and check the new firmware on one device.
+    Never raises, the outcome is in the returned result.
+    """
+    result = DeviceUpdateResult(device, version)
+    step = None
+    started = time.monotonic()
+
+    def next_step(name: str):
+        nonlocal step, started
+        now = time.monotonic()
+        if step:
+            result.timings[step] = now - started
+        step, started = name, now
+
+    def fail(error: str) -> DeviceUpdateResult:
+        result.failed_step = step
+        next_step(None)
+        result.status = "failed"
+        result.error = error
+        _log(device, f"failed: {error}")
+        return result
+
+    next_step("check")
+    current, stderr, raw = run_mcumgr_shell_command(device, "version app")
+    if stderr:
+        return fail(stderr)
+    result.from_version = current
+    if current and current.startswith(version):
+        next_step(None)
+        result.version = current
+        result.status = "up to date"
+        _log(device, f"already on {current}")
+        return result
+
+    next_step("upload")
+    reported = [0]
+
+    def on_progress(state: UploadProgress):
+        result.upload_bytes_per_sec = state.bytes_per_sec
+        if progress:
+            progress(state)
+        elif state.percent >= reported[0] + PROGRESS_STEP or state.offset == state.total:
+            reported[0] = state.percent - state.percent % PROGRESS_STEP
+            _log(device, f"upload {state}")
+
+    stdout, stderr = run_mcumgr_image_upload_command(device, fw_file, on_progress)
+    if stderr:
+        return fail(stderr)
+
+    next_step("confirm")
+    images, stderr = run_mcumgr_image_state_command(device)
+    if stderr:
+        return fail(stderr)
+    image = _find_uploaded_image(images, version)
+    if image is None or "hash" not in image:
+        return fail(f"uploaded image {version} not found in {[i.get('version') for i in images]}")
+    stdout, stderr = run_mcumgr_image_confirm_command(device, image["hash"].hex())
+    if stderr:
+        return fail(stderr)
+
+    next_step("reset")
+    stdout, stderr = run_mcumgr_reset_command(device)
+    invalidate_device_config(device)
+    if stderr:
+        return fail(stderr)
+
+    next_step("reboot")
+    _log(device, "rebooting")
+    new_version = wait_for_reboot(device)
+    if new_version is None:
+        return fail("device did not come back after the reset")
+
+    next_step("health")
+    result.version = new_version
+    if not new_version.startswith(version):
+        return fail(f"device runs {new_version} after the update, expected {version}")
+    out, stderr, raw = run_mcumgr_shell_command(device, "time", [str(int(time.time()))])
+    if stderr or out != "ok":
+        return fail(f"setting the time failed: {stderr or out}")
+    next_step(None)
+    result.status = "updated"
+    _log(device, f"updated to {new_version}")
+    return result
+
+
+def update_fleet(devices: list[str], fw_file: str, version: str, parallel: int = DEFAULT_PARALLEL,
+                 progress=None) -> list[DeviceUpdateResult]:
+    """Update up to parallel devices at a time, results are in the order of devices."""
+    with ThreadPoolExecutor(max_workers=max(1, parallel), thread_name_prefix="fleet-ota") as executor:
+        return list(executor.map(lambda device: update_one(device, fw_file, version, progress), devices))
+
+
+def write_report(results: list[DeviceUpdateResult], path: str):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                   "devices": [r.to_dict() for r in results]}, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def print_report(results: list[DeviceUpdateResult]):
+    for r in results:
+        print(r)
+    counts = {}
+    for r in results:
+        counts[r.status] = counts.get(r.status, 0) + 1
+    print(", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+
+
+def version_from_filename(path: str) -> str:
+    name = os.path.basename(path)
+    if name.endswith(".bin"):
+        name = name[:-4]
+    return name[3:] if name.startswith("fw_") else name
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update the firmware of many Atmotube PRO 2 devices at once")
+    parser.add_argument("fw_file", help="firmware image, e.g. fw/3.2.1.bin")
+    parser.add_argument("--version", help="expected version after the update, default from the file name")
+    parser.add_argument("--devices", nargs="*", help="serial ports, default all connected devices")
+    parser.add_argument("--parallel", type=int, default=DEFAULT_PARALLEL, help="devices updated at the same time")
+    parser.add_argument("--report", help="write the per-device results as JSON")
+    args = parser.parse_args()
+
+    devices = args.devices or HotplugWatcher().poll()[0]
+    if not devices:
+        print("No devices found.")
+        return
+    version = args.version or version_from_filename(args.fw_file)
+    print(f"Updating {len(devices)} devices to {version}, {args.parallel} at a time")
+    results = update_fleet(devices, args.fw_file, version, args.parallel)
+    print_report(results)
+    if args.report:
+        write_report(results, args.report)
+        print(f"Report written to {args.report}")
+    if any(r.status == "failed" for r in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
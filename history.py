@@ -1,8 +1,11 @@
 import struct
-from datetime import datetime
+from datetime import datetime, timezone
 
 from aqs import calculate_aqs
 
+# bump when parse_history_record changes its output, cached decodes of older versions are not used
+DECODER_VERSION = 1
+
 FIELDS_MAPPING = {
     "timestamp": "Date (UTC+00:00)",
     "aqs": "AQS",
@@ -54,15 +57,24 @@ def check_fw_new(demanded: tuple[int, int, int], fw: str | None) -> bool:
     return is_new
 
 
+def _crc8_maxim_byte(crc: int) -> int:
+    for _ in range(8):
+        if crc & 0x80:
+            crc = ((crc << 1) ^ 0x31) & 0xFF
+        else:
+            crc = (crc << 1) & 0xFF
+    return crc
+
+
+# CRC of every byte value, so each input byte costs one lookup instead of 8 shifts
+CRC8_MAXIM_TABLE = bytes(_crc8_maxim_byte(i) for i in range(256))
+
+
 def compute_crc8_maxim(data: bytes) -> int:
     crc = 0x00
+    table = CRC8_MAXIM_TABLE
     for byte in data:
-        crc ^= byte
-        for _ in range(8):
-            if crc & 0x80:
-                crc = ((crc << 1) ^ 0x31) & 0xFF
-            else:
-                crc = (crc << 1) & 0xFF
+        crc = table[crc ^ byte]
     return crc
 
 
@@ -83,7 +95,9 @@ def read_history_file(path: str, is_new_pm_format: bool):
     offset = 0
     while offset < len(raw):
         try:
-            record = parse_history_record(raw[offset:], is_new_pm_format)
+            # only the record itself, slicing off the whole rest made reading a file quadratic
+            record = parse_history_record(raw[offset:offset + record_length(raw[offset + 1])]
+                                          if offset + 1 < len(raw) else raw[offset:], is_new_pm_format)
             records.append(record)
             offset += record["_total_length"]
         except Exception as e:
@@ -101,6 +115,17 @@ PM_EXT_BIT = 0b00001000
 GPS_BIT = 0b00010000
 GPS_EXT_BIT = 0b00100000
 
+# bytes of each optional section, in the order they follow the core data
+SECTION_SIZES = ((VOC_BIT, 6), (CO2_BIT, 2), (PM_BIT, 6), (GPS_BIT, 8), (PM_EXT_BIT, 10), (GPS_EXT_BIT, 10))
+# header (2) + core data (14) + CRC (1)
+MIN_RECORD_LENGTH = 17
+
+
+def record_length(packet_type: int) -> int:
+    """Total length of a record, CRC included, from the section bits of its packet type."""
+    return MIN_RECORD_LENGTH + sum(size for bit, size in SECTION_SIZES if packet_type & bit)
+
+
 PM_ENCODING_FLAG = 0x8000
 PM_ENCODING_VALUE_MASK = 0x7FFF
 
@@ -115,7 +140,7 @@ def decode_pm_value(raw: int) -> float:
 
 
 def parse_history_record(data: bytes, is_new_pm_format: bool = False) -> dict:
-    if len(data) < 18:
+    if len(data) < MIN_RECORD_LENGTH:
         raise ValueError("Data too short to contain required fields")
 
     record = {}
@@ -244,3 +269,75 @@ def parse_history_record(data: bytes, is_new_pm_format: bool = False) -> dict:
     record["charging"] = "yes" if (record["error_flags"] & 0x4000) != 0 else "no"
     record["motion"] = "yes" if (record["error_flags"] & 0x1000) != 0 else "no"
     return record
+
+
+def encode_pm_value(value: float) -> int:
+    """Inverse of decode_pm_value, 0.1 precision while it fits in 15 bits, whole numbers above."""
+    tenths = round(value * 10)
+    if tenths <= PM_ENCODING_VALUE_MASK:
+        return tenths
+    return PM_ENCODING_FLAG | min(round(value), PM_ENCODING_VALUE_MASK)
+
+
+def _encode_timestamp(value) -> int:
+    if isinstance(value, str):
+        return int(datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp())
+    return int(value)
+
+
+def encode_history_record(record: dict, is_new_pm_format: bool = False, packet_type: int | None = None) -> bytes:
+    """
+    Build the binary form of a history record, the inverse of parse_history_record.
+
+    Takes the keys parse_history_record returns, "timestamp" may also be a unix time. Missing
+    temperature, humidity or pressure ("" or None) are written as their "not available" values.
+    packet_type defaults to record["packet_type"]. "voc_ppb" takes precedence over the rounded
+    "voc_ppm" when present.
+    """
+    if packet_type is None:
+        packet_type = record["packet_type"]
+
+    temp = record.get("temperature_c")
+    hum = record.get("humidity_percent")
+    pressure = record.get("pressure_mbar")
+    data = struct.pack(
+        "<BBIhBIBH",
+        record.get("history_type", 1),
+        packet_type,
+        _encode_timestamp(record["timestamp"]),
+        -1 if temp in ("", None) else round(temp * 100),
+        0xFF if hum in ("", None) else hum,
+        0xFFFFFFFF if pressure in ("", None) else round(pressure * 10),
+        record.get("battery_percent", 0),
+        record.get("error_flags", 0)
+    )
+
+    if packet_type & VOC_BIT:
+        voc_ppb = record.get("voc_ppb")
+        if voc_ppb is None:
+            voc_ppb = round(record["voc_ppm"] * 1000)
+        data += struct.pack("<HHH", record["voc_index"], voc_ppb, record["nox_index"])
+
+    if packet_type & CO2_BIT:
+        data += struct.pack("<H", record["co2_ppm"])
+
+    if packet_type & PM_BIT:
+        pm = (record["pm1_ug_m3"], record["pm25_ug_m3"], record["pm10_ug_m3"])
+        if is_new_pm_format:
+            data += struct.pack("<HHH", *(encode_pm_value(v) for v in pm))
+        else:
+            data += struct.pack("<HHH", *(round(v * 10) for v in pm))
+
+    if packet_type & GPS_BIT:
+        data += struct.pack("<ii", round(record["latitude"] * 1e6), round(record["longitude"] * 1e6))
+
+    if packet_type & PM_EXT_BIT:
+        data += struct.pack("<HHHHH", record["pm0.5_particles"], record["pm1.0_particles"],
+                            record["pm2.5_particles"], record["pm10.0_particles"], record["particle_size_nm"])
+
+    if packet_type & GPS_EXT_BIT:
+        data += struct.pack("<BBBBhBBh", record["gnss_snr0_19"], record["gnss_snr20_49"], record["gnss_snr50_99"],
+                            record["gnss_snr_avg"], record["altitude_m"], record["satellites_fixed"],
+                            record["satellites_in_view"], record["position_error_m"])
+
+    return data + bytes([compute_crc8_maxim(data)])
@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import struct
+import zlib
+from datetime import datetime, timezone
+from typing import Iterator
+
+from csv_export import export_record_stream_to_csv
+from history import MIN_RECORD_LENGTH, parse_history_record, record_length
+
+# raw bytes per block, a time range query inflates at most this much beyond the records it needs
+BLOCK_SIZE = 64 * 1024
+COMPRESS_LEVEL = 6
+# raw history downloads are archived when set to 1
+ARCHIVE_ENV = "ATMOTUBE_ARCHIVE"
+
+
+def archive_enabled() -> bool:
+    return os.environ.get(ARCHIVE_ENV) == "1"
+
+
+def _to_epoch(value) -> int | None:
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return int(datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp())
+
+
+def record_spans(raw: bytes) -> Iterator[tuple[int, int, int]]:
+    """(offset, length, timestamp) of the complete records of raw history."""
+    offset = 0
+    while offset + MIN_RECORD_LENGTH <= len(raw):
+        length = record_length(raw[offset + 1])
+        if offset + length > len(raw):
+            return
+        yield offset, length, struct.unpack_from("<I", raw, offset + 2)[0]
+        offset += length
+
+
+def _key(raw: bytes, offset: int, length: int, ts: int) -> tuple:
+    # the identity history_merge.record_key gives a decoded record: timestamp, packet type, CRC
+    return ts, raw[offset + 1], raw[offset + length - 1]
+
+
+def split_blocks(raw: bytes, block_size: int = BLOCK_SIZE) -> Iterator[tuple[bytes, int, int | None, int | None]]:
+    """
+    Cut raw history into (data, records, first timestamp, last timestamp) blocks of about block_size at
+    record boundaries. Bytes after a truncated record go into the last block as they are.
+    """
+    start = 0
+    count = 0
+    low = high = None
+    for offset, length, ts in record_spans(raw):
+        low = ts if low is None else min(low, ts)
+        high = ts if high is None else max(high, ts)
+        count += 1
+        if offset + length - start >= block_size:
+            yield raw[start:offset + length], count, low, high
+            start, count, low, high = offset + length, 0, None, None
+    if start < len(raw):
+        yield raw[start:], count, low, high
+
+
+class HistoryArchive:
+    """
+    Raw history kept compressed, as a series of independent gzip members, so "gzip -dc" restores the
+    raw bytes and any block can be inflated on its own. The index next to it (<path>.idx) lists per
+    block the file offset and size, the record count, the timestamp range and the PM format needed
+    to decode it, so a time range query only inflates the blocks that overlap it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + ".idx"
+        try:
+            with open(self.index_path) as f:
+                self.blocks: list[dict] = json.load(f)["blocks"]
+        except (OSError, ValueError, KeyError):
+            self.blocks = []
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": 1, "blocks": self.blocks}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _new_data(self, raw: bytes) -> bytes:
+        """
+        The complete records of raw the archive does not hold yet, found in the blocks of the same time
+        range. A truncated record at the end is left out, it is archived once a download has all of it.
+        """
+        spans = list(record_spans(raw))
+        if not spans:
+            return b""
+        end = spans[-1][0] + spans[-1][1]
+        if not self.blocks:
+            return raw[:end]
+        archived = set()
+        with open(self.path, "rb") as f:
+            for block in self.blocks_between(min(s[2] for s in spans), max(s[2] for s in spans)):
+                data = self.read_block(block, f)
+                archived.update(_key(data, *span) for span in record_spans(data))
+        if not archived:
+            return raw[:end]
+        return b"".join(raw[offset:offset + length] for offset, length, ts in spans
+                        if _key(raw, offset, length, ts) not in archived)
+
+    def append(self, raw: bytes, is_new_pm_format: bool, source: str | None = None) -> int:
+        """
+        Compress raw history onto the end of the archive. Records already archived and a truncated
+        record at the end are skipped, so archiving a file again, or a file that grew since, only adds
+        what is new. Returns the number of blocks written.
+        """
+        raw = self._new_data(raw)
+        if not raw:
+            return 0
+        written = []
+        with open(self.path, "ab") as f:
+            offset = f.tell()
+            for data, records, low, high in split_blocks(raw):
+                compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+                member = compressor.compress(data) + compressor.flush()
+                f.write(member)
+                written.append({"offset": offset, "size": len(member), "raw_size": len(data), "records": records,
+                                "first": low, "last": high, "new_pm": is_new_pm_format, "source": source})
+                offset += len(member)
+        # the index is only replaced once the data is on disk, a crash leaves unindexed bytes, not a bad index
+        self.blocks.extend(written)
+        self._save_index()
+        return len(written)
+
+    def append_file(self, path: str, is_new_pm_format: bool) -> int:
+        with open(path, "rb") as f:
+            return self.append(f.read(), is_new_pm_format, os.path.basename(path))
+
+    def blocks_between(self, start=None, end=None) -> list[dict]:
+        """Blocks that may hold records from start to end (unix times or "YYYY-mm-dd HH:MM:SS", inclusive)."""
+        start, end = _to_epoch(start), _to_epoch(end)
+        return [block for block in self.blocks if block["first"] is not None
+                and (start is None or block["last"] >= start) and (end is None or block["first"] <= end)]
+
+    def read_block(self, block: dict, f=None) -> bytes:
+        if f is None:
+            with open(self.path, "rb") as f:
+                return self.read_block(block, f)
+        f.seek(block["offset"])
+        return zlib.decompress(f.read(block["size"]), 31)
+
+    def records(self, start=None, end=None) -> Iterator[dict]:
+        """Decoded records from start to end, inflating only the blocks that overlap the range."""
+        low, high = _to_epoch(start), _to_epoch(end)
+        with open(self.path, "rb") as f:
+            for block in self.blocks_between(start, end):
+                data = self.read_block(block, f)
+                offset = 0
+                for _ in range(block["records"]):
+                    length = record_length(data[offset + 1])
+                    ts = struct.unpack_from("<I", data, offset + 2)[0]
+                    if (low is None or ts >= low) and (high is None or ts <= high):
+                        yield parse_history_record(data[offset:offset + length], block["new_pm"])
+                    offset += length
+
+    def raw(self) -> bytes:
+        """All archived bytes, as downloaded."""
+        with open(self.path, "rb") as f:
+            return b"".join(self.read_block(block, f) for block in self.blocks)
+
+    def summary(self) -> dict:
+        timed = [block for block in self.blocks if block["first"] is not None]
+        raw_size = sum(block["raw_size"] for block in self.blocks)
+        size = sum(block["size"] for block in self.blocks)
+        fmt = "%Y-%m-%d %H:%M:%S"
+        return {
+            "blocks": len(self.blocks),
+            "records": sum(block["records"] for block in self.blocks),
+            "raw_bytes": raw_size,
+            "compressed_bytes": size,
+            "ratio": round(raw_size / size, 2) if size else None,
+            "first": datetime.fromtimestamp(min(b["first"] for b in timed), timezone.utc).strftime(fmt) if timed else None,
+            "last": datetime.fromtimestamp(max(b["last"] for b in timed), timezone.utc).strftime(fmt) if timed else None,
+        }
+
+
+def archive_path(mac_dir: str, mac: str) -> str:
+    return os.path.join(mac_dir, f"{mac}_history.gz")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compressed archive of raw Atmotube history files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="append raw history files")
+    add.add_argument("archive")
+    add.add_argument("files", nargs="+")
+    add.add_argument("--old-pm-format", action="store_true", help="files are from firmware before 3.0.17")
+    info = commands.add_parser("info", help="print blocks, records and time span")
+    info.add_argument("archive")
+    export = commands.add_parser("export", help="decode a time range to CSV")
+    export.add_argument("archive")
+    export.add_argument("--output", required=True)
+    export.add_argument("--start", help='"YYYY-mm-dd HH:MM:SS" UTC')
+    export.add_argument("--end", help='"YYYY-mm-dd HH:MM:SS" UTC')
+    args = parser.parse_args()
+
+    archive = HistoryArchive(args.archive)
+    if args.command == "add":
+        for path in args.files:
+            blocks = archive.append_file(path, not args.old_pm_format)
+            print(f"{path}: {blocks} blocks")
+    elif args.command == "info":
+        print(json.dumps(archive.summary(), indent=2))
+    else:
+        export_record_stream_to_csv(lambda: archive.records(args.start, args.end), args.output)
+
+
+if __name__ == "__main__":
+    main()
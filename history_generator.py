@@ -0,0 +1,246 @@
+import argparse
+import random
+import struct
+import time
+from datetime import datetime, timezone
+
+from history import compute_crc8_maxim, encode_history_record, parse_history_record, round_voc, CRC8_MAXIM_TABLE, \
+    VOC_BIT, CO2_BIT, PM_BIT, PM_EXT_BIT, GPS_BIT, GPS_EXT_BIT
+
+ALL_BITS = VOC_BIT | CO2_BIT | PM_BIT | PM_EXT_BIT | GPS_BIT | GPS_EXT_BIT
+
+# packet types the firmware writes for each history mode
+LAYOUTS = {
+    "core": 0,
+    "default": VOC_BIT | CO2_BIT | PM_BIT,
+    "ext_pm": VOC_BIT | CO2_BIT | PM_BIT | PM_EXT_BIT,
+    "ext_gps": VOC_BIT | CO2_BIT | PM_BIT | GPS_BIT | GPS_EXT_BIT,
+    "ext_pm_gps": ALL_BITS,
+}
+
+# distinct records per packet type, records are copies of these with a new timestamp and CRC
+POOL_SIZE = 512
+WRITE_BUFFER = 4 * 1024 * 1024
+
+
+def synthetic_record(ts: int, packet_type: int, rng: random.Random, high_pm_rate: float = 0.0) -> dict:
+    """Plausible sensor values for every field of packet_type. high_pm_rate is the share of
+    PM readings above 3276.7 µg/m³, which need the integer PM encoding of newer firmware."""
+    record = {
+        "history_type": 1,
+        "packet_type": packet_type,
+        "timestamp": ts,
+        "temperature_c": "" if rng.random() < 0.01 else round(rng.uniform(-20, 45), 1),
+        "humidity_percent": "" if rng.random() < 0.01 else rng.randint(5, 100),
+        "pressure_mbar": "" if rng.random() < 0.01 else round(rng.uniform(950, 1050), 1),
+        "battery_percent": rng.randint(0, 100),
+        "error_flags": rng.choice((0, 0, 0, 0x1000, 0x4000, 0x5000)),
+    }
+    if packet_type & VOC_BIT:
+        record.update({"voc_index": rng.randint(1, 500), "voc_ppb": rng.randint(0, 3000),
+                       "nox_index": rng.randint(1, 500)})
+    if packet_type & CO2_BIT:
+        record["co2_ppm"] = rng.randint(400, 5000)
+    if packet_type & PM_BIT:
+        high = rng.random() < high_pm_rate
+        if high:
+            pm1 = float(rng.randint(3300, 20000))
+            pm = (pm1, float(round(pm1 * 1.2)), float(round(pm1 * 1.5)))
+        else:
+            pm1 = round(rng.uniform(0, 150), 1)
+            pm = (pm1, round(pm1 * 1.3, 1), round(pm1 * 1.6, 1))
+        record.update({"pm1_ug_m3": pm[0], "pm25_ug_m3": pm[1], "pm10_ug_m3": pm[2]})
+    if packet_type & GPS_BIT:
+        record.update({"latitude": round(rng.uniform(-90, 90), 6), "longitude": round(rng.uniform(-180, 180), 6)})
+    if packet_type & PM_EXT_BIT:
+        record.update({"pm0.5_particles": rng.randint(0, 65535), "pm1.0_particles": rng.randint(0, 65535),
+                       "pm2.5_particles": rng.randint(0, 65535), "pm10.0_particles": rng.randint(0, 65535),
+                       "particle_size_nm": rng.randint(300, 2500)})
+    if packet_type & GPS_EXT_BIT:
+        record.update({"gnss_snr0_19": rng.randint(0, 20), "gnss_snr20_49": rng.randint(0, 20),
+                       "gnss_snr50_99": rng.randint(0, 20), "gnss_snr_avg": rng.randint(0, 60),
+                       "altitude_m": rng.randint(-400, 8000), "satellites_fixed": rng.randint(0, 20),
+                       "satellites_in_view": rng.randint(0, 40), "position_error_m": rng.randint(0, 500)})
+    return record
+
+
+def parse_mix(text: str) -> dict[int, float]:
+    """"default=0.7,ext_pm_gps=0.3", layout names or packet type numbers. "all" spreads evenly over all 64 types."""
+    if text == "all":
+        return {packet_type: 1.0 for packet_type in range(ALL_BITS + 1)}
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        packet_type = LAYOUTS[name] if name in LAYOUTS else int(name, 0)
+        mix[packet_type] = float(weight or 1)
+    return mix
+
+
+def parse_size(text: str) -> int:
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    if text[-1].upper() in units:
+        return int(float(text[:-1]) * units[text[-1].upper()])
+    return int(text)
+
+
+class ArchiveStats:
+    def __init__(self):
+        self.records = 0
+        self.bytes = 0
+        self.corrupted = 0
+        self.truncated = False
+        self.layouts: dict[int, int] = {}
+
+    def __str__(self):
+        layouts = ", ".join(f"0x{k:02x}: {v}" for k, v in sorted(self.layouts.items()))
+        return (f"{self.records} records, {self.bytes} bytes, {self.corrupted} corrupted"
+                f"{', last record truncated' if self.truncated else ''} | layouts {layouts}")
+
+
+def generate_records(count: int | None = None, size: int | None = None, mix: dict[int, float] | None = None,
+                     start: int = 1_700_000_000, interval: int = 60, is_new_pm_format: bool = True,
+                     corrupt_rate: float = 0.0, high_pm_rate: float = 0.01, seed: int = 0,
+                     stats: ArchiveStats | None = None):
+    """
+    Yield encoded records until count records or size bytes were produced.
+
+    Each packet type in mix (type -> weight) gets a pool of distinct records which are reused with
+    increasing timestamps. A corrupt_rate share of records gets one flipped bit after the packet type,
+    which the CRC catches without changing the record length.
+    """
+    rng = random.Random(seed)
+    mix = mix or {LAYOUTS["default"]: 1.0}
+    stats = stats if stats is not None else ArchiveStats()
+    types = list(mix)
+    weights = [mix[t] for t in types]
+    pools = {t: [bytearray(encode_history_record(synthetic_record(start, t, rng, high_pm_rate), is_new_pm_format))
+                 for _ in range(POOL_SIZE)] for t in types}
+    table = CRC8_MAXIM_TABLE
+    pack_into = struct.pack_into
+
+    # draw the layouts in batches, random.choices per record is slow
+    batch = []
+    n = 0
+    ts = start
+    while (count is None or n < count) and (size is None or stats.bytes < size):
+        if not batch:
+            batch = rng.choices(types, weights, k=4096)
+        packet_type = batch.pop()
+        record = bytearray(pools[packet_type][n % POOL_SIZE])
+        pack_into("<I", record, 2, ts)
+        crc = 0
+        for byte in memoryview(record)[:-1]:
+            crc = table[crc ^ byte]
+        record[-1] = crc
+        if corrupt_rate and rng.random() < corrupt_rate:
+            index = rng.randrange(2, len(record))
+            record[index] ^= 1 << rng.randrange(8)
+            stats.corrupted += 1
+        stats.records += 1
+        stats.bytes += len(record)
+        stats.layouts[packet_type] = stats.layouts.get(packet_type, 0) + 1
+        n += 1
+        ts += interval
+        yield bytes(record)
+
+
+def write_archive(path: str, count: int | None = None, size: int | None = None, truncate: bool = False,
+                  **kwargs) -> ArchiveStats:
+    """Write a synthetic history file, see generate_records for the options. With truncate the
+    last record is cut in half like a file copied while the device was writing it."""
+    stats = ArchiveStats()
+    buffer = bytearray()
+    last = b""
+    with open(path, "wb") as f:
+        for record in generate_records(count, size, stats=stats, **kwargs):
+            if last:
+                buffer += last
+            last = record
+            if len(buffer) >= WRITE_BUFFER:
+                f.write(buffer)
+                buffer.clear()
+        if last and truncate:
+            # the cut record is neither valid nor corrupted, it only shows up as truncated
+            stats.records -= 1
+            stats.layouts[last[1]] -= 1
+            if not stats.layouts[last[1]]:
+                del stats.layouts[last[1]]
+            if compute_crc8_maxim(last[:-1]) != last[-1]:
+                stats.corrupted -= 1
+            kept = len(last) // 2
+            stats.bytes -= len(last) - kept
+            last = last[:kept]
+            stats.truncated = True
+        f.write(buffer + last)
+    return stats
+
+
+def _round_trip_mismatches(source: dict, parsed: dict) -> list[str]:
+    expected = dict(source)
+    expected["timestamp"] = datetime.fromtimestamp(source["timestamp"], timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    if "voc_ppb" in expected:
+        expected["voc_ppm"] = round_voc(expected.pop("voc_ppb") / 1000)
+    mismatches = []
+    for key, value in expected.items():
+        actual = parsed.get(key)
+        if isinstance(value, float) and isinstance(actual, float):
+            if abs(value - actual) > 1e-9:
+                mismatches.append(f"{key}: {value} != {actual}")
+        elif value != actual:
+            mismatches.append(f"{key}: {value!r} != {actual!r}")
+    return mismatches
+
+
+def round_trip_check(per_type: int = 50, seed: int = 0) -> int:
+    """Encode and parse random records of all 64 packet types in both PM formats and compare the
+    decoded fields with the source. Returns the number of mismatching records, which are printed."""
+    rng = random.Random(seed)
+    failures = 0
+    for is_new_pm_format in (False, True):
+        high_pm_rate = 0.3 if is_new_pm_format else 0.0
+        for packet_type in range(ALL_BITS + 1):
+            for _ in range(per_type):
+                source = synthetic_record(rng.randint(0, 2 ** 31), packet_type, rng, high_pm_rate)
+                encoded = encode_history_record(source, is_new_pm_format)
+                parsed = parse_history_record(encoded, is_new_pm_format)
+                mismatches = _round_trip_mismatches(source, parsed)
+                if not parsed["crc_valid"] or parsed["_total_length"] != len(encoded):
+                    mismatches.append("CRC or length")
+                if mismatches:
+                    failures += 1
+                    print(f"Round trip mismatch for packet type 0x{packet_type:02x}: {', '.join(mismatches)}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic Atmotube PRO 2 history archives")
+    parser.add_argument("output", nargs="?", help="archive file to write")
+    parser.add_argument("--size", type=parse_size, help="archive size, e.g. 500M or 2G")
+    parser.add_argument("--records", type=int, help="number of records")
+    parser.add_argument("--mix", default="default", help='layout weights, e.g. "default=0.7,ext_pm_gps=0.3" or "all"')
+    parser.add_argument("--old-pm-format", action="store_true", help="PM encoding of firmware before 3.0.17")
+    parser.add_argument("--high-pm-rate", type=float, default=0.01, help="share of PM values needing integer encoding")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="share of records with a flipped bit")
+    parser.add_argument("--truncate", action="store_true", help="cut the last record in half")
+    parser.add_argument("--interval", type=int, default=60, help="seconds between records")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verify", action="store_true", help="run the encoder/decoder round trip check")
+    args = parser.parse_args()
+
+    if args.verify:
+        failures = round_trip_check(seed=args.seed)
+        print(f"Round trip check: {failures} mismatches")
+        raise SystemExit(1 if failures else 0)
+    if not args.output or (args.size is None and args.records is None):
+        parser.error("output and --size or --records are required")
+
+    started = time.perf_counter()
+    stats = write_archive(args.output, args.records, args.size, args.truncate, mix=parse_mix(args.mix),
+                          interval=args.interval, is_new_pm_format=not args.old_pm_format,
+                          corrupt_rate=args.corrupt, high_pm_rate=args.high_pm_rate, seed=args.seed)
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {args.output}: {stats} in {elapsed:.1f}s ({stats.bytes / elapsed / 1e6:.1f} MB/s)")
+
+
+if __name__ == "__main__":
+    main()
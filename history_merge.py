@@ -0,0 +1,110 @@
+import argparse
+import csv
+import heapq
+import os
+from typing import Iterable, Iterator
+
+from csv_export import export_record_stream_to_csv
+from history import FIELDS_MAPPING, parse_history_record, record_length
+
+_KEYS_BY_HEADER = {header: key for key, header in FIELDS_MAPPING.items()}
+
+
+def iter_history_file(path: str, is_new_pm_format: bool) -> Iterator[dict]:
+    """Records of a raw history file, read one at a time. Stops at a truncated or unparsable record."""
+    with open(path, "rb") as f:
+        offset = 0
+        while True:
+            header = f.read(2)
+            if len(header) < 2:
+                return
+            length = record_length(header[1])
+            data = header + f.read(length - 2)
+            try:
+                if len(data) < length:
+                    raise ValueError(f"truncated record, {len(data)} of {length} bytes")
+                yield parse_history_record(data, is_new_pm_format)
+            except Exception as e:
+                print(f"Failed to parse record at offset {offset} of {path}: {e}")
+                return
+            offset += len(data)
+
+
+def iter_csv_records(path: str) -> Iterator[dict]:
+    """Rows of a CSV written by export_records_to_csv as record dicts, values as text."""
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header:
+            return
+        keys = [_KEYS_BY_HEADER.get(name, name) for name in header]
+        for row in reader:
+            record = dict(zip(keys, row))
+            # only CRC-valid records are exported
+            record["crc_valid"] = True
+            yield record
+
+
+def iter_records(path: str, is_new_pm_format: bool) -> Iterator[dict]:
+    if path.lower().endswith(".csv"):
+        return iter_csv_records(path)
+    return iter_history_file(path, is_new_pm_format)
+
+
+def record_key(record: dict) -> tuple:
+    """
+    Identity of a reading, (timestamp, packet_type, CRC). CSV rows have neither and are compared by all
+    their values, so a CSV row and the raw record it came from are not recognized as duplicates.
+    """
+    if "crc" in record:
+        return record["timestamp"], record.get("packet_type"), record["crc"]
+    return record["timestamp"], tuple(sorted((k, str(v)) for k, v in record.items()))
+
+
+def merge_records(streams: Iterable[Iterable[dict]], dedupe: bool = True) -> Iterator[dict]:
+    """
+    Lazily merge record streams, each in time order, into one stream in time order.
+
+    heapq.merge holds one record per input, and since duplicates share a timestamp only the keys of
+    the current timestamp are remembered, so memory does not grow with the length of the inputs.
+    Of records with the same record_key the first one is kept.
+    """
+    current = None
+    seen = set()
+    for record in heapq.merge(*streams, key=lambda r: r["timestamp"]):
+        if not dedupe:
+            yield record
+            continue
+        if record["timestamp"] != current:
+            current = record["timestamp"]
+            seen.clear()
+        key = record_key(record)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield record
+
+
+def merge_history_files(paths: list[str], is_new_pm_format: bool, dedupe: bool = True) -> Iterator[dict]:
+    """Merged records of raw history files and exported CSVs of one device."""
+    return merge_records([iter_records(path, is_new_pm_format) for path in paths], dedupe)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge history files of one device into one time ordered CSV")
+    parser.add_argument("files", nargs="+", help="raw history files or CSV exports")
+    parser.add_argument("--output", required=True, help="CSV file to write")
+    parser.add_argument("--old-pm-format", action="store_true", help="raw files are from firmware before 3.0.17")
+    parser.add_argument("--keep-duplicates", action="store_true")
+    args = parser.parse_args()
+
+    missing = [path for path in args.files if not os.path.exists(path)]
+    if missing:
+        parser.error(f"not found: {', '.join(missing)}")
+    # the merge is cheap to repeat, the second pass writes while the first only finds the used columns
+    export_record_stream_to_csv(
+        lambda: merge_history_files(args.files, not args.old_pm_format, not args.keep_duplicates), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from history import CRC8_MAXIM_TABLE, record_length
+
+_LENGTHS = [record_length(packet_type) for packet_type in range(256)]
+# below this many records of one layout in a row, a plain table lookup per byte is faster than by column
+SHORT_RUN = 4
+
+
+@lru_cache(maxsize=None)
+def _position_tables(length: int) -> tuple[bytes, ...]:
+    """
+    Per byte position of a record of length bytes, the CRC contribution of every byte value there.
+
+    The CRC-8 starts at 0 and is linear, so the CRC of a record is the XOR of the contributions of its
+    bytes: a byte's own table entry, carried through the zero bytes that follow it.
+    """
+    tables = [CRC8_MAXIM_TABLE]
+    while len(tables) < length - 1:
+        tables.append(tables[-1].translate(CRC8_MAXIM_TABLE))
+    return tuple(reversed(tables))
+
+
+def _run_crc_failures(run: bytes, length: int) -> bytes:
+    """For a run of records of the same length, one byte per record, 0 where the CRC matches."""
+    count = len(run) // length
+    if count < SHORT_RUN:
+        table = CRC8_MAXIM_TABLE
+        failures = bytearray(count)
+        for start in range(0, len(run), length):
+            crc = 0
+            for byte in run[start:start + length - 1]:
+                crc = table[crc ^ byte]
+            failures[start // length] = crc ^ run[start + length - 1]
+        return bytes(failures)
+    crc = 0
+    for position, table in enumerate(_position_tables(length)):
+        crc ^= int.from_bytes(run[position::length].translate(table), "little")
+    crc ^= int.from_bytes(run[length - 1::length], "little")
+    return crc.to_bytes(count, "little")
+
+
+class ScanResult:
+    def __init__(self, path: str):
+        self.path = path
+        self.bytes = 0
+        self.records = 0
+        self.crc_failures = 0
+        self.layouts: dict[int, int] = {}
+        self.first = None
+        self.last = None
+        self.truncated = False
+        self.trailing_bytes = 0
+        self.seconds = 0.0
+        self.error = ""
+
+    @property
+    def failure_rate(self) -> float:
+        return self.crc_failures / self.records if self.records else 0.0
+
+    @property
+    def damaged(self) -> bool:
+        return bool(self.crc_failures or self.truncated or self.error)
+
+    def to_dict(self) -> dict:
+        fmt = "%Y-%m-%d %H:%M:%S"
+        result = dict(self.__dict__)
+        result["layouts"] = {str(k): v for k, v in sorted(self.layouts.items())}
+        result["first"] = datetime.fromtimestamp(self.first, timezone.utc).strftime(fmt) if self.first else None
+        result["last"] = datetime.fromtimestamp(self.last, timezone.utc).strftime(fmt) if self.last else None
+        result["failure_rate"] = round(self.failure_rate, 6)
+        result["damaged"] = self.damaged
+        return result
+
+    def __str__(self):
+        if self.error:
+            return f"{self.path}: {self.error}"
+        d = self.to_dict()
+        layouts = " ".join(f"{k}:{v}" for k, v in d["layouts"].items())
+        state = "DAMAGED" if self.damaged else "ok"
+        truncated = f", truncated ({self.trailing_bytes} trailing bytes)" if self.truncated else ""
+        return (f"{self.path}: {state} | {self.records} records, {self.crc_failures} CRC failures "
+                f"({100 * self.failure_rate:.2f}%){truncated} | {d['first']} .. {d['last']} | layouts {layouts}")
+
+
+def scan_bytes(data: bytes, result: ScanResult) -> ScanResult:
+    """
+    Walk the records of raw history by the lengths their packet types imply and check every CRC,
+    without decoding. Consecutive records of one packet type are handled together: the run is found
+    by looking at every length-th byte and its CRCs are computed column by column, so the work per
+    byte happens in bytes.translate and big integer XOR rather than in Python.
+    """
+    started = time.perf_counter()
+    size = len(data)
+    result.bytes = size
+    offset = 0
+    while offset + 2 <= size:
+        packet_type = data[offset + 1]
+        length = _LENGTHS[packet_type]
+        if offset + length > size:
+            break
+        # records that follow with the same packet type, looked at in growing windows of packet type bytes
+        marker = bytes([packet_type])
+        limit = size - length + 2   # packet type bytes of complete records are before this
+        count = 0
+        window = SHORT_RUN
+        while True:
+            start = offset + 1 + count * length
+            column = data[start:min(limit, start + window * length):length]
+            same = len(column) - len(column.lstrip(marker))
+            count += same
+            if same < window or start + window * length >= limit:
+                break
+            window *= 4
+        run = data[offset:offset + count * length]
+        failures = _run_crc_failures(run, length)
+        bad = count - failures.count(0)
+        result.records += count
+        result.crc_failures += bad
+        result.layouts[packet_type] = result.layouts.get(packet_type, 0) + count
+        # time span of the records that passed the CRC
+        stamps = struct.iter_unpack(f"<2xI{length - 6}x", run)
+        if bad:
+            stamps = [ts for (ts,), failed in zip(stamps, failures) if not failed]
+            low, high = (min(stamps), max(stamps)) if stamps else (None, None)
+        else:
+            stamps = [ts for ts, in stamps]
+            low, high = min(stamps), max(stamps)
+        if low is not None:
+            result.first = low if result.first is None else min(result.first, low)
+            result.last = high if result.last is None else max(result.last, high)
+        offset += count * length
+    if offset < size:
+        result.truncated = True
+        result.trailing_bytes = size - offset
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def scan_file(path: str) -> ScanResult:
+    result = ScanResult(path)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        result.error = str(e)
+        return result
+    return scan_bytes(data, result)
+
+
+def scan_files(paths: list[str], jobs: int = 1):
+    """Scan results in the order of paths, jobs > 1 scans in that many processes."""
+    if jobs <= 1:
+        yield from map(scan_file, paths)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(scan_file, paths, chunksize=16)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check raw history files for CRC errors and truncation without decoding")
+    parser.add_argument("files", nargs="+", help="raw history files or directories of them")
+    parser.add_argument("--json", action="store_true", help="one JSON object per file")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="files scanned in parallel")
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.files:
+        if os.path.isdir(path):
+            paths.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if os.path.isfile(os.path.join(path, name))))
+        else:
+            paths.append(path)
+
+    started = time.perf_counter()
+    total = damaged = size = 0
+    for result in scan_files(paths, min(args.jobs, len(paths))):
+        total += 1
+        damaged += result.damaged
+        size += result.bytes
+        print(json.dumps(result.to_dict()) if args.json else result)
+    seconds = time.perf_counter() - started
+    print(f"{total} files, {damaged} damaged, {size / 1024 ** 2:.1f} MiB in {seconds:.2f}s "
+          f"({size / 1024 ** 2 / seconds if seconds else 0:.0f} MiB/s)", file=sys.stderr)
+    if damaged:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
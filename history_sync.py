@@ -0,0 +1,196 @@
+import json
+import os
+import struct
+import time
+
+from csv_export import export_records_to_csv
+from decode_cache import read_history
+from history_archive import HistoryArchive, archive_enabled, archive_path
+from history import MIN_RECORD_LENGTH
+from mcumgr_wrapper import run_mcumgr_shell_command, run_resumable_download_command, run_smp_file_head_command
+from pipeline import run_pipeline
+from sinks import get_publishers, prepare_records, publish_records
+
+MANIFEST_NAME = "manifest.json"
+
+
+def get_history_files(device: str) -> tuple[list[tuple[str, int]], str]:
+    """Return [(path, size)] from "history get" and an error string."""
+    files, stderr, raw = run_mcumgr_shell_command(device, "history get")
+    if stderr:
+        return [], stderr
+    result = []
+    for file in (files or "").split(";"):
+        if not file.strip():
+            continue
+        file_data = file.split(",")
+        result.append((file_data[0].strip(), int(file_data[1].strip())))
+    return result, ""
+
+
+def file_name(fname: str) -> str:
+    # files move between h_new and h_sync when synced, the numeric name stays the same
+    return fname.split('/')[-1]
+
+
+def file_key(fname: str, first: int | None = None) -> str:
+    # after "history clear" a file can be recreated under the same name, the first record tells them apart
+    return file_name(fname) if first is None else f"{file_name(fname)}@{first}"
+
+
+def get_first_timestamps(device: str, files: list[tuple[str, int]]) -> dict[str, int | None]:
+    """Return {path: timestamp of the first record}, None where it could not be read."""
+    result = {}
+    for fname, fsize in files:
+        result[fname] = None
+        if fsize < MIN_RECORD_LENGTH:
+            continue
+        head, stderr = run_smp_file_head_command(device, fname)
+        if not stderr and head and len(head) >= 6:
+            result[fname] = struct.unpack_from("<I", head, 2)[0]
+    return result
+
+
+def manifest_entry(manifest: dict, fname: str, first: int | None) -> dict | None:
+    entry = manifest["files"].get(file_key(fname, first))
+    if entry is None and first is not None:
+        # entries written before the first timestamp was part of the key
+        legacy = manifest["files"].get(file_key(fname))
+        if legacy is not None and "first" not in legacy:
+            return legacy
+    return entry
+
+
+def history_dir(fname: str) -> str:
+    parts = fname.split('/')
+    return parts[-2] if len(parts) > 1 else ""
+
+
+def load_manifest(mac_dir: str) -> dict:
+    path = os.path.join(mac_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(mac_dir: str, manifest: dict):
+    path = os.path.join(mac_dir, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def plan_sync(files: list[tuple[str, int]], manifest: dict,
+              firsts: dict[str, int | None] | None = None) -> list[tuple[str, int, int]]:
+    """Return [(path, start offset, size)] for files that are new or grew since the last sync."""
+    firsts = firsts or {}
+    plan = []
+    for fname, fsize in files:
+        entry = manifest_entry(manifest, fname, firsts.get(fname))
+        ingested = entry["size"] if entry else 0
+        if fsize > ingested:
+            plan.append((fname, ingested, fsize))
+    return plan
+
+
+def mark_synced(device: str, fname: str) -> str:
+    """Tell the device a file was ingested. Returns an error string or ""."""
+    out, stderr, raw = run_mcumgr_shell_command(device, "history sync", [fname])
+    if stderr or out != "ok":
+        return stderr or f"history sync {fname} -> {out}"
+    return ""
+
+
+def remove_file(device: str, fname: str) -> str:
+    out, stderr, raw = run_mcumgr_shell_command(device, "history rm", [fname])
+    if stderr or out != "ok":
+        return stderr or f"history rm {fname} -> {out}"
+    return ""
+
+
+def sync_history(device: str, mac: str, is_new_pm_format: bool, remove: bool = False) -> int:
+    """
+    Download only history data that was not ingested before and export it to CSV.
+
+    A manifest in export/<mac>/ remembers the ingested size of every file, keyed by its name and
+    the timestamp of its first record. New files are downloaded whole, grown files (the active
+    one) only from the previously ingested size.
+    Completed files are marked synced on the device and, with remove, deleted from it.
+    Returns the number of downloaded bytes.
+    """
+    mac_dir = os.path.join(os.getcwd(), 'export', mac)
+    os.makedirs(mac_dir, exist_ok=True)
+    manifest = load_manifest(mac_dir)
+
+    files, stderr = get_history_files(device)
+    if stderr:
+        print("Error:\n", stderr)
+        return 0
+
+    firsts = get_first_timestamps(device, files)
+    plan = plan_sync(files, manifest, firsts)
+    if not plan:
+        print("History is up to date.")
+    downloaded = 0
+
+    def download(item):
+        fname, start, fsize = item
+        fname_parts = fname.split('/')
+        out_name = os.path.join(mac_dir, mac + '_' + fname_parts[-2] + "_" + fname_parts[-1])
+        if start:
+            out_name += f"_{start}"
+        print(f"File: {fname}, new bytes: {fsize - start} of {fsize}")
+        stdout, stderr = run_resumable_download_command(device, fname, out_name, fsize, start_offset=start)
+        if stderr:
+            print(f"Error downloading {fname}:\n", stderr)
+            return None
+        return item, out_name
+
+    def decode(downloaded_item):
+        item, out_name = downloaded_item
+        return item, out_name, read_history(out_name, is_new_pm_format)
+
+    def export(decoded):
+        nonlocal downloaded
+        (fname, start, fsize), out_name, records = decoded
+        export_records_to_csv(records, out_name + ".csv")
+        publish_records(get_publishers(), prepare_records(records, mac=mac))
+        if archive_enabled():
+            HistoryArchive(archive_path(mac_dir, mac)).append_file(out_name, is_new_pm_format)
+        os.remove(out_name)
+        downloaded += fsize - start
+        first = firsts.get(fname)
+        manifest["files"].pop(file_key(fname), None)
+        manifest["files"][file_key(fname, first)] = {"path": fname, "size": fsize, "first": first,
+                                                     "ingested": int(time.time())}
+        save_manifest(mac_dir, manifest)
+
+    if plan:
+        print(run_pipeline(plan, [("download", download), ("decode", decode), ("export", export)]))
+
+    # the active file is still being written, fully ingested ones can be handed back to the device
+    for fname, fsize in files:
+        folder = history_dir(fname)
+        entry = manifest_entry(manifest, fname, firsts.get(fname))
+        if folder == "h_active" or not entry or entry["size"] < fsize:
+            continue
+        if folder == "h_new":
+            error = mark_synced(device, fname)
+            if error:
+                print(f"Error marking {fname} synced:\n", error)
+                continue
+            # after sync the file lives in h_sync
+            fname = "/fs/h_sync/" + file_name(fname)
+            entry["path"] = fname
+        if remove:
+            error = remove_file(device, fname)
+            if error:
+                print(f"Error removing {fname}:\n", error)
+            else:
+                entry["removed"] = True
+        save_manifest(mac_dir, manifest)
+
+    print(f"Synced {downloaded} bytes from {len(plan)} files.")
+    return downloaded
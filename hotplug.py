@@ -0,0 +1,94 @@
+import threading
+import time
+from typing import Callable
+
+import serial.tools.list_ports
+
+ATMOTUBE_VID = 0x16c0
+ATMOTUBE_PID = 0x05e1
+
+
+class HotplugWatcher:
+    """Poll the serial port list and report Atmotube devices as they come and go."""
+
+    def __init__(self, vid: int = ATMOTUBE_VID, pid: int = ATMOTUBE_PID, interval: float = 1.0,
+                 on_attach: Callable[[str], None] | None = None,
+                 on_detach: Callable[[str], None] | None = None):
+        self.vid = vid
+        self.pid = pid
+        self.interval = interval
+        self.on_attach = on_attach
+        self.on_detach = on_detach
+        # device path -> USB serial number, used to notice a different unit on a reused path
+        self._known: dict[str, str | None] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def devices(self) -> list[str]:
+        with self._lock:
+            return sorted(self._known)
+
+    def _scan(self) -> dict[str, str | None]:
+        found = {}
+        for port in serial.tools.list_ports.comports():
+            if port.vid == self.vid and port.pid == self.pid:
+                found[port.device] = port.serial_number
+        return found
+
+    def poll(self) -> tuple[list[str], list[str]]:
+        """Rescan once and return (attached, detached) device paths since the previous poll."""
+        found = self._scan()
+        with self._lock:
+            detached = [d for d, sn in self._known.items() if d not in found or found[d] != sn]
+            attached = [d for d, sn in found.items() if d not in self._known or self._known[d] != sn]
+            self._known = found
+
+        for device in detached:
+            if self.on_detach:
+                self.on_detach(device)
+        for device in attached:
+            if self.on_attach:
+                self.on_attach(device)
+        return attached, detached
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Hotplug scan failed: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="hotplug-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+
+def watch(interval: float = 1.0):
+    """Print attach/detach events until interrupted."""
+    watcher = HotplugWatcher(interval=interval)
+    try:
+        while True:
+            attached, detached = watcher.poll()
+            for device in detached:
+                print(f"Detached: {device}")
+            for device in attached:
+                print(f"Attached: {device}")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    watch()
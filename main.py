@@ -6,20 +6,34 @@ import unittest
 import test
 from test import AtmocubeCommandTests
 from csv_export import export_records_to_csv
-from device_config import print_device_config
-from history import read_history_file, parse_history_record, check_fw_new
-from mcumgr_wrapper import run_mcumgr_shell_command, run_mcumgr_download_command, \
+from decode_cache import read_history
+from device_config import invalidate_device_config, print_device_config
+from history import parse_history_record, check_fw_new
+from history_archive import HistoryArchive, archive_enabled, archive_path
+from mcumgr_wrapper import run_mcumgr_shell_command, run_resumable_download_command, \
     run_mcumgr_image_list_command, run_mcumgr_image_upload_command, run_mcumgr_image_confirm_command, \
     run_mcumgr_reset_command
 import serial.tools.list_ports
 
-from ota import check_firmware_update, download_file
+from firmware_cache import FirmwareCacheError, get_firmware_cache
+from fleet_ota import wait_for_reboot
+from history_sync import get_history_files, sync_history
+from hotplug import HotplugWatcher
+from ota import OTA_CHECKER, check_firmware_update
+from pipeline import run_pipeline
+from sinks import get_publishers, prepare_records, publish_records
+from retry import PROBE_POLICY, REBOOT_POLICY, SET_TIME_POLICY, adaptive_timeout, reset_breaker
+from scheduler import close_scheduler
+from timeseries import STORE, print_window_stats
+from tracing import export_from_env
 
 MACS = {}
 FWS = {}
 SERIALS = {}
 UPDATE = {}
 
+WATCHER = HotplugWatcher()
+
 
 def list_devices_by_vid_pid(vid: int = 0x16c0, pid: int = 0x05e1) -> list[str]:
     """Return a list of device paths matching given VID:PID."""
@@ -55,29 +69,62 @@ def select_device_interactively(devices: list[str]) -> str | None:
 
 def summarize_devices(devices):
     for device in devices:
-        # repeat 3 times with delay
-        for _ in range(3):
-            mac, stderr, raw = run_mcumgr_shell_command(device, "mac", timeout=1)
-            if stderr:
-                MACS[device] = "N/A"
-            else:
-                MACS[device] = mac if mac else "N/A"
-                break
-            time.sleep(1)
-        fw, stderr, raw = run_mcumgr_shell_command(device, "version app")
-        if stderr:
-            FWS[device] = "N/A"
+        summarize_device(device)
+
+
+def summarize_device(device):
+    # the first command may hit a device that is still booting, retry with backoff
+    mac, stderr, raw = PROBE_POLICY.call(
+        lambda: run_mcumgr_shell_command(device, "mac", timeout=adaptive_timeout("shell mac", 1)),
+        lambda result: bool(result[1]))
+    if stderr:
+        MACS[device] = "N/A"
+    else:
+        MACS[device] = mac if mac else "N/A"
+    fw, stderr, raw = run_mcumgr_shell_command(device, "version app")
+    if stderr:
+        FWS[device] = "N/A"
+    else:
+        FWS[device] = fw if fw else "N/A"
+    identity, stderr, raw = run_mcumgr_shell_command(device, "identity")
+    if stderr:
+        SERIALS[device] = "N/A"
+    else:
+        identity_data = identity.split(" ")
+        if len(identity_data) > 4:
+            SERIALS[device] = identity_data[4]
         else:
-            FWS[device] = fw if fw else "N/A"
-        identity, stderr, raw = run_mcumgr_shell_command(device, "identity")
-        if stderr:
             SERIALS[device] = "N/A"
-        else:
-            identity_data = identity.split(" ")
-            if len(identity_data) > 4:
-                SERIALS[device] = identity_data[4]
-            else:
-                SERIALS[device] = "N/A"
+
+
+def forget_device(device):
+    MACS.pop(device, None)
+    FWS.pop(device, None)
+    SERIALS.pop(device, None)
+    UPDATE.pop(device, None)
+    invalidate_device_config(device)
+    STORE.forget(device)
+    reset_breaker(device)
+    close_scheduler(device)
+
+
+def refresh_devices() -> list[str]:
+    """Probe only ports attached since the last call and drop detached ones."""
+    attached, detached = WATCHER.poll()
+    for device in detached:
+        forget_device(device)
+    summarize_devices(attached)
+    check_updates(attached)
+    return WATCHER.devices
+
+
+def check_updates(devices):
+    """Ask the OTA server about all devices at once, devices on the same firmware share one request."""
+    known = [d for d in devices if MACS.get(d, "N/A") != "N/A" and FWS.get(d, "N/A") != "N/A"]
+    updates = OTA_CHECKER.check_many([(MACS[d], FWS[d]) for d in known])
+    for device, update in zip(known, updates):
+        if update:
+            UPDATE[device] = update
 
 
 def parse_image_list(output: str) -> dict:
@@ -97,17 +144,6 @@ def parse_image_list(output: str) -> dict:
     return result
 
 
-def countdown(seconds: int = 60):
-    width = len(str(seconds))  # e.g. 2 for "60"
-    for i in range(seconds, 0, -1):
-        # :{width}d makes i occupy 'width' chars (right‑aligned), so " 9" not "9"
-        msg = f"Rebooting... {i:{width}d}s"
-        # add a couple spaces to blank out leftovers
-        print(msg + "  ", end="\r", flush=True)
-        time.sleep(1)
-    print()
-
-
 def run_tests(device_path):
     test.device_path = device_path
 
@@ -119,12 +155,12 @@ def run_tests(device_path):
 
 
 def update_device(device, fw_file: str, update_info: dict):
-    print(f"Uploading... (this may take 3 minutes)")
+    print(f"Uploading...")
     stdout, stderr = run_mcumgr_image_upload_command(device, fw_file)
     if stderr:
         print("Error uploading firmware:\n", stderr)
     else:
-        print(f"Upload complete!")
+        print(f"Upload complete! {stdout}")
         stdout, stderr = run_mcumgr_image_list_command(device)
         if stderr:
             print("Error listing images:\n", stderr)
@@ -142,22 +178,21 @@ def update_device(device, fw_file: str, update_info: dict):
                         check_firmware_update(MACS.get(device, ""), update_info['ver'])
                     break
             stdout, stderr = run_mcumgr_reset_command(device)
+            invalidate_device_config(device)
             if stderr:
                 print("Error resetting device:\n", stderr)
             else:
-                print("Device reset successfully. Firmware update complete.")
-                countdown(60)
+                print("Device reset successfully. Waiting for the reboot...")
+                fw = wait_for_reboot(device)
+                if fw is None:
+                    print("Device did not come back after the reset.")
+                    return
+                FWS[device] = fw
+                print(f"Firmware update complete, running {fw}.")
                 UPDATE.pop(device)
                 print("Setting time...")
-                time_result = set_time(device)
-                count = 0
-                while not time_result:
-                    time.sleep(1)
-                    time_result = set_time(device)
-                    count += 1
-                    if count > 10:
-                        print("Failed to set time after multiple attempts.")
-                        break
+                if not SET_TIME_POLICY.call(lambda: set_time(device), lambda ok: not ok):
+                    print("Failed to set time after multiple attempts.")
 
 
 def find_fw_bins(search_dir: str):
@@ -192,12 +227,25 @@ def extract_version_from_fw_filename(path: str) -> str:
     return "local"
 
 
+def fetch_firmware(update_info: dict) -> str | None:
+    """Verified local copy of the firmware from the firmware cache, downloaded only when it changed."""
+    print(f"Getting firmware {update_info['ver']} from {update_info['url']}")
+    try:
+        fw_file = get_firmware_cache().get(update_info)
+    except FirmwareCacheError as e:
+        print(e)
+        return None
+    print(f"Firmware {update_info['ver']} ready at {fw_file}")
+    return fw_file
+
+
 def interactive_command_menu(device: str):
     while True:
         print("\nSelect a command:")
         print("1) Download history")
         print("2) Get current data")
         print("3) Get last history")
+        print("4) Sync new history")
         if os.path.exists("config.json"):
             print("5) Set configuration (from config.json)")
         print("6) RECOVERY")
@@ -214,7 +262,7 @@ def interactive_command_menu(device: str):
         is_new_pm_format = check_fw_new((3, 0, 17), fw)
         if choice == "1":
             print("Downloading history...")
-            download_history(device, fw)
+            download_history(device, is_new_pm_format)
         elif choice == "2":
             print("Fetching current data...")
             data, stderr, raw = run_mcumgr_shell_command(device, "data get")
@@ -225,6 +273,8 @@ def interactive_command_menu(device: str):
                     decoded_data = base64.b64decode(data)
                     record = parse_history_record(decoded_data, is_new_pm_format)
                     print(record)
+                    STORE.append(device, record)
+                    print_window_stats(STORE.series(device), 10)
                 else:
                     print("No data found.")
         elif choice == "3":
@@ -238,17 +288,30 @@ def interactive_command_menu(device: str):
                         decoded_data = base64.b64decode(data)
                         record = parse_history_record(decoded_data, is_new_pm_format)
                         print(record)
+                        STORE.append(device, record)
                     except:
                         print("No data found.")
                 else:
                     print("No data found.")
+        elif choice == "4":
+            remove = input("Remove synced files from the device? (y/N): ").strip().lower() == "y"
+            print("Syncing history...")
+            sync_history(device, MACS.get(device, "unknown_mac"), is_new_pm_format, remove)
         elif choice == "5":
             if os.path.exists("config.json"):
                 print("Setting configuration from config.json...")
-                from config import apply_config, load_config
+                from config import apply_config, load_config, send_config_changes
                 try:
                     device_config = load_config("config.json")
-                    apply_config(device, device_config)
+                    changes = apply_config(device, device_config, dry_run=True)
+                    if not changes:
+                        print("Device already matches config.json.")
+                    else:
+                        for change in changes:
+                            print(f"  {change}")
+                        if input(f"Send {len(changes)} settings? (y/N): ").strip().lower() == "y":
+                            send_config_changes(device, changes)
+                            print(f"Configuration applied successfully ({len(changes)} settings sent).")
                 except Exception as e:
                     print(f"Error applying configuration: {e}")
             else:
@@ -272,25 +335,21 @@ def interactive_command_menu(device: str):
                     break
             # download firmware to fs
             if update_info:
-                url = update_info['url']
-                print(f"Downloading firmware from {url}")
-                fw_dir = os.path.join(os.getcwd(), 'fw')
-                os.makedirs(fw_dir, exist_ok=True)
-                fw_file = os.path.join(fw_dir, f"{update_info['ver']}.bin")
-                downloaded = download_file(url, fw_file)
-                if downloaded:
-                    print(f"Firmware downloaded to {fw_file}")
+                fw_file = fetch_firmware(update_info)
+                if fw_file:
                     print(f"Running recovery mode on {device}...")
                     # reboot device into recovery mode
                     stdout, stderr, raw = run_mcumgr_shell_command(device, "reboot")
+                    invalidate_device_config(device)
                     print("Waiting for device to enter recovery mode...")
-                    while True:
-                        stdout, stderr = run_mcumgr_image_list_command(device)
-                        if stdout:
-                            print("Device is in recovery mode.")
-                            images = parse_image_list(stdout)
-                            print(images)
-                            break
+                    stdout, stderr = REBOOT_POLICY.call(lambda: run_mcumgr_image_list_command(device, timeout=5),
+                                                        lambda result: not result[0])
+                    if not stdout:
+                        print("Device did not enter recovery mode.")
+                        continue
+                    print("Device is in recovery mode.")
+                    images = parse_image_list(stdout)
+                    print(images)
                     update_device(device, fw_file, update_info)
         elif choice == "7":
             fw_file = get_local_fw_file()
@@ -303,14 +362,8 @@ def interactive_command_menu(device: str):
                 update_info = UPDATE.get(device)
                 # download firmware to fs
                 if update_info:
-                    url = update_info['url']
-                    print(f"Downloading firmware from {url}")
-                    fw_dir = os.path.join(os.getcwd(), 'fw')
-                    os.makedirs(fw_dir, exist_ok=True)
-                    fw_file = os.path.join(fw_dir, f"{update_info['ver']}.bin")
-                    downloaded = download_file(url, fw_file)
-                    if downloaded:
-                        print(f"Firmware downloaded to {fw_file}")
+                    fw_file = fetch_firmware(update_info)
+                    if fw_file:
                         update_device(device, fw_file, update_info)
         elif choice == "8":
             print("Clearing history...")
@@ -321,6 +374,8 @@ def interactive_command_menu(device: str):
                 print("History cleared successfully.")
         elif choice == "9":
             run_tests(device)
+            # the tests change settings
+            invalidate_device_config(device)
         elif choice == "0":
             print("Exiting.")
             break
@@ -333,30 +388,38 @@ def download_history(device: str, is_new_pm_format: bool):
     mac_dir = os.path.join(os.getcwd(), 'export', mac)
     os.makedirs(mac_dir, exist_ok=True)
 
-    # Run and print result
-    files, stderr, raw = run_mcumgr_shell_command(device, "history get")
+    files, stderr = get_history_files(device)
     if stderr:
         print("Error:\n", stderr)
-    else:
-        if files:
-            for file in files.split(";"):
-                if not file.strip():
-                    continue
-                file_data = file.split(",")
-                fname = file_data[0].strip()
-                fsize = file_data[1].strip()
-                print(f"File: {fname}, Size: {fsize} bytes")
-                fname_parts = fname.split('/')
-                # Download the file
-                out_name = os.path.join(mac_dir, mac + '_' + fname_parts[-2] + "_" + fname_parts[-1])
-                stdout, stderr = run_mcumgr_download_command(device, fname, out_name)
-                if stderr:
-                    print(f"Error downloading {fname}:\n", stderr)
-                else:
-                    print(f"Downloaded {fname} successfully.")
-                records = read_history_file(out_name, is_new_pm_format)
-                export_records_to_csv(records, out_name + ".csv")
-                os.remove(out_name)
+        return
+
+    def download(file):
+        fname, fsize = file
+        print(f"File: {fname}, Size: {fsize} bytes")
+        fname_parts = fname.split('/')
+        # Download the file, a partial download from a previous attempt is resumed
+        out_name = os.path.join(mac_dir, mac + '_' + fname_parts[-2] + "_" + fname_parts[-1])
+        stdout, stderr = run_resumable_download_command(device, fname, out_name, fsize)
+        if stderr:
+            print(f"Error downloading {fname}:\n", stderr)
+            return None
+        print(f"Downloaded {fname} successfully. {stdout}")
+        return out_name
+
+    def decode(out_name):
+        return out_name, read_history(out_name, is_new_pm_format)
+
+    def export(decoded):
+        out_name, records = decoded
+        export_records_to_csv(records, out_name + ".csv")
+        publish_records(get_publishers(), prepare_records(records, mac=mac))
+        if archive_enabled():
+            HistoryArchive(archive_path(mac_dir, mac)).append_file(out_name, is_new_pm_format)
+        os.remove(out_name)
+
+    # the next file downloads while the previous one is decoded and written
+    stats = run_pipeline(files, [("download", download), ("decode", decode), ("export", export)])
+    print(stats)
 
 
 def set_time(device):
@@ -370,8 +433,7 @@ def main():
     print("Atmotube PRO2 Interactive Shell")
     while True:
         print("Searching for devices...")
-        devices = list_devices_by_vid_pid()
-        summarize_devices(devices)
+        devices = refresh_devices()
         device = select_device_interactively(devices)
 
         if device:
@@ -379,12 +441,12 @@ def main():
                 print(f"Time set successfully.")
             else:
                 print(f"Failed to set time!")
-            update = check_firmware_update(MACS.get(device, ""), FWS.get(device, ""))
-            if update:
-                UPDATE[device] = update
+            update = UPDATE.get(device)
+            print(f"Update available: {update['ver']}" if update else "Device is up to date.")
             print_device_config(device)
             interactive_command_menu(device)
         else:
+            export_from_env()
             return
 
 
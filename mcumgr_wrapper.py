@@ -1,11 +1,43 @@
+import hashlib
+import os
+import re
 import subprocess
+import time
+import zlib
+
+import serial
+
+from retry import CHUNK_POLICY, CircuitOpen, adaptive_timeout, get_breaker
+from scheduler import PRIORITY_BULK, PRIORITY_LIVE, get_scheduler, release_device
+from smp import SmpError, SmpTimeout, image_upload_chunk_size
+from tracing import CommandTrace, trace
 
 BAUD_RATE = 1000000  # Default baud rate for serial communication
+# Shell commands and image uploads go over the shared SMP connection instead of spawning ./mcumgr for each one
+# when ATMOTUBE_NATIVE_SMP=1. Off by default, the native client is only tested against simulator.py so far.
+NATIVE_SMP_ENV = "ATMOTUBE_NATIVE_SMP"
+USE_NATIVE_SMP = os.environ.get(NATIVE_SMP_ENV) == "1"
+# image upload chunks in flight before waiting for the device answers
+UPLOAD_WINDOW = 3
+# progress of ./mcumgr image upload, "12.50 KiB/300.00 KiB" or "4%"
+CLI_PROGRESS_BYTES = re.compile(r"([\d.]+)\s*([KMG]i?B|B)\s*/\s*([\d.]+)\s*([KMG]i?B|B)")
+CLI_PROGRESS_PERCENT = re.compile(r"(\d+(?:\.\d+)?)\s*%")
+SIZE_UNITS = {"B": 1, "KB": 1000, "KiB": 1024, "MB": 1000 ** 2, "MiB": 1024 ** 2, "GB": 1000 ** 3, "GiB": 1024 ** 3}
 
 
-def run_mcumgr_shell_command(device: str, cmd: str, args=None, timeout=4) -> tuple[str, str, str]:
+def run_mcumgr_shell_command(device: str, cmd: str, args=None, timeout=None,
+                             priority: int = PRIORITY_LIVE) -> tuple[str, str, str]:
     if args is None:
         args = []
+    if timeout is None:
+        timeout = adaptive_timeout(f"shell {cmd}")
+    breaker = get_breaker(device)
+    try:
+        breaker.check(device)
+    except CircuitOpen as e:
+        return "", str(e), ""
+    if USE_NATIVE_SMP:
+        return run_smp_shell_command(device, cmd, args, timeout, priority)
     # surround args with quotes if they contain spaces
     args = [f'"{arg}"' if "-" in arg else arg for arg in args]
     conn_args = [
@@ -14,65 +46,470 @@ def run_mcumgr_shell_command(device: str, cmd: str, args=None, timeout=4) -> tup
     ]
     """Run mcumgr with specified arguments."""
     command = ["./mcumgr"] + conn_args + ["shell", "exec"] + cmd.split(" ") + args
+    with trace(f"shell {cmd}", device) as t:
+        try:
+            result = _cli_call(device, lambda: _run_cli(command, t, timeout), priority, t)
+            breaker.record(True)
+            full_cmd = cmd.split(" ") + args
+            out, raw = parse_output(cmd, result.stdout, " ".join(full_cmd))
+            return out, "", raw
+        except subprocess.CalledProcessError as e:
+            breaker.record(False)
+            return e.stdout or "", e.stderr or "Unknown error", e.stdout or ""
+        except subprocess.TimeoutExpired as e:
+            breaker.record(False)
+            return "", "Command timed out", e.stdout or ""
+
+
+def _run_cli(command: list[str], t: CommandTrace, timeout=None) -> subprocess.CompletedProcess:
+    """subprocess.run(..., check=True) that records spawn time, output size and failures on the trace."""
+    started = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    t.spawn_s = time.perf_counter() - started
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        stdout, stderr = process.communicate()
+        t.timeout_reason = f"mcumgr did not finish within {timeout}s"
+        raise subprocess.TimeoutExpired(command, timeout, output=stdout, stderr=stderr)
+    t.bytes_received += len(stdout or "")
+    if process.returncode:
+        t.error = (stderr or "").strip() or f"exit code {process.returncode}"
+        raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+
+def _cli_call(device: str, run, priority: int, t: CommandTrace):
+    """
+    Run run() as a job on the device scheduler with the SMP port closed, so ./mcumgr has the port
+    to itself and waits its turn by priority like a native command.
+    """
+    submitted = time.perf_counter()
+
+    def job(client):
+        t.queue_s += time.perf_counter() - submitted
+        client.close()
+        return run()
+
+    return get_scheduler(device, BAUD_RATE).call(job, priority)
+
+
+def _smp_call(device: str, job, priority: int, t: CommandTrace):
+    """Run job(client) on the device scheduler, adding queue wait and serial timings to the trace."""
+    submitted = time.perf_counter()
+
+    def traced(client):
+        t.queue_s += time.perf_counter() - submitted
+        try:
+            return job(client)
+        finally:
+            t.add_smp_stats(client.last_stats)
+
+    return get_scheduler(device, BAUD_RATE).call(traced, priority)
+
+
+def run_smp_shell_command(device: str, cmd: str, args: list[str], timeout=4,
+                          priority: int = PRIORITY_LIVE) -> tuple[str, str, str]:
+    """Same contract as run_mcumgr_shell_command, queued on the device scheduler."""
+    argv = cmd.split(" ") + [str(arg) for arg in args]
+    full_cmd = " ".join(argv)
+    breaker = get_breaker(device)
+    try:
+        breaker.check(device)
+    except CircuitOpen as e:
+        return "", str(e), ""
+    with trace(f"shell {cmd}", device) as t:
+        try:
+            output, ret = _smp_call(device, lambda c: c.shell_exec(argv, timeout), priority, t)
+        except SmpTimeout:
+            breaker.record(False)
+            t.timeout_reason = f"no SMP response within {timeout}s"
+            return "", "Command timed out", ""
+        except (SmpError, serial.SerialException, OSError) as e:
+            # an SMP error code means the device answered
+            breaker.record(isinstance(e, SmpError) and e.rc is not None)
+            t.error = str(e) or "Unknown error"
+            return "", t.error, ""
+    breaker.record(True)
+    return _parse_shell_output(cmd, full_cmd, output, ret)
+
+
+def _parse_shell_output(cmd: str, full_cmd: str, output: str, ret: int) -> tuple[str, str, str]:
+    lines = [line for line in output.strip().splitlines() if line.strip()]
+    if not lines:
+        return None, f"Command returned {ret}" if ret else "", f"{full_cmd} -> None"
+    # the answer is the line echoing the command name, fall back to the first one
+    data = next((line for line in lines if line.lower().startswith(cmd)), lines[0]).strip()
+    out, raw = parse_data_line(cmd, data, full_cmd)
+    if out is None and ret:
+        return output, f"Command returned {ret}", raw
+    return out, "", raw
+
+
+def run_shell_batch(device: str, cmds: list[str], timeout=4,
+                    priority: int = PRIORITY_LIVE) -> dict[str, tuple[str, str, str]]:
+    """
+    Run several argument-less shell commands as one job on the device scheduler, so nothing else is
+    queued between them. Returns cmd -> run_mcumgr_shell_command result.
+    """
+    if not USE_NATIVE_SMP:
+        return {cmd: run_mcumgr_shell_command(device, cmd, timeout=timeout, priority=priority) for cmd in cmds}
+    breaker = get_breaker(device)
     try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True, timeout=timeout)
-        full_cmd = cmd.split(" ") + args
-        out, raw = parse_output(cmd, result.stdout, " ".join(full_cmd))
-        return out, "", raw
-    except subprocess.CalledProcessError as e:
-        return e.stdout or "", e.stderr or "Unknown error", e.stdout or ""
-    except subprocess.TimeoutExpired as e:
-        return "", "Command timed out", e.stdout or ""
+        breaker.check(device)
+    except CircuitOpen as e:
+        return {cmd: ("", str(e), "") for cmd in cmds}
+
+    def job(client):
+        outputs = {}
+        for cmd in cmds:
+            try:
+                outputs[cmd] = client.shell_exec(cmd.split(" "), timeout)
+            except SmpError as e:
+                if e.rc is None:
+                    raise
+                outputs[cmd] = e
+        return outputs
+
+    with trace("shell batch", device) as t:
+        try:
+            outputs = _smp_call(device, job, priority, t)
+        except SmpTimeout:
+            breaker.record(False)
+            t.timeout_reason = f"no SMP response within {timeout}s"
+            return {cmd: ("", "Command timed out", "") for cmd in cmds}
+        except (SmpError, serial.SerialException, OSError) as e:
+            breaker.record(False)
+            t.error = str(e) or "Unknown error"
+            return {cmd: ("", t.error, "") for cmd in cmds}
+    breaker.record(True)
+    results = {}
+    for cmd, output in outputs.items():
+        if isinstance(output, SmpError):
+            results[cmd] = ("", str(output), "")
+        else:
+            results[cmd] = _parse_shell_output(cmd, cmd, *output)
+    return results
 
 
-def run_mcumgr_download_command(device: str, file: str, out_file: str) -> tuple[str, str]:
+def run_mcumgr_download_command(device: str, file: str, out_file: str, timeout=None) -> tuple[str, str]:
     conn_args = [
         "--conntype", "serial",
         "--connstring", f"dev={device},baud={BAUD_RATE}"
     ]
     command = ["./mcumgr"] + conn_args + ["fs", "download"] + [file, out_file]
+    with trace("fs download", device) as t:
+        try:
+            result = _cli_call(device, lambda: _run_cli(command, t, timeout), PRIORITY_BULK, t)
+            if os.path.exists(out_file):
+                t.bytes_received += os.path.getsize(out_file)
+            return result.stdout, ""
+        except subprocess.CalledProcessError as e:
+            return e.stdout or "", e.stderr or "Unknown error"
+        except subprocess.TimeoutExpired as e:
+            return e.stdout or "", "Command timed out"
+
+
+def _verify_download(device: str, file: str, path: str, offset: int, size: int, t: CommandTrace) -> str:
+    """Compare the local file with the device side hash/checksum. Returns an error string or ""."""
+    with open(path, "rb") as f:
+        content = f.read()
+    for hash_type in ("sha256", "crc32"):
+        try:
+            remote = _smp_call(device, lambda c: c.fs_hash(file, hash_type, offset, size), PRIORITY_BULK, t)
+        except SmpError:
+            # not supported by this firmware, try the next one
+            continue
+        if hash_type == "sha256":
+            local = hashlib.sha256(content).digest()
+        else:
+            local = zlib.crc32(content)
+        if remote != local:
+            return f"{hash_type} mismatch for {file}"
+        return ""
+    return ""
+
+
+def run_resumable_download_command(device: str, file: str, out_file: str, expected_size: int | None = None,
+                                   timeout=4, retries=5, start_offset: int = 0) -> tuple[str, str]:
+    """
+    Download a file over SMP, resuming from a partial "<out_file>.part" left by an earlier attempt.
+
+    Only expected_size bytes are fetched when it is given (the size from "history get"), so a file
+    that keeps growing on the device is downloaded as the listed snapshot. The result is verified
+    against the size and, when the firmware supports it, the SMP fs hash/checksum.
+    With start_offset only the tail of the file from that offset is fetched into out_file.
+    Every chunk is a separate bulk job on the device scheduler, so other commands for the
+    device are served between chunks.
+    """
+    part_file = out_file + ".part"
+    if expected_size is not None and os.path.exists(out_file) \
+            and os.path.getsize(out_file) == expected_size - start_offset:
+        return f"{file} already downloaded", ""
+
+    offset = start_offset
+    if os.path.exists(part_file):
+        offset += os.path.getsize(part_file)
+    if expected_size is not None and offset > expected_size:
+        offset = start_offset
+    resumed_from = offset
+
+    total = expected_size
+    attempts = 0
+    with trace("fs download", device) as t:
+        try:
+            with open(part_file, "r+b" if offset > start_offset else "wb") as f:
+                f.truncate(offset - start_offset)
+                f.seek(offset - start_offset)
+                while total is None or offset < total:
+                    try:
+                        data, length = _smp_call(device, lambda c: c.fs_download_chunk(file, offset, timeout),
+                                                 PRIORITY_BULK, t)
+                    except (SmpError, serial.SerialException, OSError) as e:
+                        attempts += 1
+                        t.retries += 1
+                        if attempts > retries:
+                            if isinstance(e, SmpTimeout):
+                                t.timeout_reason = str(e)
+                            t.error = f"Download of {file} interrupted at {offset} bytes: {e}"
+                            return "", t.error
+                        release_device(device)
+                        time.sleep(CHUNK_POLICY.backoff(attempts))
+                        continue
+                    if total is None:
+                        total = length if length is not None else _smp_call(device, lambda c: c.fs_status(file),
+                                                                            PRIORITY_BULK, t)
+                    if not data:
+                        break
+                    data = data[:total - offset]
+                    f.write(data)
+                    f.flush()
+                    offset += len(data)
+                    attempts = 0
+
+            if total is not None and offset != total:
+                t.error = f"Size mismatch for {file}: got {offset} bytes, expected {total}"
+                return "", t.error
+            t.error = _verify_download(device, file, part_file, start_offset, offset - start_offset, t)
+            if t.error:
+                os.remove(part_file)
+                return "", t.error
+        except (SmpError, serial.SerialException, OSError) as e:
+            t.error = f"Download of {file} failed: {e}"
+            return "", t.error
+
+    os.replace(part_file, out_file)
+    return f"Downloaded {offset - resumed_from} of {offset - start_offset} bytes", ""
+
+
+class UploadProgress:
+    """Passed to the image upload progress callback after every window of chunks."""
+
+    def __init__(self, device: str, total: int):
+        self.device = device
+        self.total = total
+        self.offset = 0          # bytes the device has confirmed
+        self.resumed_from = 0    # offset the device reported when the upload started
+        self.started = time.perf_counter()
+        self.retries = 0
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def bytes_per_sec(self) -> float:
+        elapsed = self.elapsed
+        return (self.offset - self.resumed_from) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def percent(self) -> float:
+        return 100.0 * self.offset / self.total if self.total else 100.0
+
+    def __str__(self):
+        return (f"{self.offset}/{self.total} bytes {self.percent:.1f}% "
+                f"{self.bytes_per_sec / 1024:.1f} KiB/s")
+
+
+def print_upload_progress(progress: UploadProgress):
+    print(f"\r{progress}", end="", flush=True)
+
+
+def parse_cli_progress(line: str, total: int) -> int | None:
+    """Bytes uploaded according to a progress line of ./mcumgr image upload, None for other output."""
+    match = CLI_PROGRESS_BYTES.search(line)
+    if match:
+        # the CLI rounds to its units, scale to the image size
+        done = float(match[1]) * SIZE_UNITS[match[2]]
+        size = float(match[3]) * SIZE_UNITS[match[4]]
+        if size:
+            return min(total, round(total * done / size))
+    match = CLI_PROGRESS_PERCENT.search(line)
+    if match:
+        return min(total, round(total * float(match[1]) / 100))
+    return None
+
+
+def run_smp_image_upload_command(device: str, file: str, progress=print_upload_progress,
+                                 window: int = UPLOAD_WINDOW, timeout=4, retries=5) -> tuple[str, str]:
+    """
+    Upload a firmware image over SMP with window chunks of MTU size in flight.
+
+    The first request carries the image sha256, so a device holding part of the same image from an
+    interrupted upload answers with the offset it reached and the upload continues from there.
+    After an error the device offset is asked again the same way. progress(UploadProgress) is
+    called after every window, each window is one bulk job on the device scheduler.
+    """
+    with open(file, "rb") as f:
+        image = f.read()
+    sha = hashlib.sha256(image).digest()
+    state = UploadProgress(device, len(image))
+    attempts = 0
+    with trace("image upload", device) as t:
+        try:
+            mtu = _smp_call(device, lambda c: c.mtu(), PRIORITY_BULK, t)
+        except (SmpError, serial.SerialException, OSError) as e:
+            t.error = f"Upload of {file} failed: {e}"
+            return "", t.error
+        chunk_size = image_upload_chunk_size(mtu, len(image))
+        probe = True
+        while state.offset < len(image):
+            # after a start or an error only the first chunk is sent, its answer is the device offset
+            offset, count = (0, 1) if probe else (state.offset, window)
+            try:
+                device_offset = _smp_call(
+                    device, lambda c: c.image_upload_window(image, sha, offset, chunk_size, count, timeout),
+                    PRIORITY_BULK, t)
+            except (SmpError, serial.SerialException, OSError) as e:
+                attempts += 1
+                t.retries += 1
+                state.retries += 1
+                if attempts > retries:
+                    if isinstance(e, SmpTimeout):
+                        t.timeout_reason = str(e)
+                    t.error = f"Upload of {file} interrupted at {state.offset} bytes: {e}"
+                    return "", t.error
+                release_device(device)
+                time.sleep(CHUNK_POLICY.backoff(attempts))
+                probe = True
+                continue
+            if device_offset is None or device_offset > len(image):
+                t.error = f"Device reported offset {device_offset} for an image of {len(image)} bytes"
+                return "", t.error
+            if probe and device_offset > chunk_size and state.offset == 0:
+                state.resumed_from = device_offset
+            probe = False
+            attempts = 0
+            state.offset = device_offset
+            if progress:
+                progress(state)
+        t.bytes_sent = len(image) - state.resumed_from
+    if progress is print_upload_progress:
+        print()
+    resumed = f", resumed at {state.resumed_from}" if state.resumed_from else ""
+    return (f"Uploaded {len(image) - state.resumed_from} bytes in {state.elapsed:.1f}s "
+            f"({state.bytes_per_sec / 1024:.1f} KiB/s{resumed})"), ""
+
+
+def _run_smp_command(device: str, command: str, job, timeout=4) -> tuple[object, str]:
+    """Run a single request job(client) as a traced bulk job. Returns (result, error)."""
+    breaker = get_breaker(device)
     try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        return result.stdout, ""
-    except subprocess.CalledProcessError as e:
-        return e.stdout or "", e.stderr or "Unknown error"
+        breaker.check(device)
+    except CircuitOpen as e:
+        return None, str(e)
+    with trace(command, device) as t:
+        try:
+            result = _smp_call(device, job, PRIORITY_BULK, t)
+        except SmpTimeout:
+            breaker.record(False)
+            t.timeout_reason = f"no SMP response within {timeout}s"
+            return None, "Command timed out"
+        except (SmpError, serial.SerialException, OSError) as e:
+            breaker.record(isinstance(e, SmpError) and e.rc is not None)
+            t.error = str(e) or "Unknown error"
+            return None, t.error
+    breaker.record(True)
+    return result, ""
+
+
+def run_smp_image_state_command(device: str, timeout=4) -> tuple[list[dict] | None, str]:
+    """Image slots as reported by the device: image, slot, version, hash (bytes), active, confirmed, pending."""
+    return _run_smp_command(device, "image list", lambda c: c.image_state(), timeout)
+
+
+def run_smp_image_confirm_command(device: str, image_hash: bytes, timeout=4) -> tuple[list[dict] | None, str]:
+    return _run_smp_command(device, "image confirm", lambda c: c.image_set_state(image_hash, True), timeout)
+
 
+def run_smp_file_head_command(device: str, file: str, timeout=4) -> tuple[bytes | None, str]:
+    """First chunk of a device file, enough to read its first record."""
+    result, stderr = _run_smp_command(device, "fs download", lambda c: c.fs_download_chunk(file, 0, timeout), timeout)
+    return (result[0] if result else None), stderr
 
-def run_mcumgr_image_upload_command(device: str, file: str) -> tuple[str, str]:
+
+def run_smp_reset_command(device: str, timeout=4) -> tuple[str, str]:
+    result, stderr = _run_smp_command(device, "reset", lambda c: c.reset(), timeout)
+    # the port goes away with the reboot, reopen it on the next command
+    release_device(device)
+    return ("" if stderr else "ok"), stderr
+
+
+def run_mcumgr_image_upload_command(device: str, file: str, progress=print_upload_progress) -> tuple[str, str]:
+    if USE_NATIVE_SMP:
+        return run_smp_image_upload_command(device, file, progress)
     conn_args = [
         "--conntype", "serial",
         "--connstring", f"dev={device},baud={BAUD_RATE}"
     ]
     command = ["./mcumgr"] + conn_args + ["image", "upload", file]
 
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    state = UploadProgress(device, os.path.getsize(file))
 
-    stdout_full = []
-    stderr_full = []
+    def upload() -> tuple[str, str]:
+        started = time.perf_counter()
+        # text mode also splits the lines a progress bar redraws with \r
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        t.spawn_s = time.perf_counter() - started
+        state.started = time.perf_counter()
 
-    try:
-        for line in process.stdout:
-            line = line.rstrip()
-            stdout_full.append(line)
+        stdout_full = []
+        stderr_full = []
 
-            if "%" in line:  # crude check for progress lines
-                print(f"\r{line}", end="", flush=True)
-            else:
-                print("\n" + line)  # print other output normally
+        try:
+            for line in process.stdout:
+                line = line.rstrip()
+                stdout_full.append(line)
 
-        process.wait()
+                offset = parse_cli_progress(line, state.total)
+                if offset is None:
+                    print("\n" + line)  # print other output normally
+                elif progress:
+                    state.offset = offset
+                    progress(state)
 
-        # Read remaining stderr
-        stderr_output = process.stderr.read()
-        if stderr_output:
-            stderr_full.append(stderr_output.strip())
+            process.wait()
 
-    except Exception as e:
-        process.kill()
-        return "", f"Error: {str(e)}"
+            # Read remaining stderr
+            stderr_output = process.stderr.read()
+            if stderr_output:
+                stderr_full.append(stderr_output.strip())
+                t.error = stderr_full[-1]
+
+        except Exception as e:
+            process.kill()
+            t.error = str(e)
+            return "", f"Error: {str(e)}"
+        return "\n".join(stdout_full), "\n".join(stderr_full)
 
-    print()  # move to new line after progress
-    return "\n".join(stdout_full), "\n".join(stderr_full)
+    with trace("image upload", device) as t:
+        t.bytes_sent = state.total
+        stdout, stderr = _cli_call(device, upload, PRIORITY_BULK, t)
+
+    if progress is print_upload_progress:
+        print()  # move to new line after progress
+    return stdout, stderr
 
 
 def run_mcumgr_image_list_command(device: str, timeout=None) -> tuple[str, str]:
@@ -81,47 +518,100 @@ def run_mcumgr_image_list_command(device: str, timeout=None) -> tuple[str, str]:
         "--connstring", f"dev={device},baud={BAUD_RATE}"
     ]
     command = ["./mcumgr"] + conn_args + ["image", "list"]
-    try:
-        if timeout:
-            result = subprocess.run(command, capture_output=True, text=True, check=True, timeout=timeout)
-        else:
-            result = subprocess.run(command, capture_output=True, text=True, check=True)
-        return result.stdout, ""
-    except subprocess.CalledProcessError as e:
-        return e.stdout or "", e.stderr or "Unknown error"
+    with trace("image list", device) as t:
+        try:
+            result = _cli_call(device, lambda: _run_cli(command, t, timeout or None), PRIORITY_BULK, t)
+            return result.stdout, ""
+        except subprocess.CalledProcessError as e:
+            return e.stdout or "", e.stderr or "Unknown error"
+        except subprocess.TimeoutExpired:
+            return "", "Command timed out"
+
+
+def parse_image_state(output: str) -> list[dict]:
+    """
+    Image slots from the output of ./mcumgr image list, in the form run_smp_image_state_command returns:
+    image, slot, version, hash (bytes), active, confirmed, pending.
+    """
+    images = []
+    for line in output.splitlines():
+        line = line.strip()
+        # a slot starts at its "image=0 slot=1" header, or at its version when there are no headers
+        if line.startswith("image=") or (line.startswith("version:") and (not images or "version" in images[-1])):
+            images.append({"image": 0, "slot": len(images), "active": False, "confirmed": False, "pending": False})
+            for field in line.split():
+                name, _, value = field.partition("=")
+                if name in ("image", "slot") and value.isdigit():
+                    images[-1][name] = int(value)
+        if not images or ":" not in line:
+            continue
+        name, value = (part.strip() for part in line.split(":", 1))
+        if name == "version":
+            images[-1]["version"] = value
+        elif name == "hash":
+            try:
+                images[-1]["hash"] = bytes.fromhex(value)
+            except ValueError:
+                pass
+        elif name == "flags":
+            for flag in ("active", "confirmed", "pending"):
+                images[-1][flag] = flag in value.split()
+        elif name in ("active", "confirmed", "pending"):
+            images[-1][name] = value == "true"
+    return images
+
+
+def run_mcumgr_image_state_command(device: str, timeout=None) -> tuple[list[dict] | None, str]:
+    """Image slots as run_smp_image_state_command reports them, over the transport USE_NATIVE_SMP selects."""
+    if USE_NATIVE_SMP:
+        return run_smp_image_state_command(device, timeout or 4)
+    stdout, stderr = run_mcumgr_image_list_command(device, timeout)
+    if stderr:
+        return None, stderr
+    return parse_image_state(stdout), ""
 
 
 def run_mcumgr_image_confirm_command(device: str, hash: str) -> tuple[str, str]:
+    if USE_NATIVE_SMP:
+        images, stderr = run_smp_image_confirm_command(device, bytes.fromhex(hash))
+        return ("" if stderr else "ok"), stderr
     conn_args = [
         "--conntype", "serial",
         "--connstring", f"dev={device},baud={BAUD_RATE}"
     ]
     command = ["./mcumgr"] + conn_args + ["image", "confirm", hash]
-    try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        return result.stdout, ""
-    except subprocess.CalledProcessError as e:
-        return e.stdout or "", e.stderr or "Unknown error"
+    with trace("image confirm", device) as t:
+        try:
+            result = _cli_call(device, lambda: _run_cli(command, t), PRIORITY_BULK, t)
+            return result.stdout, ""
+        except subprocess.CalledProcessError as e:
+            return e.stdout or "", e.stderr or "Unknown error"
 
 
 def run_mcumgr_reset_command(device: str) -> tuple[str, str]:
+    if USE_NATIVE_SMP:
+        return run_smp_reset_command(device)
     conn_args = [
         "--conntype", "serial",
         "--connstring", f"dev={device},baud={BAUD_RATE}"
     ]
     command = ["./mcumgr"] + conn_args + ["reset"]
-    try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        return result.stdout, ""
-    except subprocess.CalledProcessError as e:
-        return e.stdout or "", e.stderr or "Unknown error"
+    with trace("reset", device) as t:
+        try:
+            result = _cli_call(device, lambda: _run_cli(command, t), PRIORITY_BULK, t)
+            return result.stdout, ""
+        except subprocess.CalledProcessError as e:
+            return e.stdout or "", e.stderr or "Unknown error"
 
 
 def parse_output(cmd: str, raw: str, full_cmd: str) -> (str | None, str | None):
     lines = raw.strip().splitlines()
     if len(lines) < 3:
         return None, f"{full_cmd} -> None"
-    data = lines[2]
+    return parse_data_line(cmd, lines[2], full_cmd)
+
+
+def parse_data_line(cmd: str, data: str, full_cmd: str) -> (str | None, str | None):
     if data.startswith(cmd) or data.lower().startswith(cmd):
         return data[len(cmd):].strip(), f"{full_cmd} -> {data}"
     if cmd.startswith("version"):
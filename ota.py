@@ -1,23 +1,55 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
 
+OTA_BASE_URL = os.environ.get("ATMOTUBE_OTA_URL", "https://ota2.atmotube.com")
+CHANNEL_PATHS = {
+    "stable": "/api/v1-public/ota",
+    "recovery": "/api/v1-public/ota?fw=3.0.0",
+    "recovery_beta": "/api/v1-public/ota?fw=2.0.0",
+}
+# devices on the same firmware get the same answer, ask again after this many seconds
+CHECK_TTL = 600
+CHECK_WORKERS = 8
 
-def check_firmware_update(mac: str, fw_version: str, recovery: bool = False, beta: bool = False) -> dict | None:
+
+def make_session(pool_size: int = CHECK_WORKERS) -> requests.Session:
+    """Session keeping up to pool_size connections alive, one per concurrent check."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+SESSION = make_session()
+
+
+def _channel(recovery: bool, beta: bool) -> str:
     if recovery:
-        if beta:
-            url = "https://ota2.atmotube.com/api/v1-public/ota?fw=2.0.0"
-        else:
-            url = "https://ota2.atmotube.com/api/v1-public/ota?fw=3.0.0"
-    else:
-        url = "https://ota2.atmotube.com/api/v1-public/ota"
+        return "recovery_beta" if beta else "recovery"
+    return "stable"
+
+
+def query_ota(session: requests.Session, mac: str, fw_version: str, channel: str = "stable") -> dict | None:
+    """The update offered for fw_version, None when up to date. Raises requests.RequestException."""
     params = {"mac": mac.upper(), "fw": fw_version}
+    response = session.get(OTA_BASE_URL + CHANNEL_PATHS[channel], params=params, timeout=5)
+    response.raise_for_status()
+    data = response.json()
+    if data.get("status") == 0 and "data" in data and 'ver' in data["data"]:
+        return data["data"]
+    return None
 
-    try:
-        response = requests.get(url, params=params, timeout=5)
-        response.raise_for_status()
-        data = response.json()
 
-        if data.get("status") == 0 and "data" in data and 'ver' in data["data"]:
-            update_info = data["data"]
+def check_firmware_update(mac: str, fw_version: str, recovery: bool = False, beta: bool = False) -> dict | None:
+    try:
+        update_info = query_ota(SESSION, mac, fw_version, _channel(recovery, beta))
+        if update_info:
             print(f"Update available: {update_info['ver']}")
             return update_info
         else:
@@ -28,9 +60,77 @@ def check_firmware_update(mac: str, fw_version: str, recovery: bool = False, bet
         return None
 
 
+class OtaChecker:
+    """
+    Update checks for many devices over one pooled session.
+
+    Answers are cached per (firmware, channel) for ttl seconds and concurrent checks of the same
+    pair share one request. Failed checks are not cached.
+    """
+
+    def __init__(self, session: requests.Session | None = None, ttl: float = CHECK_TTL,
+                 workers: int = CHECK_WORKERS):
+        self.session = session or make_session(workers)
+        self.ttl = ttl
+        self.workers = workers
+        self.requests = 0
+        self._cache: dict[tuple[str, str], tuple[float, dict | None]] = {}
+        self._inflight: dict[tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+
+    def check(self, mac: str, fw_version: str, channel: str = "stable") -> dict | None:
+        """Offered update for a device, None when up to date. Raises requests.RequestException."""
+        key = (fw_version, channel)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+                self.requests += 1
+        if not owner:
+            return future.result()
+        try:
+            update_info = query_ota(self.session, mac, fw_version, channel)
+            with self._lock:
+                self._cache[key] = (time.monotonic() + self.ttl, update_info)
+            future.set_result(update_info)
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return future.result()
+
+    def check_many(self, devices: list[tuple[str, str]], channel: str = "stable") -> list[dict | None]:
+        """check() for (mac, firmware) pairs concurrently, in order. A failed check gives None and is printed."""
+        def safe_check(device):
+            mac, fw_version = device
+            try:
+                return self.check(mac, fw_version, channel)
+            except requests.RequestException as e:
+                print(f"Failed to check update for {mac}: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ota-check") as executor:
+            return list(executor.map(safe_check, devices))
+
+    def invalidate(self, fw_version: str | None = None):
+        with self._lock:
+            if fw_version is None:
+                self._cache.clear()
+            else:
+                self._cache = {k: v for k, v in self._cache.items() if k[0] != fw_version}
+
+
+OTA_CHECKER = OtaChecker(SESSION)
+
+
 def download_file(url: str, output_path: str) -> bool:
     try:
-        response = requests.get(url, stream=True, timeout=10)
+        response = SESSION.get(url, stream=True, timeout=10)
         response.raise_for_status()
 
         with open(output_path, "wb") as f:
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class OtaStub:
+    """
+    Local stand-in for the OTA server, for trying the firmware cache and update checks without network.
+
+    Firmware added with add_firmware is served at /fw/<version>.bin with an ETag and Last-Modified,
+    conditional requests get 304. /api/v1-public/ota offers the latest added version to any other
+    firmware, so set ota.OTA_BASE_URL to base_url. hits counts the requests per path.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.firmware: dict[str, tuple[bytes, str, str]] = {}
+        self.latest = None
+        self.hits: dict[str, int] = {}
+        self.downloads = 0     # 200 responses with a firmware body
+        self.delay = 0.0       # seconds before answering, to make concurrent requests overlap
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def add_firmware(self, version: str, data: bytes) -> dict:
+        """Serve data as firmware version, returns the matching OTA answer data."""
+        etag = f'"{hashlib.sha256(data).hexdigest()}"'
+        self.firmware[version] = (data, etag, formatdate(usegmt=True))
+        self.latest = {"ver": version, "url": f"{self.base_url}/fw/{version}.bin"}
+        return dict(self.latest)
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._server.serve_forever, name="ota-stub", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                with stub._lock:
+                    stub.hits[path] = stub.hits.get(path, 0) + 1
+                if stub.delay:
+                    threading.Event().wait(stub.delay)
+                if path.startswith("/fw/") and path.endswith(".bin"):
+                    return self.send_firmware(path[4:-4])
+                if path == "/api/v1-public/ota":
+                    return self.send_ota(parse_qs(self.path.partition("?")[2]))
+                self.send_body(404, b"not found", "text/plain")
+
+            def send_firmware(self, version: str):
+                if version not in stub.firmware:
+                    return self.send_body(404, b"not found", "text/plain")
+                data, etag, modified = stub.firmware[version]
+                if self.headers.get("If-None-Match") == etag or \
+                        self.headers.get("If-None-Match") is None and self.headers.get("If-Modified-Since") == modified:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                with stub._lock:
+                    stub.downloads += 1
+                self.send_body(200, data, "application/octet-stream", {"ETag": etag, "Last-Modified": modified})
+
+            def send_ota(self, query: dict):
+                if stub.latest and stub.latest["ver"] not in query.get("fw", []):
+                    answer = {"status": 0, "data": stub.latest}
+                else:
+                    answer = {"status": 1}
+                self.send_body(200, json.dumps(answer).encode(), "application/json")
+
+            def send_body(self, status: int, body: bytes, content_type: str, headers: dict | None = None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
@@ -0,0 +1,80 @@
+import queue
+import threading
+import time
+from typing import Callable, Iterable
+
+_DONE = object()
+
+
+class PipelineStats:
+    def __init__(self, stage_names: list[str]):
+        self.stage_names = stage_names
+        self.busy = {name: 0.0 for name in stage_names}
+        self.items = 0
+        self.failed = 0
+        self.wall = 0.0
+
+    @property
+    def overlap(self) -> float:
+        """Seconds saved compared to running every stage back to back."""
+        return max(0.0, sum(self.busy.values()) - self.wall)
+
+    def __str__(self):
+        busy = ", ".join(f"{name} {self.busy[name]:.2f}s" for name in self.stage_names)
+        serial_time = sum(self.busy.values())
+        percent = 100 * self.overlap / serial_time if serial_time else 0.0
+        return (f"Pipeline: {self.items} items ({self.failed} failed) in {self.wall:.2f}s | busy: {busy} | "
+                f"overlap {self.overlap:.2f}s ({percent:.0f}% of sequential time)")
+
+
+def run_pipeline(items: Iterable, stages: list[tuple[str, Callable]], queue_size: int = 2) -> PipelineStats:
+    """
+    Run every item through the stages, each stage in its own thread.
+
+    Stages are connected by bounded queues, so a fast stage blocks once it is queue_size items
+    ahead of the next one. A stage returning None drops the item, an exception in a stage is
+    printed and drops the item as well. The last stage's return value is ignored.
+    """
+    names = [name for name, _ in stages]
+    stats = PipelineStats(names)
+    lock = threading.Lock()
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+
+    def worker(index: int, name: str, func: Callable):
+        inbox = queues[index]
+        outbox = queues[index + 1] if index + 1 < len(queues) else None
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                break
+            started = time.perf_counter()
+            try:
+                result = func(item)
+                ok = result is not None or outbox is None
+            except Exception as e:
+                print(f"{name} failed: {e}")
+                result, ok = None, False
+            elapsed = time.perf_counter() - started
+            with lock:
+                stats.busy[name] += elapsed
+                if not ok:
+                    stats.failed += 1
+                elif outbox is None:
+                    stats.items += 1
+            if ok and outbox is not None:
+                outbox.put(result)
+        if outbox is not None:
+            outbox.put(_DONE)
+
+    threads = [threading.Thread(target=worker, args=(i, name, func), name=f"pipeline-{name}", daemon=True)
+               for i, (name, func) in enumerate(stages)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for item in items:
+        queues[0].put(item)
+    queues[0].put(_DONE)
+    for thread in threads:
+        thread.join()
+    stats.wall = time.perf_counter() - started
+    return stats
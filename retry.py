@@ -0,0 +1,127 @@
+import random
+import threading
+import time
+from typing import Callable
+
+from tracing import TRACER
+
+DEFAULT_TIMEOUT = 4
+MIN_TIMEOUT = 0.5
+MAX_TIMEOUT = 30
+# timeout = TIMEOUT_FACTOR * p95 of the successful calls of that command
+TIMEOUT_PERCENTILE = 95
+TIMEOUT_FACTOR = 3
+TIMEOUT_MIN_SAMPLES = 5
+
+BREAKER_THRESHOLD = 3      # consecutive transport failures before a port is considered dead
+BREAKER_COOLDOWN = 10.0    # seconds before a dead port is tried again
+
+
+def adaptive_timeout(command: str, default: float = DEFAULT_TIMEOUT) -> float:
+    """Timeout for a traced command name derived from its observed latency, default until enough samples."""
+    if TRACER.sample_count(command) < TIMEOUT_MIN_SAMPLES:
+        return default
+    p = TRACER.percentile(command, TIMEOUT_PERCENTILE)
+    return min(MAX_TIMEOUT, max(MIN_TIMEOUT, p * TIMEOUT_FACTOR))
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, limited by attempts and optionally by a total deadline."""
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.25, max_delay: float = 5.0,
+                 deadline: float | None = None):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before retry number attempt (1 based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, func: Callable[[], object], is_failure: Callable[[object], bool]):
+        """
+        Call func until is_failure(result) is false, the attempts are used up or the deadline passes.
+
+        The last result is returned either way, so callers keep their usual error handling.
+        """
+        started = time.monotonic()
+        result = func()
+        attempt = 1
+        while is_failure(result) and attempt < self.attempts:
+            delay = self.backoff(attempt)
+            if self.deadline is not None:
+                remaining = self.deadline - (time.monotonic() - started)
+                if remaining <= 0:
+                    break
+                delay = min(delay, remaining)
+            time.sleep(delay)
+            result = func()
+            attempt += 1
+        return result
+
+
+# the few call sites that used fixed sleeps and loops
+PROBE_POLICY = RetryPolicy(attempts=3, base_delay=0.25, max_delay=1.0)
+SET_TIME_POLICY = RetryPolicy(attempts=10, base_delay=0.5, max_delay=4.0)
+REBOOT_POLICY = RetryPolicy(attempts=1000, base_delay=0.5, max_delay=5.0, deadline=120)
+CHUNK_POLICY = RetryPolicy(attempts=6, base_delay=0.25, max_delay=4.0)
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Fail fast on a port that stopped answering, probing it again after a cooldown."""
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.opened_at is not None and time.monotonic() - self.opened_at < self.cooldown
+
+    def check(self, device: str):
+        """Raise CircuitOpen while the port is considered dead. After the cooldown one call is let through."""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.cooldown:
+                raise CircuitOpen(f"{device} is not responding, retrying in "
+                                  f"{self.cooldown - (time.monotonic() - self.opened_at):.0f}s")
+            # half open, the next result decides
+            self.opened_at = None
+            self.failures = self.threshold - 1
+
+    def record(self, success: bool):
+        with self._lock:
+            if success:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+_BREAKERS: dict[str, CircuitBreaker] = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def get_breaker(device: str) -> CircuitBreaker:
+    with _BREAKERS_LOCK:
+        breaker = _BREAKERS.get(device)
+        if breaker is None:
+            breaker = _BREAKERS[device] = CircuitBreaker()
+        return breaker
+
+
+def reset_breaker(device: str):
+    with _BREAKERS_LOCK:
+        _BREAKERS.pop(device, None)
@@ -0,0 +1,123 @@
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable
+
+from smp import SmpClient
+
+# Lower value runs first
+PRIORITY_LIVE = 0
+PRIORITY_CONFIG = 1
+PRIORITY_BULK = 2
+
+# The serial port is released after this many idle seconds so other tools can open it,
+# devices polled on a longer interval keep it open between polls, see set_poll_interval
+IDLE_CLOSE_TIMEOUT = 2.0
+
+
+class DeviceScheduler:
+    """
+    Owns the single SMP connection to a device and runs jobs on it one at a time.
+
+    Jobs are callables taking the SmpClient. They are queued by priority class and run in
+    submission order within a class. Bulk transfers submit one job per chunk, so a live
+    reading or a config change waits for at most one chunk instead of the whole transfer.
+    """
+
+    def __init__(self, device: str, baud: int = 1000000, timeout: float = 4,
+                 idle_timeout: float = IDLE_CLOSE_TIMEOUT):
+        self.device = device
+        self.client = SmpClient(device, baud, timeout)
+        self.idle_timeout = idle_timeout
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"scheduler-{device}", daemon=True)
+        self._thread.start()
+
+    def submit(self, job: Callable[[SmpClient], object], priority: int = PRIORITY_LIVE) -> Future:
+        if self._closed:
+            raise RuntimeError(f"Scheduler for {self.device} is closed")
+        future = Future()
+        self._queue.put((priority, next(self._counter), job, future))
+        return future
+
+    def call(self, job: Callable[[SmpClient], object], priority: int = PRIORITY_LIVE):
+        """Run a job and wait for its result, exceptions raised by the job are re-raised."""
+        return self.submit(job, priority).result()
+
+    def release(self):
+        """Close the serial port once the jobs queued so far have run, it reopens on the next job."""
+        self.call(lambda client: client.close(), PRIORITY_BULK)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put((PRIORITY_BULK + 1, next(self._counter), None, None))
+        self._thread.join()
+        self.client.close()
+
+    def _run(self):
+        while True:
+            try:
+                priority, _, job, future = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                self.client.close()
+                continue
+            if job is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(job(self.client))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+_SCHEDULERS: dict[str, DeviceScheduler] = {}
+_SCHEDULERS_LOCK = threading.Lock()
+_IDLE_TIMEOUTS: dict[str, float] = {}
+
+
+def get_scheduler(device: str, baud: int = 1000000, timeout: float = 4) -> DeviceScheduler:
+    with _SCHEDULERS_LOCK:
+        scheduler = _SCHEDULERS.get(device)
+        if scheduler is None:
+            scheduler = DeviceScheduler(device, baud, timeout, _IDLE_TIMEOUTS.get(device, IDLE_CLOSE_TIMEOUT))
+            _SCHEDULERS[device] = scheduler
+        return scheduler
+
+
+def set_poll_interval(device: str, interval: float | None):
+    """
+    Keep the port of a device polled every interval seconds open between polls instead of reopening it
+    for each one. None goes back to closing it after IDLE_CLOSE_TIMEOUT.
+    """
+    idle_timeout = IDLE_CLOSE_TIMEOUT if interval is None else interval + IDLE_CLOSE_TIMEOUT
+    with _SCHEDULERS_LOCK:
+        if interval is None:
+            _IDLE_TIMEOUTS.pop(device, None)
+        else:
+            _IDLE_TIMEOUTS[device] = idle_timeout
+        scheduler = _SCHEDULERS.get(device)
+    if scheduler:
+        scheduler.idle_timeout = idle_timeout
+
+
+def release_device(device: str):
+    """Free the serial port for an external process such as the mcumgr CLI."""
+    with _SCHEDULERS_LOCK:
+        scheduler = _SCHEDULERS.get(device)
+    if scheduler:
+        scheduler.release()
+
+
+def close_scheduler(device: str):
+    """Stop the scheduler thread of a device that went away and close its port."""
+    with _SCHEDULERS_LOCK:
+        scheduler = _SCHEDULERS.pop(device, None)
+        _IDLE_TIMEOUTS.pop(device, None)
+    if scheduler:
+        scheduler.close()
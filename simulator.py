@@ -0,0 +1,579 @@
+import argparse
+import base64
+import hashlib
+import os
+import select
+import struct
+import threading
+import time
+import tty
+import unittest
+import zlib
+
+from history import compute_crc8_maxim, VOC_BIT, CO2_BIT, PM_BIT
+from smp import FrameDecoder, SmpError, decode_packet, encode_frames, encode_packet, \
+    OP_READ, OP_WRITE, GROUP_OS, GROUP_IMAGE, GROUP_FS, GROUP_SHELL, \
+    OS_ID_ECHO, OS_ID_RESET, OS_ID_PARAMS, IMAGE_ID_STATE, IMAGE_ID_UPLOAD, FS_ID_FILE, FS_ID_STATUS, FS_ID_HASH, SHELL_ID_EXEC
+
+# mcumgr return codes
+MGMT_ERR_ENOENT = 5
+MGMT_ERR_EINVAL = 3
+MGMT_ERR_ENOTSUP = 8
+
+SIM_MTU = 1024
+# MCUboot image header: magic, load address, header size, protected TLV size, image size, flags, version
+MCUBOOT_MAGIC = 0x96F3B83D
+MCUBOOT_HEADER_FMT = "<IIHHIIBBHI"
+RECORD_INTERVAL = 60
+
+
+def _make_record(ts: int, seq: int) -> bytes:
+    """A VOC + CO2 + PM history record with slowly varying synthetic values."""
+    packet_type = VOC_BIT | CO2_BIT | PM_BIT
+    data = struct.pack("<BBIhBIBH", 1, packet_type, ts, 2150 + seq % 50, 40 + seq % 10, 10132 + seq % 20,
+                       90 - seq % 50, 0)
+    data += struct.pack("<HHH", 100 + seq % 80, 250 + seq % 300, 1 + seq % 20)
+    data += struct.pack("<H", 450 + seq % 500)
+    data += struct.pack("<HHH", 30 + seq % 40, 55 + seq % 90, 70 + seq % 150)
+    return data + bytes([compute_crc8_maxim(data)])
+
+
+def _int_arg(value: str, low: int, high: int) -> int | None:
+    try:
+        number = int(value)
+    except ValueError:
+        return None
+    return number if low <= number <= high else None
+
+
+def _float_arg(value: str, low: float, high: float) -> float | None:
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return number if low <= number <= high else None
+
+
+class SimulatedDevice:
+    """State and command handling of an Atmotube PRO 2, without any transport."""
+
+    def __init__(self, mac: str = "C0:FF:EE:00:00:01", serial_number: str = "SIM0000001", fw: str = "3.1.0",
+                 history_files: int = 4, records_per_file: int = 1440):
+        self.mac = mac
+        self.serial_number = serial_number
+        self.fw = fw
+        self.hw = "2.0"
+        self.time_offset = 0
+        self.pm = {"state": 1, "mode": 2, "charging": 0, "limit": 1000, "keepalive": 0}
+        self.history_mode = 0
+        self.interval = [60, 0]
+        self.calibration = [0.0, 0]
+        self.button = [1, 1]
+        self.voc_mode = 1
+        self.gnss = {"mode": 1, "timer": 10}
+        self.files: dict[str, bytearray] = {}
+        self.upload = None          # image upload in progress: sha, len, data
+        self.secondary = None       # uploaded image in slot 1: version, hash
+        self._lock = threading.Lock()
+
+        # history is generated backwards from now, the active file keeps growing while the simulator runs
+        now = int(time.time())
+        start = now - (history_files + 1) * records_per_file * RECORD_INTERVAL
+        seq = 0
+        for i in range(history_files):
+            file_start = start + i * records_per_file * RECORD_INTERVAL
+            content = bytearray()
+            for n in range(records_per_file):
+                content += _make_record(file_start + n * RECORD_INTERVAL, seq)
+                seq += 1
+            self.files[f"/fs/h_new/{file_start}"] = content
+        self._active_start = start + history_files * records_per_file * RECORD_INTERVAL
+        self._active_name = f"/fs/h_active/{self._active_start}"
+        self.files[self._active_name] = bytearray()
+        self._seq = seq
+        self._grow_active()
+
+    def now(self) -> int:
+        return int(time.time()) + self.time_offset
+
+    def _grow_active(self):
+        """Append the records the sensor would have written since the last call."""
+        active = self.files.get(self._active_name)
+        if active is None:
+            return
+        due = (self.now() - self._active_start) // RECORD_INTERVAL + 1
+        written = len(active) // len(_make_record(0, 0))
+        for n in range(written, due):
+            active += _make_record(self._active_start + n * RECORD_INTERVAL, self._seq)
+            self._seq += 1
+
+    def current_record(self) -> bytes:
+        return _make_record(self.now(), self._seq)
+
+    def shell(self, argv: list[str]) -> tuple[str, int]:
+        """Run a shell command, returns (output, return code) like the shell exec handler."""
+        with self._lock:
+            self._grow_active()
+            for words in (2, 1):
+                name = " ".join(argv[:words])
+                handler = SHELL_COMMANDS.get(name)
+                if handler and len(argv) >= words:
+                    result = handler(self, argv[words:])
+                    return f"{name} {result}", 0
+        return f"{argv[0] if argv else ''}: command not found", 1
+
+    # --- shell command handlers, return the text printed after the command name ---
+
+    def cmd_time(self, args):
+        if not args:
+            return str(self.now())
+        ts = _int_arg(args[0], 0, 0xFFFFFFFF)
+        if ts is None:
+            return "err"
+        self.time_offset = ts - int(time.time())
+        return "ok"
+
+    def cmd_mac(self, args):
+        return self.mac
+
+    def cmd_identity(self, args):
+        # the serial number is the fifth field, see summarize_device
+        return f"atmotube_pro2 {self.hw} nrf5340 1 {self.serial_number} {self.mac.replace(':', '')}"
+
+    def cmd_version(self, args):
+        return self.fw
+
+    def cmd_version_hw(self, args):
+        return self.hw
+
+    def cmd_data_get(self, args):
+        return base64.b64encode(self.current_record()).decode()
+
+    def cmd_history_get(self, args):
+        return "".join(f"{name},{len(content)};" for name, content in sorted(self.files.items()) if content)
+
+    def cmd_history_last(self, args):
+        active = self.files.get(self._active_name)
+        size = len(_make_record(0, 0))
+        if not active:
+            return ""
+        return base64.b64encode(bytes(active[-size:])).decode()
+
+    def cmd_history_mode(self, args):
+        if not args:
+            return str(self.history_mode)
+        mode = _int_arg(args[0], 0, 3)
+        if mode is None:
+            return "err"
+        self.history_mode = mode
+        return "ok"
+
+    def cmd_history_clear(self, args):
+        self.files = {self._active_name: bytearray()}
+        self._active_start = self.now()
+        return "ok"
+
+    def cmd_history_sync(self, args):
+        if not args or not args[0].startswith("/fs/h_new/") or args[0] not in self.files:
+            return "err"
+        self.files["/fs/h_sync/" + args[0].split("/")[-1]] = self.files.pop(args[0])
+        return "ok"
+
+    def cmd_history_rm(self, args):
+        if not args or args[0] not in self.files or args[0] == self._active_name:
+            return "err"
+        del self.files[args[0]]
+        return "ok"
+
+    def cmd_pm_on(self, args):
+        self.pm["state"] = 1
+        return "ok"
+
+    def cmd_pm_off(self, args):
+        self.pm["state"] = 0
+        return "ok"
+
+    def cmd_pm_status(self, args):
+        return f"{self.pm['state']} {self.pm['mode']} {self.pm['charging']} {self.pm['keepalive']}"
+
+    def cmd_pm_mode(self, args):
+        if len(args) != 2:
+            return "err"
+        mode, charging = _int_arg(args[0], 0, 4), _int_arg(args[1], 0, 1)
+        if mode is None or charging is None:
+            return "err"
+        self.pm["mode"], self.pm["charging"] = mode, charging
+        return "ok"
+
+    def cmd_pm_limit(self, args):
+        if not args:
+            return str(self.pm["limit"])
+        limit = _int_arg(args[0], 1000, 65500)
+        if limit is None:
+            return "err"
+        self.pm["limit"] = limit
+        return "ok"
+
+    def cmd_pm_clean(self, args):
+        return "ok"
+
+    def cmd_pm_keepalive(self, args):
+        seconds = _int_arg(args[0], 1, 600) if args else None
+        if seconds is None:
+            return "err"
+        self.pm["keepalive"] = seconds
+        return "ok"
+
+    def cmd_interval(self, args):
+        if not args:
+            return f"{self.interval[0]} {self.interval[1]}"
+        seconds = _int_arg(args[0], 1, 60)
+        mode = _int_arg(args[1], 0, 3) if len(args) > 1 else None
+        if seconds is None or mode is None:
+            return "err"
+        self.interval = [seconds, mode]
+        return "ok"
+
+    def cmd_calibration(self, args):
+        if not args:
+            return f"{self.calibration[0]} {self.calibration[1]}"
+        t = _float_arg(args[0], -5, 5)
+        h = _int_arg(args[1], -10, 10) if len(args) > 1 else None
+        if t is None or h is None:
+            return "err"
+        self.calibration = [t, h]
+        return "ok"
+
+    def cmd_calibration_co2(self, args):
+        ppm = _int_arg(args[0], 400, 5000) if args else None
+        return "err" if ppm is None else "ok"
+
+    def cmd_button_mode(self, args):
+        if not args:
+            return f"{self.button[0]} {self.button[1]}"
+        mode = _int_arg(args[0], 0, 5)
+        pm_mode = _int_arg(args[1], 0, 1) if len(args) > 1 else None
+        if mode is None or pm_mode is None:
+            return "err"
+        self.button = [mode, pm_mode]
+        return "ok"
+
+    def cmd_voc_mode(self, args):
+        if not args:
+            return str(self.voc_mode)
+        mode = _int_arg(args[0], 0, 1)
+        if mode is None:
+            return "err"
+        self.voc_mode = mode
+        return "ok"
+
+    def cmd_gnss_mode(self, args):
+        mode = _int_arg(args[0], 0, 2) if args else None
+        if mode is None:
+            return "err"
+        self.gnss["mode"] = mode
+        return "ok"
+
+    def cmd_gnss_timer(self, args):
+        timer = _int_arg(args[0], 1, 3600) if args else None
+        if timer is None:
+            return "err"
+        self.gnss["timer"] = timer
+        return "ok"
+
+    def cmd_gnss_status(self, args):
+        return "0"
+
+    def cmd_gnss_info(self, args):
+        return "0 0.000000 0.000000 0 0/0"
+
+    def cmd_battery_status(self, args):
+        return "12 97"
+
+    def cmd_reboot(self, args):
+        return "ok"
+
+    # --- SMP groups other than shell ---
+
+    def fs_read(self, name: str, offset: int, chunk: int) -> dict:
+        with self._lock:
+            self._grow_active()
+            content = self.files.get(name)
+            if content is None:
+                raise SmpError(f"No such file {name}", MGMT_ERR_ENOENT)
+            if offset > len(content):
+                raise SmpError(f"Offset {offset} past end of {name}", MGMT_ERR_EINVAL)
+            rsp = {"off": offset, "data": bytes(content[offset:offset + chunk])}
+            if offset == 0:
+                rsp["len"] = len(content)
+            return rsp
+
+    def fs_status(self, name: str) -> dict:
+        with self._lock:
+            content = self.files.get(name)
+            if content is None:
+                raise SmpError(f"No such file {name}", MGMT_ERR_ENOENT)
+            return {"len": len(content)}
+
+    def fs_hash(self, name: str, hash_type: str, offset: int, length: int | None) -> dict:
+        with self._lock:
+            content = self.files.get(name)
+            if content is None:
+                raise SmpError(f"No such file {name}", MGMT_ERR_ENOENT)
+            part = bytes(content[offset:] if length is None else content[offset:offset + length])
+        if hash_type == "sha256":
+            output = hashlib.sha256(part).digest()
+        elif hash_type == "crc32":
+            output = zlib.crc32(part)
+        else:
+            raise SmpError(f"Unsupported hash {hash_type}", MGMT_ERR_ENOTSUP)
+        return {"type": hash_type, "off": offset, "len": len(part), "output": output}
+
+    def image_state(self) -> dict:
+        image_hash = hashlib.sha256(self.fw.encode()).digest()
+        images = [{"image": 0, "slot": 0, "version": self.fw, "hash": image_hash,
+                   "bootable": True, "confirmed": True, "active": True}]
+        if self.secondary:
+            images.append({"image": 0, "slot": 1, "version": self.secondary["version"],
+                           "hash": self.secondary["hash"], "bootable": True, "confirmed": False, "active": False,
+                           "pending": self.secondary.get("pending", False),
+                           "permanent": self.secondary.get("permanent", False)})
+        return {"images": images}
+
+    def image_set_state(self, image_hash: bytes, confirm: bool) -> dict:
+        with self._lock:
+            if self.secondary and image_hash == self.secondary["hash"]:
+                self.secondary["pending"] = True
+                self.secondary["permanent"] = confirm
+            elif image_hash != hashlib.sha256(self.fw.encode()).digest():
+                raise SmpError("No image with that hash", MGMT_ERR_EINVAL)
+        return self.image_state()
+
+    def reboot(self):
+        """Boot a pending image from slot 1, MCUboot swaps it into slot 0."""
+        with self._lock:
+            if self.secondary and self.secondary.get("pending"):
+                self.fw = self.secondary["version"]
+                self.secondary = None
+                self.upload = None
+
+    def image_upload(self, payload: dict) -> dict:
+        """Like Zephyr img_mgmt: data that is not at the expected offset is dropped and the expected
+        offset returned, a first chunk with the sha of the upload in progress resumes it."""
+        with self._lock:
+            offset = payload.get("off", 0)
+            upload = self.upload
+            if offset == 0:
+                if upload and payload.get("sha") and payload.get("sha") == upload["sha"]:
+                    return {"off": len(upload["data"])}
+                if "len" not in payload:
+                    raise SmpError("First image chunk without length", MGMT_ERR_EINVAL)
+                upload = self.upload = {"sha": payload.get("sha"), "len": payload["len"], "data": bytearray()}
+                self.secondary = None
+            if upload is None or offset != len(upload["data"]):
+                return {"off": len(upload["data"]) if upload else 0}
+            upload["data"] += payload.get("data", b"")
+            if len(upload["data"]) >= upload["len"]:
+                image = bytes(upload["data"][:upload["len"]])
+                self.secondary = {"version": _image_version(image), "hash": hashlib.sha256(image).digest()}
+            return {"off": len(upload["data"])}
+
+
+def _image_version(image: bytes) -> str:
+    if len(image) >= struct.calcsize(MCUBOOT_HEADER_FMT):
+        magic, _, _, _, _, _, major, minor, revision, build = struct.unpack_from(MCUBOOT_HEADER_FMT, image)
+        if magic == MCUBOOT_MAGIC:
+            return f"{major}.{minor}.{revision}"
+    return "0.0.0"
+
+
+SHELL_COMMANDS = {
+    "time": SimulatedDevice.cmd_time,
+    "mac": SimulatedDevice.cmd_mac,
+    "identity": SimulatedDevice.cmd_identity,
+    "version app": SimulatedDevice.cmd_version,
+    "version hw": SimulatedDevice.cmd_version_hw,
+    "data get": SimulatedDevice.cmd_data_get,
+    "history get": SimulatedDevice.cmd_history_get,
+    "history last": SimulatedDevice.cmd_history_last,
+    "history mode": SimulatedDevice.cmd_history_mode,
+    "history clear": SimulatedDevice.cmd_history_clear,
+    "history sync": SimulatedDevice.cmd_history_sync,
+    "history rm": SimulatedDevice.cmd_history_rm,
+    "pm on": SimulatedDevice.cmd_pm_on,
+    "pm off": SimulatedDevice.cmd_pm_off,
+    "pm status": SimulatedDevice.cmd_pm_status,
+    "pm mode": SimulatedDevice.cmd_pm_mode,
+    "pm limit": SimulatedDevice.cmd_pm_limit,
+    "pm clean": SimulatedDevice.cmd_pm_clean,
+    "pm keepalive": SimulatedDevice.cmd_pm_keepalive,
+    "interval": SimulatedDevice.cmd_interval,
+    "calibration": SimulatedDevice.cmd_calibration,
+    "calibration_co2": SimulatedDevice.cmd_calibration_co2,
+    "button mode": SimulatedDevice.cmd_button_mode,
+    "voc mode": SimulatedDevice.cmd_voc_mode,
+    "gnss mode": SimulatedDevice.cmd_gnss_mode,
+    "gnss timer": SimulatedDevice.cmd_gnss_timer,
+    "gnss status": SimulatedDevice.cmd_gnss_status,
+    "gnss info": SimulatedDevice.cmd_gnss_info,
+    "battery status": SimulatedDevice.cmd_battery_status,
+    "reboot": SimulatedDevice.cmd_reboot,
+}
+
+
+class Simulator:
+    """
+    Serve a SimulatedDevice over SMP on a pseudo-terminal.
+
+    Responses are delayed by their serial transfer time at baud (10 bits per byte) plus latency
+    seconds of device processing, so throughput numbers are comparable to a real link.
+    """
+
+    def __init__(self, device: SimulatedDevice | None = None, baud: int = 1000000, latency: float = 0.002,
+                 mtu: int = SIM_MTU, reboot_time: float = 2.0):
+        self.device = device or SimulatedDevice()
+        self.baud = baud
+        self.latency = latency
+        self.mtu = mtu
+        self.reboot_time = reboot_time
+        self.port = None
+        self.requests = 0
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._rebooting_until = 0.0
+
+    def start(self) -> str:
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._thread = threading.Thread(target=self._serve, name="atmotube-simulator", daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _serve(self):
+        decoder = FrameDecoder()
+        pending = b""
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._master], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                pending += os.read(self._master, 4096)
+            except OSError:
+                break
+            while b"\n" in pending:
+                line, pending = pending.split(b"\n", 1)
+                try:
+                    packet = decoder.feed_line(line)
+                except SmpError:
+                    continue
+                if packet is not None:
+                    self._respond(packet)
+
+    def _respond(self, packet: bytes):
+        op, group, cmd_id, seq, payload = decode_packet(packet)
+        self.requests += 1
+        if time.monotonic() < self._rebooting_until:
+            return
+        try:
+            rsp = self.handle(op, group, cmd_id, payload)
+        except SmpError as e:
+            rsp = {"rc": e.rc or 1}
+        frames = encode_frames(encode_packet(op + 1, group, cmd_id, seq, rsp))
+        time.sleep(self.latency + (len(packet) + len(frames)) * 10 / self.baud)
+        os.write(self._master, frames)
+
+    def _reboot(self):
+        # the response to the reset request still goes out, then the device is silent for reboot_time
+        self._rebooting_until = time.monotonic() + self.reboot_time
+        self.device.reboot()
+
+    def handle(self, op: int, group: int, cmd_id: int, payload: dict) -> dict:
+        device = self.device
+        if group == GROUP_SHELL and cmd_id == SHELL_ID_EXEC and op == OP_WRITE:
+            output, ret = device.shell([str(arg) for arg in payload.get("argv", [])])
+            if payload.get("argv", [None])[0] == "reboot":
+                self._reboot()
+            return {"o": output + "\n", "ret": ret}
+        if group == GROUP_FS and cmd_id == FS_ID_FILE and op == OP_READ:
+            # leave room for the header and the CBOR keys of the response
+            return device.fs_read(payload["name"], payload.get("off", 0), self.mtu - 64)
+        if group == GROUP_FS and cmd_id == FS_ID_STATUS:
+            return device.fs_status(payload["name"])
+        if group == GROUP_FS and cmd_id == FS_ID_HASH:
+            return device.fs_hash(payload["name"], payload.get("type", "sha256"), payload.get("off", 0),
+                                  payload.get("len"))
+        if group == GROUP_OS and cmd_id == OS_ID_ECHO:
+            return {"r": payload.get("d", "")}
+        if group == GROUP_OS and cmd_id == OS_ID_PARAMS:
+            return {"buf_size": self.mtu, "buf_count": 4}
+        if group == GROUP_OS and cmd_id == OS_ID_RESET:
+            self._reboot()
+            return {}
+        if group == GROUP_IMAGE and cmd_id == IMAGE_ID_STATE and op == OP_READ:
+            return device.image_state()
+        if group == GROUP_IMAGE and cmd_id == IMAGE_ID_STATE and op == OP_WRITE:
+            return device.image_set_state(payload.get("hash", b""), payload.get("confirm", False))
+        if group == GROUP_IMAGE and cmd_id == IMAGE_ID_UPLOAD and op == OP_WRITE:
+            return device.image_upload(payload)
+        raise SmpError(f"Unsupported group {group} id {cmd_id}", MGMT_ERR_ENOTSUP)
+
+
+def run_command_tests(port: str) -> unittest.TestResult:
+    """Run the hardware command tests against a port, e.g. a simulator."""
+    import mcumgr_wrapper
+    import test
+
+    # the simulator answers SMP frames, the tests go through the native client rather than ./mcumgr
+    use_native_smp = mcumgr_wrapper.USE_NATIVE_SMP
+    mcumgr_wrapper.USE_NATIVE_SMP = True
+    test.device_path = port
+    try:
+        suite = unittest.TestLoader().loadTestsFromTestCase(test.AtmocubeCommandTests)
+        return unittest.TextTestRunner(verbosity=2).run(suite)
+    finally:
+        mcumgr_wrapper.USE_NATIVE_SMP = use_native_smp
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated Atmotube PRO 2 on a pseudo-terminal")
+    parser.add_argument("--baud", type=int, default=1000000, help="modelled serial speed")
+    parser.add_argument("--latency", type=float, default=0.002, help="device processing time per request (s)")
+    parser.add_argument("--files", type=int, default=4, help="number of synthetic history files")
+    parser.add_argument("--records", type=int, default=1440, help="records per history file")
+    parser.add_argument("--test", action="store_true", help="run AtmocubeCommandTests against the simulator")
+    args = parser.parse_args()
+
+    device = SimulatedDevice(history_files=args.files, records_per_file=args.records)
+    with Simulator(device, args.baud, args.latency) as simulator:
+        if args.test:
+            result = run_command_tests(simulator.port)
+            raise SystemExit(0 if result.wasSuccessful() else 1)
+        print(f"Simulated Atmotube PRO 2 on {simulator.port} (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
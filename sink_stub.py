@@ -0,0 +1,139 @@
+import json
+import socket
+import socketserver
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sinks import _mqtt_packet, _read_mqtt_packet
+
+
+class _StubServer:
+    def __init__(self, server):
+        self._server = server
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+class MqttBrokerStub(_StubServer):
+    """
+    Local stand-in for an MQTT broker, for trying MqttSink without one. Accepts any client, keeps every
+    published (topic, payload) in messages and acknowledges QoS 1. fail_next drops that many of the
+    next PUBLISH packets together with their connection, to exercise the sink's retries.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.messages: list[tuple[str, bytes]] = []
+        self.connections = 0
+        self.fail_next = 0
+        self._lock = threading.Lock()
+        super().__init__(socketserver.ThreadingTCPServer((host, port), self._handler()))
+
+    @property
+    def url(self) -> str:
+        host, port = self.address
+        return f"mqtt://{host}:{port}/atmotube/{{mac}}"
+
+    def records(self) -> list[dict]:
+        with self._lock:
+            return [json.loads(payload) for topic, payload in self.messages]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                sock: socket.socket = self.request
+                try:
+                    while True:
+                        packet_type, body = _read_mqtt_packet(sock)
+                        kind = packet_type >> 4
+                        if kind == 1:       # CONNECT
+                            with stub._lock:
+                                stub.connections += 1
+                            sock.sendall(_mqtt_packet(0x20, b"\0\0"))
+                        elif kind == 3:     # PUBLISH
+                            with stub._lock:
+                                if stub.fail_next:
+                                    stub.fail_next -= 1
+                                    return
+                            qos = packet_type >> 1 & 3
+                            topic_length = struct.unpack(">H", body[:2])[0]
+                            topic = body[2:2 + topic_length].decode()
+                            offset = 2 + topic_length + (2 if qos else 0)
+                            with stub._lock:
+                                stub.messages.append((topic, body[offset:]))
+                            if qos == 1:
+                                sock.sendall(_mqtt_packet(0x40, body[2 + topic_length:offset]))
+                        elif kind == 12:    # PINGREQ
+                            sock.sendall(_mqtt_packet(0xd0, b""))
+                        elif kind == 14:    # DISCONNECT
+                            return
+                except (ConnectionError, OSError):
+                    return
+
+        return Handler
+
+
+class HttpCollectorStub(_StubServer):
+    """
+    Local stand-in for an HTTP ingestion endpoint, for trying HttpSink. Every POSTed JSON array is kept
+    in batches. fail_next answers that many of the next requests with 503.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.batches: list[list[dict]] = []
+        self.fail_next = 0
+        self._lock = threading.Lock()
+        super().__init__(ThreadingHTTPServer((host, port), self._handler()))
+
+    @property
+    def url(self) -> str:
+        host, port = self.address
+        return f"http://{host}:{port}/ingest"
+
+    def records(self) -> list[dict]:
+        with self._lock:
+            return [record for batch in self.batches for record in batch]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stub._lock:
+                    failing = stub.fail_next > 0
+                    if failing:
+                        stub.fail_next -= 1
+                    else:
+                        stub.batches.append(json.loads(body))
+                self.send_response(503 if failing else 204)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        return Handler
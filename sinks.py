@@ -0,0 +1,343 @@
+import atexit
+import json
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+from urllib.parse import unquote, urlsplit
+
+import requests
+
+from retry import RetryPolicy
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_QUEUE_SIZE = 10000
+SINK_POLICY = RetryPolicy(attempts=5, base_delay=0.5, max_delay=8.0)
+# comma separated sink urls used by history ingestion, see sink_from_url
+SINKS_ENV = "ATMOTUBE_SINKS"
+
+_DONE = object()
+
+
+class SinkError(Exception):
+    pass
+
+
+class Sink:
+    """
+    Destination for records. Subclasses implement write_batch, which gets a list of record dicts and
+    raises on failure; the Publisher around it takes care of batching, queueing and retries.
+    """
+
+    def write_batch(self, records: list[dict]):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __str__(self):
+        return type(self).__name__
+
+
+class NdjsonSink(Sink):
+    """Append one JSON object per line to a file."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write_batch(self, records: list[dict]):
+        with open(self.path, "a") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+
+    def __str__(self):
+        return f"ndjson {self.path}"
+
+
+class HttpSink(Sink):
+    """POST each batch as a JSON array, any non-2xx answer is a failure."""
+
+    def __init__(self, url: str, session: requests.Session | None = None, timeout: float = 10,
+                 headers: dict | None = None):
+        self.url = url
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.headers = headers or {}
+
+    def write_batch(self, records: list[dict]):
+        response = self.session.post(self.url, data=json.dumps(records), timeout=self.timeout,
+                                     headers={"Content-Type": "application/json", **self.headers})
+        response.raise_for_status()
+
+    def __str__(self):
+        return f"http {self.url}"
+
+
+def _mqtt_string(value: str) -> bytes:
+    data = value.encode()
+    return struct.pack(">H", len(data)) + data
+
+
+def _mqtt_packet(packet_type: int, body: bytes) -> bytes:
+    """Fixed header, the packet type byte and the variable length encoded body size, plus body."""
+    length = len(body)
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            break
+    return bytes([packet_type]) + bytes(encoded) + body
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed by the broker")
+        data += chunk
+    return data
+
+
+def _read_mqtt_packet(sock: socket.socket) -> tuple[int, bytes]:
+    packet_type = _recv_exactly(sock, 1)[0]
+    length, shift = 0, 0
+    while True:
+        byte = _recv_exactly(sock, 1)[0]
+        length += (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    return packet_type, _recv_exactly(sock, length)
+
+
+class MqttSink(Sink):
+    """
+    Publish every record as JSON with QoS 1 over MQTT 3.1.1, using a plain socket and only the
+    packets needed for that: CONNECT, PUBLISH, PUBACK and DISCONNECT.
+
+    topic may use record fields, e.g. "atmotube/{mac}", records without the field go to the topic with
+    the placeholder replaced by "unknown". A batch counts as written once the broker acknowledged
+    every message of it; after a failure the connection is opened again and the batch is sent again.
+    """
+
+    def __init__(self, host: str, port: int = 1883, topic: str = "atmotube/{mac}", client_id: str | None = None,
+                 username: str | None = None, password: str | None = None, keepalive: int = 60,
+                 timeout: float = 10):
+        self.host = host
+        self.port = port
+        self.topic = topic
+        self.client_id = client_id or f"atmotube-{os.getpid()}"
+        self.username = username
+        self.password = password
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self._sock = None
+        self._packet_id = 0
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        flags = 0x02   # clean session
+        payload = _mqtt_string(self.client_id)
+        if self.username is not None:
+            flags |= 0x80
+            payload += _mqtt_string(self.username)
+            if self.password is not None:
+                flags |= 0x40
+                payload += _mqtt_string(self.password)
+        body = _mqtt_string("MQTT") + struct.pack(">BBH", 4, flags, self.keepalive) + payload
+        try:
+            sock.sendall(_mqtt_packet(0x10, body))
+            packet_type, body = _read_mqtt_packet(sock)
+            if packet_type != 0x20 or len(body) != 2 or body[1] != 0:
+                raise SinkError(f"MQTT connection refused, return code {body[1] if len(body) == 2 else '?'}")
+        except BaseException:
+            sock.close()
+            raise
+        self._sock = sock
+
+    def _topic(self, record: dict) -> str:
+        return self.topic.format_map(_Unknown((k, v) for k, v in record.items() if v is not None))
+
+    def write_batch(self, records: list[dict]):
+        if self._sock is None:
+            self._connect()
+        pending = set()
+        packets = []
+        for record in records:
+            self._packet_id = self._packet_id % 0xffff + 1
+            pending.add(self._packet_id)
+            body = _mqtt_string(self._topic(record)) + struct.pack(">H", self._packet_id) + json.dumps(record).encode()
+            packets.append(_mqtt_packet(0x32, body))
+        try:
+            self._sock.sendall(b"".join(packets))
+            while pending:
+                packet_type, body = _read_mqtt_packet(self._sock)
+                if packet_type >> 4 == 4:
+                    pending.discard(struct.unpack(">H", body[:2])[0])
+        except BaseException:
+            self._disconnect(graceful=False)
+            raise
+
+    def _disconnect(self, graceful: bool = True):
+        if self._sock is None:
+            return
+        try:
+            if graceful:
+                self._sock.sendall(_mqtt_packet(0xe0, b""))
+        except OSError:
+            pass
+        finally:
+            self._sock.close()
+            self._sock = None
+
+    def close(self):
+        self._disconnect()
+
+    def __str__(self):
+        return f"mqtt {self.host}:{self.port}/{self.topic}"
+
+
+class _Unknown(dict):
+    def __missing__(self, key):
+        return "unknown"
+
+
+class Publisher:
+    """
+    Batches records for one sink in a background thread.
+
+    Records are queued up to queue_size; publish blocks while the queue is full (backpressure), or
+    gives up after timeout and counts the record as dropped. A batch is written when batch_size
+    records are waiting or flush_interval seconds after the first of them, whichever comes first,
+    and retried with SINK_POLICY before it is given up and counted as failed.
+    """
+
+    def __init__(self, sink: Sink, batch_size: int = DEFAULT_BATCH_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 policy: RetryPolicy = SINK_POLICY):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name=f"sink-{sink}", daemon=True)
+        self._thread.start()
+
+    def publish(self, record: dict, timeout: float | None = None) -> bool:
+        """Queue a record, False if the queue stayed full for timeout seconds (None waits for room)."""
+        try:
+            if timeout == 0:
+                self._queue.put_nowait(record)
+            else:
+                self._queue.put(record, timeout=timeout)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def publish_many(self, records: list[dict], timeout: float | None = None) -> int:
+        return sum(self.publish(record, timeout) for record in records)
+
+    def _write(self, batch: list[dict]):
+        def attempt():
+            try:
+                self.sink.write_batch(batch)
+                return None
+            except Exception as e:
+                return e
+
+        error = self.policy.call(attempt, lambda result: result is not None)
+        if error is None:
+            self.written += len(batch)
+        else:
+            self.failed += len(batch)
+            print(f"Sink {self.sink}: dropped {len(batch)} records after retries: {error}", file=sys.stderr)
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            try:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is not None and item is not _DONE:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+            if batch and (item is None or item is _DONE or len(batch) >= self.batch_size
+                          or time.monotonic() >= deadline):
+                self._write(batch)
+                batch, deadline = [], None
+            if item is _DONE:
+                break
+
+    def close(self):
+        """Write what is queued and release the sink."""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_DONE)
+        self._thread.join()
+        self.sink.close()
+
+    def __str__(self):
+        return f"{self.sink}: {self.written} written, {self.failed} failed, {self.dropped} dropped"
+
+
+def sink_from_url(url: str) -> Sink:
+    """
+    Sink for a url:
+
+        mqtt://[user:password@]host[:port]/topic/{mac}   MqttSink, the path is the topic template
+        http://... or https://...                        HttpSink
+        ndjson:path, file:path or a plain path           NdjsonSink
+    """
+    parts = urlsplit(url)
+    if parts.scheme == "mqtt":
+        return MqttSink(parts.hostname, parts.port or 1883, unquote(parts.path.lstrip("/")) or "atmotube/{mac}",
+                        username=unquote(parts.username) if parts.username else None,
+                        password=unquote(parts.password) if parts.password else None)
+    if parts.scheme in ("http", "https"):
+        return HttpSink(url)
+    if parts.scheme in ("ndjson", "file"):
+        return NdjsonSink(url.split(":", 1)[1])
+    return NdjsonSink(url)
+
+
+def prepare_records(records: list[dict], **fields) -> list[dict]:
+    """Decoded history records as published: CRC-valid ones only, without private keys, plus fields."""
+    return [dict({k: v for k, v in record.items() if not k.startswith("_")}, **fields)
+            for record in records if record.get("crc_valid")]
+
+
+def publish_records(publishers: list[Publisher], records: list[dict], timeout: float | None = None):
+    for publisher in publishers:
+        publisher.publish_many(records, timeout)
+
+
+def close_publishers(publishers: list[Publisher]):
+    for publisher in publishers:
+        publisher.close()
+
+
+PUBLISHERS = None
+
+
+def get_publishers() -> list[Publisher]:
+    """Publishers for the sinks in $ATMOTUBE_SINKS, created on first use."""
+    global PUBLISHERS
+    if PUBLISHERS is None:
+        urls = [url.strip() for url in os.environ.get(SINKS_ENV, "").split(",") if url.strip()]
+        PUBLISHERS = [Publisher(sink_from_url(url)) for url in urls]
+        # queued records are written before the program exits
+        atexit.register(close_publishers, PUBLISHERS)
+    return PUBLISHERS
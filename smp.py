@@ -0,0 +1,454 @@
+import base64
+import struct
+import threading
+import time
+
+import serial
+
+# SMP over serial framing (Zephyr "SMP over console"):
+# each packet is length-prefixed, CRC16 protected, base64 encoded and split into
+# newline terminated frames. The first frame starts with 0x06 0x09, the rest with 0x04 0x14.
+FRAME_START = b"\x06\x09"
+FRAME_CONTINUE = b"\x04\x14"
+MAX_FRAME_SIZE = 127
+
+OP_READ = 0
+OP_READ_RSP = 1
+OP_WRITE = 2
+OP_WRITE_RSP = 3
+
+GROUP_OS = 0
+GROUP_IMAGE = 1
+GROUP_FS = 8
+GROUP_SHELL = 9
+
+OS_ID_ECHO = 0
+OS_ID_RESET = 5
+OS_ID_PARAMS = 6
+IMAGE_ID_STATE = 0
+IMAGE_ID_UPLOAD = 1
+FS_ID_FILE = 0
+FS_ID_STATUS = 1
+FS_ID_HASH = 2
+SHELL_ID_EXEC = 0
+
+SMP_HEADER_FMT = ">BBHHBB"
+SMP_HEADER_SIZE = struct.calcsize(SMP_HEADER_FMT)
+
+# Used when the device does not answer the parameters request
+DEFAULT_MTU = 256
+
+
+class SmpError(Exception):
+    """Raised when the device returns a non-zero SMP result code or the transport fails."""
+
+    def __init__(self, message: str, rc: int | None = None):
+        super().__init__(message)
+        self.rc = rc
+
+
+class SmpTimeout(SmpError):
+    pass
+
+
+# --- CBOR (RFC 8949) subset used by SMP ---------------------------------------
+
+def _cbor_head(major: int, value: int) -> bytes:
+    if value < 24:
+        return bytes([(major << 5) | value])
+    if value < 0x100:
+        return bytes([(major << 5) | 24, value])
+    if value < 0x10000:
+        return bytes([(major << 5) | 25]) + struct.pack(">H", value)
+    if value < 0x100000000:
+        return bytes([(major << 5) | 26]) + struct.pack(">I", value)
+    return bytes([(major << 5) | 27]) + struct.pack(">Q", value)
+
+
+def cbor_encode(value) -> bytes:
+    if value is None:
+        return b"\xf6"
+    if value is True:
+        return b"\xf5"
+    if value is False:
+        return b"\xf4"
+    if isinstance(value, int):
+        if value >= 0:
+            return _cbor_head(0, value)
+        return _cbor_head(1, -1 - value)
+    if isinstance(value, float):
+        return b"\xfb" + struct.pack(">d", value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = bytes(value)
+        return _cbor_head(2, len(value)) + value
+    if isinstance(value, str):
+        encoded = value.encode("utf-8")
+        return _cbor_head(3, len(encoded)) + encoded
+    if isinstance(value, (list, tuple)):
+        return _cbor_head(4, len(value)) + b"".join(cbor_encode(v) for v in value)
+    if isinstance(value, dict):
+        return _cbor_head(5, len(value)) + b"".join(cbor_encode(k) + cbor_encode(v) for k, v in value.items())
+    raise TypeError(f"Cannot CBOR encode {type(value).__name__}")
+
+
+def _cbor_decode(data: bytes, offset: int):
+    initial = data[offset]
+    offset += 1
+    major = initial >> 5
+    info = initial & 0x1F
+
+    if major == 7:
+        if info == 20:
+            return False, offset
+        if info == 21:
+            return True, offset
+        if info in (22, 23):
+            return None, offset
+        if info == 25:
+            return struct.unpack_from(">e", data, offset)[0], offset + 2
+        if info == 26:
+            return struct.unpack_from(">f", data, offset)[0], offset + 4
+        if info == 27:
+            return struct.unpack_from(">d", data, offset)[0], offset + 8
+        if info == 31:
+            return _BREAK, offset
+        raise ValueError(f"Unsupported CBOR simple value {info}")
+
+    if info < 24:
+        arg = info
+    elif info == 24:
+        arg = data[offset]
+        offset += 1
+    elif info == 25:
+        arg = struct.unpack_from(">H", data, offset)[0]
+        offset += 2
+    elif info == 26:
+        arg = struct.unpack_from(">I", data, offset)[0]
+        offset += 4
+    elif info == 27:
+        arg = struct.unpack_from(">Q", data, offset)[0]
+        offset += 8
+    elif info == 31:
+        arg = None  # indefinite length
+    else:
+        raise ValueError(f"Invalid CBOR additional info {info}")
+
+    if major == 0:
+        return arg, offset
+    if major == 1:
+        return -1 - arg, offset
+    if major in (2, 3):
+        if arg is None:
+            chunks = []
+            while True:
+                chunk, offset = _cbor_decode(data, offset)
+                if chunk is _BREAK:
+                    break
+                chunks.append(chunk)
+            return (b"" if major == 2 else "").join(chunks), offset
+        if offset + arg > len(data):
+            raise ValueError("Truncated CBOR string")
+        raw = data[offset:offset + arg]
+        return (raw if major == 2 else raw.decode("utf-8")), offset + arg
+    if major == 4:
+        items = []
+        while arg is None or len(items) < arg:
+            item, offset = _cbor_decode(data, offset)
+            if item is _BREAK:
+                break
+            items.append(item)
+        return items, offset
+    if major == 5:
+        result = {}
+        while arg is None or len(result) < arg:
+            key, offset = _cbor_decode(data, offset)
+            if key is _BREAK:
+                break
+            result[key], offset = _cbor_decode(data, offset)
+        return result, offset
+    if major == 6:
+        # tagged item, the tag itself is irrelevant for SMP
+        return _cbor_decode(data, offset)
+    raise ValueError(f"Unsupported CBOR major type {major}")
+
+
+_BREAK = object()
+
+
+def cbor_decode(data: bytes):
+    value, _ = _cbor_decode(data, 0)
+    return value
+
+
+# --- serial framing -----------------------------------------------------------
+
+def crc16_xmodem(data: bytes, crc: int = 0) -> int:
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+    return crc
+
+
+def encode_frames(packet: bytes) -> bytes:
+    body = struct.pack(">H", len(packet) + 2) + packet + struct.pack(">H", crc16_xmodem(packet))
+    encoded = base64.b64encode(body)
+    out = []
+    prefix = FRAME_START
+    # leave room for the 2 byte prefix and the trailing newline
+    step = MAX_FRAME_SIZE - 3
+    step -= step % 4
+    for i in range(0, len(encoded), step):
+        out.append(prefix + encoded[i:i + step] + b"\n")
+        prefix = FRAME_CONTINUE
+    return b"".join(out)
+
+
+class FrameDecoder:
+    """Reassemble SMP packets from serial lines, ignoring any console output in between."""
+
+    def __init__(self):
+        self._buffer = b""
+        self._expected = None
+
+    def feed_line(self, line: bytes) -> bytes | None:
+        line = line.rstrip(b"\r\n")
+        if line.startswith(FRAME_START):
+            self._buffer = b""
+            self._expected = None
+        elif not line.startswith(FRAME_CONTINUE) or self._expected is None and not self._buffer:
+            return None
+        self._buffer += line[2:]
+        try:
+            # base64 is only decodable on 4 byte boundaries, intermediate frames always are
+            decoded = base64.b64decode(self._buffer)
+        except ValueError:
+            return None
+        if self._expected is None and len(decoded) >= 2:
+            self._expected = struct.unpack_from(">H", decoded)[0]
+        if self._expected is None or len(decoded) - 2 < self._expected:
+            return None
+        body = decoded[2:2 + self._expected]
+        self._buffer = b""
+        self._expected = None
+        packet, crc = body[:-2], struct.unpack(">H", body[-2:])[0]
+        if crc16_xmodem(packet) != crc:
+            raise SmpError("SMP frame CRC mismatch")
+        return packet
+
+
+def encode_packet(op: int, group: int, cmd_id: int, seq: int, payload: dict) -> bytes:
+    body = cbor_encode(payload)
+    return struct.pack(SMP_HEADER_FMT, op, 0, len(body), group, seq, cmd_id) + body
+
+
+def decode_packet(packet: bytes) -> tuple[int, int, int, int, dict]:
+    if len(packet) < SMP_HEADER_SIZE:
+        raise SmpError("SMP packet too short")
+    op, flags, length, group, seq, cmd_id = struct.unpack_from(SMP_HEADER_FMT, packet)
+    payload = cbor_decode(packet[SMP_HEADER_SIZE:SMP_HEADER_SIZE + length]) if length else {}
+    return op & 0x07, group, cmd_id, seq, payload
+
+
+# --- client -------------------------------------------------------------------
+
+class SmpClient:
+    """Persistent SMP connection to a device over a serial port."""
+
+    def __init__(self, device: str, baud: int = 1000000, timeout: float = 4):
+        self.device = device
+        self.baud = baud
+        self.timeout = timeout
+        self._serial = None
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._mtu = None
+        self._rx = bytearray()
+        self._written = None
+        self._first_read = None
+        # timings and sizes of the last request, see tracing.CommandTrace.add_smp_stats
+        self.last_stats = {}
+
+    def open(self):
+        if self._serial is None:
+            self._serial = serial.Serial(self.device, self.baud, timeout=0.05)
+        return self
+
+    def close(self):
+        if self._serial is not None:
+            self._serial.close()
+            self._serial = None
+            self._rx.clear()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def request(self, op: int, group: int, cmd_id: int, payload: dict | None = None,
+                timeout: float | None = None) -> dict:
+        """Send one SMP request and wait for the matching response payload."""
+        if timeout is None:
+            timeout = self.timeout
+        with self._lock:
+            self.last_stats = {}
+            self.open()
+            self._reset_input()
+            seq = self._send(op, group, cmd_id, payload or {})
+            _, rsp = self._receive({seq: (op + 1, group, cmd_id)}, time.monotonic() + timeout, timeout)
+            return rsp
+
+    def _reset_input(self):
+        self._serial.reset_input_buffer()
+        self._rx.clear()
+        self.last_stats = {"bytes_sent": 0, "bytes_received": 0, "write_s": 0.0, "wait_s": 0.0, "read_s": 0.0}
+        self._written = None
+        self._first_read = None
+
+    def _send(self, op: int, group: int, cmd_id: int, payload: dict) -> int:
+        """Write one request without waiting for the answer, returns its sequence number."""
+        self._seq = (self._seq + 1) & 0xFF
+        frames = encode_frames(encode_packet(op, group, cmd_id, self._seq, payload))
+        started = time.perf_counter()
+        self._serial.write(frames)
+        self._serial.flush()
+        self._written = time.perf_counter()
+        self.last_stats["bytes_sent"] += len(frames)
+        self.last_stats["write_s"] += self._written - started
+        return self._seq
+
+    def _readline(self, deadline: float) -> bytes | None:
+        # pyserial's readline reads byte by byte, take whatever the driver has buffered instead
+        while True:
+            end = self._rx.find(b"\n")
+            if end >= 0:
+                line = bytes(self._rx[:end + 1])
+                del self._rx[:end + 1]
+                return line
+            if time.monotonic() >= deadline:
+                return None
+            chunk = self._serial.read(self._serial.in_waiting or 1)
+            if chunk:
+                self._rx += chunk
+
+    def _receive(self, expected: dict[int, tuple[int, int, int]], deadline: float,
+                 timeout: float) -> tuple[int, dict]:
+        """
+        Wait for the response to one of the expected requests (seq -> (op, group, id)) and remove it
+        from expected. Unrelated frames and console output are skipped.
+        """
+        stats = self.last_stats
+        decoder = FrameDecoder()
+        while True:
+            line = self._readline(deadline)
+            if line is None:
+                raise SmpTimeout(f"No SMP response from {self.device} within {timeout}s")
+            now = time.perf_counter()
+            if self._first_read is None:
+                self._first_read = now
+                stats["wait_s"] = now - (self._written or now)
+            stats["bytes_received"] += len(line)
+            stats["read_s"] = now - self._first_read
+            packet = decoder.feed_line(line)
+            if packet is None:
+                continue
+            rsp_op, rsp_group, rsp_id, rsp_seq, rsp = decode_packet(packet)
+            if expected.get(rsp_seq) != (rsp_op, rsp_group, rsp_id):
+                continue
+            del expected[rsp_seq]
+            rc = rsp.get("rc", 0) if isinstance(rsp, dict) else 0
+            if "err" in rsp and isinstance(rsp["err"], dict):
+                rc = rsp["err"].get("rc", rc)
+            if rc:
+                raise SmpError(f"SMP group {rsp_group} id {rsp_id} failed with rc={rc}", rc)
+            return rsp_seq, rsp
+
+    def mtu(self) -> int:
+        """Largest SMP packet the device accepts, from the mcumgr parameters request."""
+        if self._mtu is None:
+            try:
+                params = self.request(OP_READ, GROUP_OS, OS_ID_PARAMS, timeout=1)
+                self._mtu = int(params.get("buf_size", DEFAULT_MTU))
+            except SmpError:
+                self._mtu = DEFAULT_MTU
+        return self._mtu
+
+    def shell_exec(self, argv: list[str], timeout: float | None = None) -> tuple[str, int]:
+        rsp = self.request(OP_WRITE, GROUP_SHELL, SHELL_ID_EXEC, {"argv": argv}, timeout)
+        return rsp.get("o", ""), rsp.get("ret", 0)
+
+    def fs_status(self, name: str) -> int:
+        return self.request(OP_READ, GROUP_FS, FS_ID_STATUS, {"name": name})["len"]
+
+    def fs_download_chunk(self, name: str, offset: int, timeout: float | None = None) -> tuple[bytes, int | None]:
+        """Read the next chunk of a file at offset. Returns (data, total length or None)."""
+        rsp = self.request(OP_READ, GROUP_FS, FS_ID_FILE, {"name": name, "off": offset}, timeout)
+        if rsp.get("off", offset) != offset:
+            raise SmpError(f"Device answered offset {rsp.get('off')} instead of {offset}")
+        return rsp.get("data", b""), rsp.get("len")
+
+    def fs_hash(self, name: str, hash_type: str = "sha256", offset: int = 0, length: int | None = None) -> bytes | int:
+        payload = {"name": name, "type": hash_type, "off": offset}
+        if length is not None:
+            payload["len"] = length
+        return self.request(OP_READ, GROUP_FS, FS_ID_HASH, payload, timeout=max(self.timeout, 10))["output"]
+
+    def image_state(self) -> list[dict]:
+        return self.request(OP_READ, GROUP_IMAGE, IMAGE_ID_STATE).get("images", [])
+
+    def image_set_state(self, image_hash: bytes, confirm: bool = True) -> list[dict]:
+        """Mark an image for the next boot, confirmed (permanent) or as a test boot."""
+        rsp = self.request(OP_WRITE, GROUP_IMAGE, IMAGE_ID_STATE, {"hash": image_hash, "confirm": confirm})
+        return rsp.get("images", [])
+
+    def reset(self):
+        self.request(OP_WRITE, GROUP_OS, OS_ID_RESET)
+
+    def image_upload_window(self, image: bytes, sha: bytes, offset: int, chunk_size: int, window: int,
+                            timeout: float | None = None) -> int:
+        """
+        Send up to window image chunks from offset back to back, then collect the answers.
+        Returns the offset the device expects next, the device drops chunks that are not at its offset.
+
+        A chunk at offset 0 carries the image length and sha256. When the device already holds part of
+        an upload with that hash it answers with the offset reached instead of starting over.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        with self._lock:
+            self.last_stats = {}
+            self.open()
+            self._reset_input()
+            expected = {}
+            for off in range(offset, min(len(image), offset + chunk_size * window), chunk_size):
+                payload = {"off": off, "data": image[off:off + chunk_size]}
+                if off == 0:
+                    payload.update({"image": 0, "len": len(image), "sha": sha})
+                expected[self._send(OP_WRITE, GROUP_IMAGE, IMAGE_ID_UPLOAD, payload)] = \
+                    (OP_WRITE_RSP, GROUP_IMAGE, IMAGE_ID_UPLOAD)
+            device_offset = None
+            deadline = time.monotonic() + timeout
+            while expected:
+                try:
+                    seq, rsp = self._receive(expected, deadline, timeout)
+                except SmpTimeout:
+                    if device_offset is None:
+                        raise
+                    break
+                device_offset = rsp.get("off", device_offset)
+                # answers arrive in order, a later one is as good as an earlier one
+                deadline = time.monotonic() + timeout
+            return device_offset
+
+
+def image_upload_chunk_size(mtu: int, image_len: int) -> int:
+    """Largest image data per upload request that keeps the SMP packet within mtu."""
+    overhead = len(encode_packet(OP_WRITE, GROUP_IMAGE, IMAGE_ID_UPLOAD, 0, {
+        "off": image_len, "data": b"", "image": 0, "len": image_len, "sha": bytes(32)}))
+    # 3 bytes for the CBOR byte string length of the data, multiple of 4 keeps flash writes aligned
+    size = mtu - overhead - 3
+    return max(4, size - size % 4)
@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import base64
+import binascii
+import json
+import queue
+import struct
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from history import check_fw_new, parse_history_record
+from hotplug import HotplugWatcher
+from mcumgr_wrapper import run_smp_shell_command
+from scheduler import PRIORITY_LIVE, set_poll_interval
+from sinks import Publisher, close_publishers, publish_records, sink_from_url
+from timeseries import STORE, TimeSeriesStore
+
+DEFAULT_INTERVAL = 1.0
+# weight of a new sample in the device clock offset estimate
+OFFSET_SMOOTHING = 0.1
+
+
+class DeviceStream:
+    """
+    Poll "data get" of one device on a fixed cadence over its persistent SMP connection, also
+    without ATMOTUBE_NATIVE_SMP: spawning ./mcumgr for every sample could not keep a one second cadence.
+
+    Ticks are scheduled from the start time, so slow polls do not make the cadence drift; ticks that
+    are already over are skipped. The device clock has one second resolution and drifts, each
+    sample carries "time", the device timestamp corrected by a smoothed estimate of the offset
+    between the device clock and this host. A sample identical to the previous one is dropped.
+    """
+
+    def __init__(self, device: str, interval: float = DEFAULT_INTERVAL, is_new_pm_format: bool | None = None,
+                 mac: str | None = None):
+        self.device = device
+        self.interval = interval
+        self.is_new_pm_format = is_new_pm_format
+        self.mac = mac
+        self.clock_offset = None
+        self.samples = 0
+        self.duplicates = 0
+        self.errors = 0
+        self._last_raw = None
+        self._next_tick = None
+        # the port stays open between polls
+        set_poll_interval(device, interval)
+
+    def _identify(self):
+        fw, stderr, raw = run_smp_shell_command(self.device, "version app", [], priority=PRIORITY_LIVE)
+        self.is_new_pm_format = check_fw_new((3, 0, 17), None if stderr else fw)
+        mac, stderr, raw = run_smp_shell_command(self.device, "mac", [], priority=PRIORITY_LIVE)
+        self.mac = None if stderr or not mac else mac
+
+    def poll(self) -> dict | None:
+        """One reading, None when it failed or repeats the previous one."""
+        if self.is_new_pm_format is None:
+            self._identify()
+        sent = time.time()
+        data, stderr, raw = run_smp_shell_command(self.device, "data get", [], priority=PRIORITY_LIVE)
+        received = time.time()
+        if stderr or not data:
+            self.errors += 1
+            return None
+        try:
+            payload = base64.b64decode(data)
+            record = parse_history_record(payload, self.is_new_pm_format)
+        except (binascii.Error, ValueError, struct.error):
+            self.errors += 1
+            return None
+        if payload == self._last_raw:
+            self.duplicates += 1
+            return None
+        self._last_raw = payload
+
+        device_ts = struct.unpack_from("<I", payload, 2)[0]
+        # the reading was taken at most a round trip ago, assume the middle of it
+        offset = (sent + received) / 2 - device_ts
+        if self.clock_offset is None:
+            self.clock_offset = offset
+        else:
+            self.clock_offset += OFFSET_SMOOTHING * (offset - self.clock_offset)
+        corrected = device_ts + self.clock_offset
+        record.update({
+            "device": self.device,
+            "mac": self.mac,
+            "time": datetime.fromtimestamp(corrected, timezone.utc).isoformat(timespec="milliseconds"),
+            "received": datetime.fromtimestamp(received, timezone.utc).isoformat(timespec="milliseconds"),
+            "clock_offset_s": round(self.clock_offset, 3),
+            "poll_s": round(received - sent, 4),
+        })
+        record.pop("_total_length", None)
+        self.samples += 1
+        return record
+
+    def next_delay(self) -> float:
+        """Advance to the next tick and return the seconds until it."""
+        now = time.monotonic()
+        if self._next_tick is None:
+            self._next_tick = now
+        else:
+            self._next_tick += self.interval
+            if self._next_tick < now:
+                # behind schedule, skip the ticks that are over instead of bursting
+                missed = int((now - self._next_tick) / self.interval) + 1
+                self._next_tick += missed * self.interval
+        return self._next_tick - now
+
+    def wait_next_tick(self, stop: threading.Event | None = None) -> bool:
+        """Sleep until the next tick, False when stop was set meanwhile."""
+        delay = self.next_delay()
+        if stop is not None:
+            return not stop.wait(delay)
+        time.sleep(delay)
+        return True
+
+
+def stream(devices: list[str], interval: float = DEFAULT_INTERVAL, stop: threading.Event | None = None,
+           max_samples: int | None = None, store: TimeSeriesStore | None = STORE,
+           publishers: list[Publisher] | None = None):
+    """
+    Yield samples of all devices as they arrive, one polling thread per device, and keep them in store.
+    Samples are also handed to publishers, without waiting: a sink that falls behind loses samples
+    instead of delaying the polls. Runs until stop is set or max_samples were yielded.
+    """
+    stop = stop or threading.Event()
+    samples = queue.Queue(maxsize=1000)
+
+    def poll_device(device):
+        device_stream = DeviceStream(device, interval)
+        while device_stream.wait_next_tick(stop):
+            sample = device_stream.poll()
+            if sample is not None:
+                if store is not None:
+                    store.append(device, sample)
+                if publishers:
+                    publish_records(publishers, [sample], timeout=0)
+                # a consumer that stopped reading must not leave this thread blocked on a full queue
+                while not stop.is_set():
+                    try:
+                        samples.put(sample, timeout=0.2)
+                        break
+                    except queue.Full:
+                        continue
+
+    threads = [threading.Thread(target=poll_device, args=(device,), name=f"telemetry-{device}", daemon=True)
+               for device in devices]
+    for thread in threads:
+        thread.start()
+    count = 0
+    try:
+        while not stop.is_set() and (max_samples is None or count < max_samples):
+            try:
+                sample = samples.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            count += 1
+            yield sample
+    finally:
+        stop.set()
+        # the threads stop together, at most one poll after stop
+        deadline = time.monotonic() + interval + 5
+        for thread in threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+
+
+async def astream(devices: list[str], interval: float = DEFAULT_INTERVAL, store: TimeSeriesStore | None = STORE):
+    """Async iterator over the samples of all devices, the polls run in worker threads."""
+    samples = asyncio.Queue(maxsize=1000)
+
+    async def poll_device(device):
+        device_stream = DeviceStream(device, interval)
+        while True:
+            await asyncio.sleep(device_stream.next_delay())
+            sample = await asyncio.to_thread(device_stream.poll)
+            if sample is not None:
+                if store is not None:
+                    store.append(device, sample)
+                await samples.put(sample)
+
+    tasks = [asyncio.create_task(poll_device(device)) for device in devices]
+    try:
+        while True:
+            yield await samples.get()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream live readings of Atmotube PRO 2 devices as NDJSON")
+    parser.add_argument("--devices", nargs="*", help="serial ports, default all connected devices")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="seconds between polls")
+    parser.add_argument("--count", type=int, help="stop after this many samples")
+    parser.add_argument("--output", help="append to this file instead of stdout")
+    parser.add_argument("--sink", action="append", default=[],
+                        help="also publish to this sink url (mqtt://host/topic, http://..., ndjson:path), repeatable")
+    args = parser.parse_args()
+
+    devices = args.devices or HotplugWatcher().poll()[0]
+    if not devices:
+        print("No devices found.", file=sys.stderr)
+        return
+    publishers = [Publisher(sink_from_url(url)) for url in args.sink]
+    out = open(args.output, "a") if args.output else sys.stdout
+    try:
+        for sample in stream(devices, args.interval, max_samples=args.count, publishers=publishers):
+            out.write(json.dumps(sample) + "\n")
+            out.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        close_publishers(publishers)
+        for publisher in publishers:
+            print(f"Sink {publisher}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+from config import apply_config, load_config
+from device_config import get_device_config
+from mcumgr_wrapper import run_mcumgr_shell_command
+
+
+def test_plan_sees_settings_changed_behind_the_cache(simulator):
+    config = load_config("config.json")
+    apply_config(simulator.port, config)
+    assert {c.cmd for c in apply_config(simulator.port, config, dry_run=True)} == {"gnss mode", "gnss timer"}
+    # cached now, then changed directly on the device
+    assert get_device_config(simulator.port).interval.seconds == 60
+    response, error, raw = run_mcumgr_shell_command(simulator.port, "interval", ["10", "2"])
+    assert response == "ok"
+    changes = apply_config(simulator.port, config, dry_run=True)
+    assert "interval" in {c.cmd for c in changes}
+    apply_config(simulator.port, config)
+    assert simulator.device.interval == [60, 0]
+    assert get_device_config(simulator.port).interval.seconds == 60
@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+import simulator as simulator_module
+from config import ConfigError, load_config
+from config_rollout import Rollout, load_rollout, rollout_fleet
+from conftest import start_simulator, stop_simulator
+from retry import reset_breaker
+from scheduler import close_scheduler
+
+
+def write_rollout(tmp_path, data: dict) -> str:
+    path = tmp_path / "rollout.json"
+    path.write_text(json.dumps(data))
+    return str(path)
+
+
+def profile(seconds: int) -> dict:
+    config = load_config("config.json")
+    config["interval"] = dict(config["interval"], seconds=seconds)
+    return config
+
+
+def test_load_rollout(tmp_path):
+    (tmp_path / "indoor.json").write_text(json.dumps(profile(60)))
+    rollout = load_rollout(write_rollout(tmp_path, {
+        "profiles": {"indoor": "indoor.json", "outdoor": profile(10)},
+        "tags": {"Roof": ["sn0000002"]},
+        "assign": {"c0:ff:ee:00:00:03": "outdoor", "tag:roof": "outdoor"},
+        "default": "indoor",
+    }))
+    assert rollout.profiles["indoor"]["interval"]["seconds"] == 60
+    assert rollout.profile_for("C0:FF:EE:00:00:03", None) == "outdoor"
+    assert rollout.profile_for("C0:FF:EE:00:00:09", "SN0000002") == "outdoor"
+    assert rollout.profile_for("C0:FF:EE:00:00:09", "SN0000009") == "indoor"
+
+
+@pytest.mark.parametrize("data, message", [
+    ({"profiles": {"p": {"pm": {}}}}, "Profile 'p'"),
+    ({"profiles": {"p": "missing.json"}}, "Profile 'p'"),
+    ({"profiles": {}, "default": "p"}, "Unknown profile 'p'"),
+    ({"profiles": {"p": profile(60)}, "assign": {"tag:roof": "p"}}, "Unknown tag 'roof'"),
+])
+def test_load_rollout_rejects(tmp_path, data, message):
+    with pytest.raises(ConfigError, match=message):
+        load_rollout(write_rollout(tmp_path, data))
+
+
+@pytest.fixture
+def second_simulator():
+    simulator = start_simulator()
+    simulator.device.mac = "C0:FF:EE:00:00:02"
+    simulator.device.serial_number = "SIM0000002"
+    yield simulator
+    stop_simulator(simulator)
+
+
+def test_rollout_fleet(simulator, second_simulator):
+    rollout = Rollout({"fast": profile(10), "slow": profile(30)}, {"SIM0000002": "slow"}, {}, default="fast")
+    missing = "/dev/atmotube-missing"
+    try:
+        summary = rollout_fleet([simulator.port, missing, second_simulator.port], rollout, parallel=3)
+    finally:
+        close_scheduler(missing)
+        reset_breaker(missing)
+    first, failed, second = summary["devices"]
+    assert [r["device"] for r in summary["devices"]] == [simulator.port, missing, second_simulator.port]
+    assert (first["profile"], first["status"]) == ("fast", "applied")
+    assert (second["profile"], second["status"]) == ("slow", "applied")
+    assert simulator.device.interval == [10, 0] and second_simulator.device.interval == [30, 0]
+    # GPS settings can't be read back
+    assert {change.split(":")[0] for change in first["unverified"]} == {"GPS mode", "GPS timer"}
+    assert (failed["status"], failed["error"]) == ("failed", "device does not answer")
+    assert summary["counts"] == {"applied": 2, "failed": 1}
+
+
+def test_rollout_dry_run(simulator):
+    rollout = Rollout({"fast": profile(10)}, {}, {}, default="fast")
+    summary = rollout_fleet([simulator.port], rollout, dry_run=True)
+    assert summary["devices"][0]["status"] == "planned"
+    assert any(change.startswith("interval: 60 0 -> 10 0") for change in summary["devices"][0]["changes"])
+    assert simulator.device.interval == [60, 0]
+
+
+def test_rollout_reports_mismatch(simulator, monkeypatch):
+    # the device acknowledges the interval but keeps its old one
+    interval = simulator_module.SHELL_COMMANDS["interval"]
+    monkeypatch.setitem(simulator_module.SHELL_COMMANDS, "interval",
+                        lambda device, args: interval(device, []) if not args else "ok")
+    rollout = Rollout({"fast": profile(10)}, {}, {}, default="fast")
+    result = rollout_fleet([simulator.port], rollout)["devices"][0]
+    assert result["status"] == "mismatch"
+    assert result["error"] == "interval: 60 0 -> 10 0"
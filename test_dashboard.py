@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+import dashboard
+from dashboard import Dashboard, device_id
+from retry import RetryPolicy
+from timeseries import TimeSeriesStore
+
+
+@pytest.fixture(autouse=True)
+def fast_restarts(monkeypatch):
+    monkeypatch.setattr(dashboard, "POLLER_POLICY", RetryPolicy(base_delay=0.01, max_delay=0.02))
+
+
+async def wait_for(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.02)
+
+
+def test_info_read_is_retried(simulator, monkeypatch):
+    fails = {"version app": 2}
+    read_device_info = dashboard.read_device_info
+
+    def flaky(device):
+        info = read_device_info(device)
+        if fails["version app"]:
+            fails["version app"] -= 1
+            info["fw"] = None
+        return info
+
+    monkeypatch.setattr(dashboard, "read_device_info", flaky)
+
+    async def run():
+        board = Dashboard([simulator.port], interval=0.05, store=TimeSeriesStore())
+        board._attach(simulator.port)
+        await wait_for(lambda: board.store.series(simulator.port).latest() is not None)
+        assert board.info[device_id(simulator.port)]["fw"] == simulator.device.fw
+        board._detach(simulator.port)
+
+    asyncio.run(run())
+    assert fails["version app"] == 0
+
+
+def test_poller_restarts_after_error(simulator, monkeypatch):
+    polls = []
+
+    async def run():
+        board = Dashboard([simulator.port], interval=0.05, store=TimeSeriesStore())
+        broadcast = board._broadcast
+
+        def failing_once(message):
+            polls.append(message)
+            if len(polls) == 1:
+                raise RuntimeError("injected")
+            broadcast(message)
+
+        board._broadcast = failing_once
+        board._attach(simulator.port)
+        await wait_for(lambda: len(polls) >= 3)
+        task = board._pollers[simulator.port]
+        board._detach(simulator.port)
+        await asyncio.sleep(0)
+        return board, task
+
+    board, task = asyncio.run(run())
+    assert task.cancelled()
+    assert device_id(simulator.port) not in board.info
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+import decode_cache
+from decode_cache import DecodeCache, columns_to_records, decode_columns, encode_columns, read_history
+from history import read_history_file
+from history_generator import parse_mix, write_archive
+
+
+@pytest.fixture
+def history_file(tmp_path):
+    path = str(tmp_path / "history.bin")
+    write_archive(path, 500, mix=parse_mix("all"))
+    return path
+
+
+def test_columns_round_trip(history_file):
+    records = read_history_file(history_file, True)
+    assert columns_to_records(*decode_columns(encode_columns(records))) == records
+
+
+@pytest.mark.parametrize("records", [
+    [],
+    [{"a": 1, "b": "x"}, {"a": 2 ** 40}, {"b": ""}],
+    [{"t": 21.5, "ok": True}, {"t": "", "ok": False}, {"t": None, "ok": True}],
+])
+def test_columns_round_trip_mixed(records):
+    assert columns_to_records(*decode_columns(encode_columns(records))) == records
+
+
+def test_entries_keyed_by_format_and_decoder(history_file, tmp_path, monkeypatch):
+    cache = DecodeCache(str(tmp_path / "cache"))
+    new = cache.read(history_file, True)
+    assert cache.read(history_file, True) == new
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.read(history_file, False) == read_history_file(history_file, False)
+    assert cache.misses == 2
+    # entries of another decoder version are not used
+    monkeypatch.setattr(decode_cache, "DECODER_VERSION", decode_cache.DECODER_VERSION + 1)
+    cache.read(history_file, True)
+    assert cache.misses == 3
+    assert len(os.listdir(cache.root)) == 3
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DecodeCache(str(tmp_path / "cache"))
+    paths = []
+    for n in range(3):
+        path = str(tmp_path / f"history{n}.bin")
+        write_archive(path, 500, seed=n)
+        cache.read(path, True)
+        entry = cache.entry_path(decode_cache._content_hash(path), True)
+        os.utime(entry, (1000 + n, 1000 + n))
+        paths.append(entry)
+    # the oldest entry becomes the most recently used
+    cache.read(str(tmp_path / "history0.bin"), True)
+    sizes = [os.path.getsize(entry) for entry in paths]
+    cache.max_bytes = sizes[0] + sizes[2]
+    cache.evict()
+    assert [os.path.exists(entry) for entry in paths] == [True, False, True]
+
+
+def test_cache_is_opt_in(history_file, tmp_path, monkeypatch):
+    cache = DecodeCache(str(tmp_path / "cache"))
+    monkeypatch.setattr(decode_cache, "DECODE_CACHE", cache)
+    monkeypatch.delenv(decode_cache.CACHE_ENV, raising=False)
+    assert read_history(history_file, True) == read_history_file(history_file, True)
+    assert os.listdir(cache.root) == []
+    monkeypatch.setenv(decode_cache.CACHE_ENV, "1")
+    assert read_history(history_file, True) == read_history_file(history_file, True)
+    assert cache.misses == 1 and len(os.listdir(cache.root)) == 1
@@ -0,0 +1,92 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from firmware_cache import FirmwareCache, FirmwareCacheError
+from ota_stub import OtaStub
+
+IMAGE = bytes(range(256)) * 64
+
+
+@pytest.fixture
+def stub():
+    with OtaStub() as stub:
+        yield stub
+
+
+def make_cache(tmp_path, revalidate_after=0):
+    return FirmwareCache(str(tmp_path / "fw"), requests.Session(), revalidate_after)
+
+
+def test_download_and_revalidate(stub, tmp_path):
+    update_info = stub.add_firmware("3.2.1", IMAGE)
+    cache = make_cache(tmp_path)
+    path = cache.get(update_info)
+    with open(path, "rb") as f:
+        assert f.read() == IMAGE
+    assert os.path.basename(path) == hashlib.sha256(IMAGE).hexdigest() + ".bin"
+    # the next get asks with the ETag and gets 304
+    assert cache.get(update_info) == path
+    assert stub.hits["/fw/3.2.1.bin"] == 2
+    assert stub.downloads == cache.downloads == 1
+
+
+def test_no_request_within_revalidate_after(stub, tmp_path):
+    update_info = stub.add_firmware("3.2.1", IMAGE)
+    cache = make_cache(tmp_path, revalidate_after=300)
+    path = cache.get(update_info)
+    assert cache.get(update_info) == path
+    assert stub.hits["/fw/3.2.1.bin"] == 1
+
+
+def test_changed_image_is_downloaded_again(stub, tmp_path):
+    update_info = stub.add_firmware("3.2.1", IMAGE)
+    cache = make_cache(tmp_path)
+    first = cache.get(update_info)
+    stub.add_firmware("3.2.1", IMAGE[::-1])
+    second = cache.get(update_info)
+    assert first != second
+    assert cache.downloads == 2
+
+
+def test_cached_copy_when_server_is_down(stub, tmp_path):
+    update_info = stub.add_firmware("3.2.1", IMAGE)
+    cache = make_cache(tmp_path)
+    path = cache.get(update_info)
+    stub.stop()
+    assert cache.get(update_info) == path
+    assert cache.cached("3.2.1") == path
+
+
+def test_hash_mismatch_is_rejected(stub, tmp_path):
+    update_info = stub.add_firmware("3.2.1", IMAGE)
+    update_info["sha256"] = hashlib.sha256(b"something else").hexdigest()
+    cache = make_cache(tmp_path)
+    with pytest.raises(FirmwareCacheError, match="hash mismatch"):
+        cache.get(update_info)
+    assert cache.cached("3.2.1") is None
+    assert os.listdir(cache.objects_dir) == []
+
+
+def test_cached_image_with_other_hash_is_not_used(stub, tmp_path):
+    update_info = stub.add_firmware("3.2.1", IMAGE)
+    cache = make_cache(tmp_path, revalidate_after=300)
+    cache.get(update_info)
+    stub.add_firmware("3.2.1", IMAGE[::-1])
+    update_info["sha256"] = hashlib.sha256(IMAGE[::-1]).hexdigest()
+    path = cache.get(update_info)
+    assert os.path.basename(path) == update_info["sha256"] + ".bin"
+
+
+def test_concurrent_gets_share_one_download(stub, tmp_path):
+    update_info = stub.add_firmware("3.2.1", IMAGE)
+    stub.delay = 0.3
+    cache = make_cache(tmp_path)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        paths = list(executor.map(lambda _: cache.get(update_info), range(8)))
+    assert len(set(paths)) == 1
+    assert stub.downloads == cache.downloads == 1
+    assert stub.hits["/fw/3.2.1.bin"] == 1
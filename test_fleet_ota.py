@@ -0,0 +1,98 @@
+import struct
+
+import pytest
+
+import fleet_ota
+import mcumgr_wrapper
+from fleet_ota import update_fleet, update_one
+from retry import RetryPolicy
+from simulator import MCUBOOT_HEADER_FMT, MCUBOOT_MAGIC, MGMT_ERR_EINVAL, OS_ID_RESET, GROUP_OS
+from smp import SmpError
+
+VERSION = "3.2.1"
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(fleet_ota, "REBOOT_SETTLE", 0.1)
+    monkeypatch.setattr(fleet_ota, "REBOOT_POLICY", RetryPolicy(attempts=100, base_delay=0.05, max_delay=0.2,
+                                                                deadline=2))
+    monkeypatch.setattr(mcumgr_wrapper, "CHUNK_POLICY", RetryPolicy(attempts=6, base_delay=0.01, max_delay=0.02))
+
+
+@pytest.fixture
+def fw_file(tmp_path):
+    header = struct.pack(MCUBOOT_HEADER_FMT, MCUBOOT_MAGIC, 0, 32, 0, 20000, 0, 3, 2, 1, 0)
+    path = tmp_path / f"fw_{VERSION}.bin"
+    path.write_bytes(header + bytes(range(256)) * 80)
+    return str(path)
+
+
+def fail_on(simulator, matches):
+    """Answer requests for which matches(op, group, cmd_id, payload) is true with an SMP error."""
+    handle = simulator.handle
+
+    def failing(op, group, cmd_id, payload):
+        if matches(op, group, cmd_id, payload):
+            raise SmpError("injected failure", MGMT_ERR_EINVAL)
+        return handle(op, group, cmd_id, payload)
+
+    simulator.handle = failing
+
+
+def test_update(simulator, fw_file):
+    result = update_one(simulator.port, fw_file, VERSION)
+    assert result.status == "updated", result.error
+    assert (result.from_version, result.version) == ("3.1.0", VERSION)
+    assert simulator.device.fw == VERSION
+    assert set(result.timings) == {"check", "upload", "confirm", "reset", "reboot", "health"}
+    assert result.upload_bytes_per_sec > 0
+
+
+def test_up_to_date(simulator, fw_file):
+    simulator.device.fw = VERSION
+    result = update_one(simulator.port, fw_file, VERSION)
+    assert result.status == "up to date"
+    assert simulator.device.upload is None
+
+
+def test_update_fleet_keeps_order(simulator, fw_file):
+    results = update_fleet([simulator.port, "/dev/does-not-exist"], fw_file, VERSION, parallel=2)
+    assert [r.device for r in results] == [simulator.port, "/dev/does-not-exist"]
+    assert [r.status for r in results] == ["updated", "failed"]
+
+
+@pytest.mark.parametrize("step, matches", [
+    ("check", lambda op, group, cmd_id, payload: payload.get("argv") == ["version", "app"]),
+    ("upload", lambda op, group, cmd_id, payload: "data" in payload),
+    ("confirm", lambda op, group, cmd_id, payload: "confirm" in payload),
+    ("reset", lambda op, group, cmd_id, payload: (group, cmd_id) == (GROUP_OS, OS_ID_RESET)),
+])
+def test_failed_step(simulator, fw_file, step, matches):
+    fail_on(simulator, matches)
+    result = update_one(simulator.port, fw_file, VERSION)
+    assert (result.status, result.failed_step) == ("failed", step)
+    assert result.error
+    assert simulator.device.fw == "3.1.0"
+
+
+def test_no_reboot(simulator, fw_file, monkeypatch):
+    # the device stays silent after the reset
+    monkeypatch.setattr(simulator, "reboot_time", 60)
+    result = update_one(simulator.port, fw_file, VERSION)
+    assert (result.status, result.failed_step) == ("failed", "reboot")
+
+
+def test_old_firmware_after_reboot(simulator, fw_file, monkeypatch):
+    # MCUboot did not swap the image in
+    monkeypatch.setattr(simulator.device, "reboot", lambda: None)
+    result = update_one(simulator.port, fw_file, VERSION)
+    assert (result.status, result.failed_step) == ("failed", "health")
+    assert result.version == "3.1.0"
+
+
+def test_health_check_fails(simulator, fw_file):
+    fail_on(simulator, lambda op, group, cmd_id, payload: payload.get("argv", [None])[0] == "time")
+    result = update_one(simulator.port, fw_file, VERSION)
+    assert (result.status, result.failed_step) == ("failed", "health")
+    assert simulator.device.fw == VERSION
@@ -0,0 +1,52 @@
+import gzip
+
+from history_archive import HistoryArchive, record_spans
+from history_generator import parse_mix, write_archive
+from history_merge import iter_history_file, record_key
+
+
+def keys(records) -> list:
+    return [record_key(record) for record in records]
+
+
+def test_same_file_twice(tmp_path):
+    path = str(tmp_path / "history.bin")
+    write_archive(path, 3000, mix=parse_mix("all"))
+    archive = HistoryArchive(str(tmp_path / "archive.gz"))
+    blocks = archive.append_file(path, True)
+    assert blocks > 1
+    assert archive.append_file(path, True) == 0
+    assert len(HistoryArchive(archive.path).blocks) == blocks
+    assert keys(archive.records()) == keys(iter_history_file(path, True))
+    with open(path, "rb") as f, gzip.open(archive.path) as archived:
+        assert archived.read() == f.read()
+
+
+def test_grown_file_adds_only_new_records(tmp_path):
+    full_path = str(tmp_path / "full.bin")
+    write_archive(full_path, 2000, mix=parse_mix("default=1,ext_pm=1"))
+    with open(full_path, "rb") as f:
+        full = f.read()
+    archive = HistoryArchive(str(tmp_path / "archive.gz"))
+    archive.append(full[:len(full) // 3], True)   # cut mid-record, like a download of the active file
+    assert archive.append(full[:len(full) // 3], True) == 0
+    archive.append(full, True)
+    spans = list(record_spans(full))
+    archive.append(full[spans[1000][0]:spans[1100][0]], True)
+    expected = keys(iter_history_file(full_path, True))
+    assert sorted(keys(archive.records())) == sorted(expected)
+    assert archive.summary()["records"] == len(expected)
+    # the cut record is only archived once complete, the archive still inflates to the raw history
+    with gzip.open(archive.path) as archived:
+        assert archived.read() == full
+
+
+def test_time_range(tmp_path):
+    path = str(tmp_path / "history.bin")
+    write_archive(path, 5000, interval=60, start=1_700_000_000)
+    archive = HistoryArchive(str(tmp_path / "archive.gz"))
+    archive.append_file(path, True)
+    start, end = 1_700_000_000 + 60 * 1000, 1_700_000_000 + 60 * 1099
+    records = list(archive.records(start, end))
+    assert len(records) == 100
+    assert len(archive.blocks_between(start, end)) < len(archive.blocks)
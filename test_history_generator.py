@@ -0,0 +1,30 @@
+import os
+
+from history_generator import parse_mix, round_trip_check, write_archive
+from history_scan import scan_file
+
+
+def test_round_trip():
+    assert round_trip_check(per_type=10) == 0
+
+
+def test_stats_match_file(tmp_path):
+    path = str(tmp_path / "history.bin")
+    stats = write_archive(path, 500, mix=parse_mix("all"), corrupt_rate=0.1, seed=3)
+    scan = scan_file(path)
+    assert stats.bytes == os.path.getsize(path)
+    assert (stats.records, stats.corrupted, stats.truncated) == (scan.records, scan.crc_failures, False)
+    assert stats.layouts == scan.layouts
+
+
+def test_truncated_record_not_counted(tmp_path):
+    full_path = str(tmp_path / "full.bin")
+    path = str(tmp_path / "truncated.bin")
+    full = write_archive(full_path, 200, mix=parse_mix("all"), corrupt_rate=0.2, seed=5)
+    stats = write_archive(path, 200, truncate=True, mix=parse_mix("all"), corrupt_rate=0.2, seed=5)
+    scan = scan_file(path)
+    assert stats.truncated and scan.truncated
+    assert stats.bytes == os.path.getsize(path)
+    assert stats.records == full.records - 1 == scan.records
+    assert stats.corrupted == scan.crc_failures
+    assert stats.layouts == scan.layouts
@@ -0,0 +1,65 @@
+import csv
+import sys
+
+import pytest
+
+import history_merge
+from csv_export import export_records_to_csv
+from history_archive import record_spans
+from history_generator import parse_mix, write_archive
+from history_merge import iter_history_file, merge_history_files, record_key
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    """Overlapping downloads of 1300 records: raw 0-600 and 400-1000, CSV exports of 900-1200 and 1100-1300."""
+    full_path = str(tmp_path / "full.bin")
+    write_archive(full_path, 1300, mix=parse_mix("default=1,ext_pm=1"))
+    with open(full_path, "rb") as f:
+        full = f.read()
+    offsets = [offset for offset, length, ts in record_spans(full)] + [len(full)]
+    records = list(iter_history_file(full_path, True))
+
+    paths = []
+    for name, start, end in (("a.bin", 0, 600), ("b.bin", 400, 1000)):
+        path = tmp_path / name
+        path.write_bytes(full[offsets[start]:offsets[end]])
+        paths.append(str(path))
+    for name, start, end in (("c.csv", 900, 1200), ("d.csv", 1100, 1300)):
+        path = str(tmp_path / name)
+        export_records_to_csv(records[start:end], path)
+        paths.append(path)
+    return paths, records
+
+
+def test_merge_dedupes_overlaps(inputs):
+    paths, records = inputs
+    merged = list(merge_history_files(paths, True))
+    timestamps = [record["timestamp"] for record in merged]
+    assert timestamps == sorted(timestamps)
+    raw = [record for record in merged if "crc" in record]
+    assert [record_key(record) for record in raw] == [record_key(record) for record in records[:1000]]
+    # CSV rows are only compared with CSV rows
+    assert len(merged) - len(raw) == 400
+    assert len({record_key(record) for record in merged}) == len(merged)
+
+
+def test_merge_keeps_duplicates(inputs):
+    paths, records = inputs
+    merged = list(merge_history_files(paths, True, dedupe=False))
+    assert len(merged) == 600 + 600 + 300 + 200
+    timestamps = [record["timestamp"] for record in merged]
+    assert timestamps == sorted(timestamps)
+
+
+@pytest.mark.parametrize("args, rows", [([], 1400), (["--keep-duplicates"], 1700)])
+def test_main_writes_csv(inputs, tmp_path, monkeypatch, args, rows):
+    paths, records = inputs
+    output = tmp_path / "merged.csv"
+    monkeypatch.setattr(sys, "argv", ["history_merge.py", *paths, "--output", str(output), *args])
+    history_merge.main()
+    with open(output, newline="") as f:
+        header, *body = list(csv.reader(f))
+    assert len(body) == rows
+    column = header.index("Date (UTC+00:00)")
+    assert [row[column] for row in body] == sorted(row[column] for row in body)
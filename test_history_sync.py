@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from history_sync import file_key, load_manifest, plan_sync, sync_history
+from simulator import RECORD_INTERVAL, _make_record
+
+
+@pytest.fixture
+def export_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("ATMOTUBE_SINKS", raising=False)
+    monkeypatch.delenv("ATMOTUBE_ARCHIVE", raising=False)
+    return tmp_path / "export"
+
+
+def test_plan_sync_keys_by_first_record():
+    manifest = {"files": {file_key("/fs/h_sync/100", 100): {"size": 170, "first": 100}}}
+    files = [("/fs/h_new/100", 170), ("/fs/h_new/200", 170)]
+    assert plan_sync(files, manifest, {"/fs/h_new/100": 100, "/fs/h_new/200": 200}) == [("/fs/h_new/200", 0, 170)]
+    # same name, other first record: a new file
+    assert plan_sync(files[:1], manifest, {"/fs/h_new/100": 5000}) == [("/fs/h_new/100", 0, 170)]
+
+
+def test_plan_sync_reads_legacy_entries():
+    manifest = {"files": {"100": {"size": 170}}}
+    assert plan_sync([("/fs/h_new/100", 340)], manifest, {"/fs/h_new/100": 100}) == [("/fs/h_new/100", 170, 340)]
+
+
+def test_sync_after_history_clear(simulator, export_dir):
+    device = simulator.device
+    assert sync_history(simulator.port, device.mac, True) > 0
+    name = next(name for name in device.files if name.startswith("/fs/h_sync/"))
+    content = device.files[name]
+
+    # the device starts over and writes a file under the same name, no larger than the synced one
+    device.cmd_history_clear([])
+    first = int(name.split("/")[-1]) + 86400
+    recreated = bytearray(b"".join(_make_record(first + n * RECORD_INTERVAL, n) for n in range(30)))
+    assert len(recreated) <= len(content)
+    device.files["/fs/h_new/" + name.split("/")[-1]] = recreated
+
+    assert sync_history(simulator.port, device.mac, True) >= len(recreated)
+    manifest = load_manifest(os.path.join(export_dir, device.mac))
+    assert manifest["files"][file_key(name, first)]["size"] == len(recreated)
@@ -0,0 +1,111 @@
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import mcumgr_wrapper
+from scheduler import PRIORITY_BULK, PRIORITY_LIVE, close_scheduler, get_scheduler
+
+DEVICE = "/dev/cli-test"
+
+
+@pytest.fixture
+def cli(monkeypatch):
+    """./mcumgr replaced by a recorder of the thread it runs on."""
+    monkeypatch.setattr(mcumgr_wrapper, "USE_NATIVE_SMP", False)
+    calls = []
+
+    def run_cli(command, t, timeout=None):
+        calls.append((threading.current_thread().name, command[command.index("--connstring") + 2:]))
+        return subprocess.CompletedProcess(command, 0, "", "")
+
+    monkeypatch.setattr(mcumgr_wrapper, "_run_cli", run_cli)
+    yield calls
+    close_scheduler(DEVICE)
+
+
+def test_cli_runs_on_device_scheduler(cli):
+    mcumgr_wrapper.run_mcumgr_reset_command(DEVICE)
+    mcumgr_wrapper.run_mcumgr_image_list_command(DEVICE)
+    assert cli == [(f"scheduler-{DEVICE}", ["reset"]), (f"scheduler-{DEVICE}", ["image", "list"])]
+
+
+def test_cli_waits_for_priority(cli):
+    # a bulk job holds the port, a live shell command queued behind it runs before the next bulk job
+    started, release = threading.Event(), threading.Event()
+    scheduler = get_scheduler(DEVICE, mcumgr_wrapper.BAUD_RATE)
+    scheduler.submit(lambda client: (started.set(), release.wait(5)), PRIORITY_BULK)
+    started.wait(5)
+    bulk = scheduler.submit(lambda client: cli.append(("bulk", [])), PRIORITY_BULK)
+    shell = threading.Thread(target=mcumgr_wrapper.run_mcumgr_shell_command,
+                             args=(DEVICE, "version app"), kwargs={"priority": PRIORITY_LIVE})
+    shell.start()
+    while scheduler._queue.qsize() < 2:
+        time.sleep(0.01)
+    release.set()
+    shell.join(5)
+    bulk.result(5)
+    assert [name for name, argv in cli] == [f"scheduler-{DEVICE}", "bulk"]
+
+
+@pytest.mark.parametrize("line, offset", [
+    ("[00:00:01] [#####>----] 150.00 KiB/300.00 KiB (1s)", 5000),
+    ("upload 40%", 4000),
+    ("10000 B/10000 B", 10000),
+    ("Uploading image.bin", None),
+])
+def test_parse_cli_progress(line, offset):
+    assert mcumgr_wrapper.parse_cli_progress(line, 10000) == offset
+
+
+def test_cli_upload_reports_progress(tmp_path, monkeypatch):
+    monkeypatch.setattr(mcumgr_wrapper, "USE_NATIVE_SMP", False)
+    monkeypatch.chdir(tmp_path)
+    fake = tmp_path / "mcumgr"
+    fake.write_text(f"#!{sys.executable}\n"
+                    "print('Uploading')\n"
+                    "for kib in (1, 2, 4):\n"
+                    "    print(f'{kib}.00 KiB/4.00 KiB', end='\\r', flush=True)\n"
+                    "print('Done')\n")
+    fake.chmod(0o755)
+    image = tmp_path / "image.bin"
+    image.write_bytes(bytes(4096))
+
+    offsets = []
+    try:
+        stdout, stderr = mcumgr_wrapper.run_mcumgr_image_upload_command(
+            DEVICE, str(image), progress=lambda state: offsets.append((state.offset, state.total)))
+    finally:
+        close_scheduler(DEVICE)
+    assert stderr == ""
+    assert offsets == [(1024, 4096), (2048, 4096), (4096, 4096)]
+
+
+def test_parse_image_state():
+    output = """Images:
+ image=0 slot=0
+    version: 3.1.0
+    bootable: true
+    flags: active confirmed
+    hash: 0a0b0c
+ image=0 slot=1
+    version: 3.2.1
+    bootable: true
+    flags:
+    hash: 0d0e0f
+Split status: N/A (0)
+"""
+    assert mcumgr_wrapper.parse_image_state(output) == [
+        {"image": 0, "slot": 0, "version": "3.1.0", "hash": bytes.fromhex("0a0b0c"),
+         "active": True, "confirmed": True, "pending": False},
+        {"image": 0, "slot": 1, "version": "3.2.1", "hash": bytes.fromhex("0d0e0f"),
+         "active": False, "confirmed": False, "pending": False},
+    ]
+
+
+def test_parse_image_state_without_headers():
+    images = mcumgr_wrapper.parse_image_state("version: 3.1.0\nhash: 0a\nversion: 3.2.1\nhash: 0b\n")
+    assert [(image["slot"], image["version"], image["hash"].hex()) for image in images] == [
+        (0, "3.1.0", "0a"), (1, "3.2.1", "0b")]
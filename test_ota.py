@@ -0,0 +1,64 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+import ota
+from ota import OtaChecker
+from ota_stub import OtaStub
+
+OTA_PATH = "/api/v1-public/ota"
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    with OtaStub() as stub:
+        monkeypatch.setattr(ota, "OTA_BASE_URL", stub.base_url)
+        stub.add_firmware("3.2.1", b"image")
+        yield stub
+
+
+def test_same_firmware_is_asked_once(stub):
+    checker = OtaChecker(ttl=60)
+    devices = [(f"C0:FF:EE:00:00:{i:02X}", "3.1.0") for i in range(10)] + [("C0:FF:EE:00:01:00", "3.2.1")]
+    updates = checker.check_many(devices)
+    assert [u["ver"] if u else None for u in updates] == ["3.2.1"] * 10 + [None]
+    assert stub.hits[OTA_PATH] == checker.requests == 2
+
+
+def test_ttl_expiry(stub):
+    checker = OtaChecker(ttl=0.2)
+    checker.check("C0:FF:EE:00:00:01", "3.1.0")
+    checker.check("C0:FF:EE:00:00:02", "3.1.0")
+    assert stub.hits[OTA_PATH] == 1
+    time.sleep(0.3)
+    checker.check("C0:FF:EE:00:00:01", "3.1.0")
+    assert stub.hits[OTA_PATH] == 2
+
+
+def test_invalidate(stub):
+    checker = OtaChecker(ttl=60)
+    checker.check("C0:FF:EE:00:00:01", "3.1.0")
+    checker.invalidate("3.1.0")
+    checker.check("C0:FF:EE:00:00:01", "3.1.0")
+    assert stub.hits[OTA_PATH] == 2
+
+
+def test_concurrent_checks_share_one_request(stub):
+    stub.delay = 0.3
+    checker = OtaChecker(ttl=60)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        updates = list(executor.map(lambda i: checker.check(f"C0:FF:EE:00:00:{i:02X}", "3.1.0"), range(8)))
+    assert all(u["ver"] == "3.2.1" for u in updates)
+    assert stub.hits[OTA_PATH] == checker.requests == 1
+
+
+def test_failed_check_is_not_cached(stub, monkeypatch):
+    checker = OtaChecker(ttl=60)
+    monkeypatch.setattr(ota, "OTA_BASE_URL", "http://127.0.0.1:1")
+    with pytest.raises(requests.RequestException):
+        checker.check("C0:FF:EE:00:00:01", "3.1.0")
+    assert checker.check_many([("C0:FF:EE:00:00:01", "3.1.0")]) == [None]
+    monkeypatch.setattr(ota, "OTA_BASE_URL", stub.base_url)
+    assert checker.check("C0:FF:EE:00:00:01", "3.1.0")["ver"] == "3.2.1"
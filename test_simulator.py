@@ -0,0 +1,39 @@
+import unittest
+
+import pytest
+
+import mcumgr_wrapper
+import test
+from conftest import start_simulator, stop_simulator
+from simulator import run_command_tests
+from test import AtmocubeCommandTests  # noqa: F401, collected by pytest
+
+
+@pytest.fixture(scope="module", autouse=True)
+def command_tests_device():
+    """AtmocubeCommandTests talk to test.device_path, here one simulator for the whole module."""
+    native = mcumgr_wrapper.USE_NATIVE_SMP
+    mcumgr_wrapper.USE_NATIVE_SMP = True
+    simulator = start_simulator()
+    test.device_path = simulator.port
+    yield simulator
+    stop_simulator(simulator)
+    mcumgr_wrapper.USE_NATIVE_SMP = native
+
+
+def test_simulator_counts_requests(command_tests_device):
+    before = command_tests_device.requests
+    response, error, raw = mcumgr_wrapper.run_mcumgr_shell_command(command_tests_device.port, "time")
+    assert response.isdigit() and not error
+    assert command_tests_device.requests == before + 1
+
+
+def test_command_tests_restore_transport(command_tests_device, monkeypatch):
+    class Empty(unittest.TestCase):
+        def test_transport(self):
+            assert mcumgr_wrapper.USE_NATIVE_SMP
+
+    monkeypatch.setattr(test, "AtmocubeCommandTests", Empty)
+    monkeypatch.setattr(mcumgr_wrapper, "USE_NATIVE_SMP", False)
+    assert run_command_tests(command_tests_device.port).wasSuccessful()
+    assert mcumgr_wrapper.USE_NATIVE_SMP is False
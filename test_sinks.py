@@ -0,0 +1,110 @@
+import json
+import threading
+
+from retry import RetryPolicy
+from sink_stub import HttpCollectorStub, MqttBrokerStub
+from sinks import NdjsonSink, Publisher, Sink, sink_from_url
+
+FAST = RetryPolicy(attempts=5, base_delay=0.01, max_delay=0.02)
+
+
+def records(count: int, mac: str = "C0:FF:EE:00:00:01") -> list[dict]:
+    return [{"mac": mac, "timestamp": 1_700_000_000 + i, "co2_ppm": 400 + i} for i in range(count)]
+
+
+class GatedSink(Sink):
+    """Blocks in write_batch until released, keeps the batches it got."""
+
+    def __init__(self):
+        self.batches = []
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+    def write_batch(self, batch):
+        self.writing.set()
+        self.release.wait()
+        self.batches.append(list(batch))
+
+
+def test_http_retries_until_delivered():
+    with HttpCollectorStub() as collector:
+        collector.fail_next = 3
+        publisher = Publisher(sink_from_url(collector.url), batch_size=50, flush_interval=0.05, policy=FAST)
+        publisher.publish_many(records(120))
+        publisher.close()
+        assert collector.records() == records(120)
+        assert (publisher.written, publisher.failed, publisher.dropped) == (120, 0, 0)
+
+
+def test_mqtt_retries_until_delivered():
+    with MqttBrokerStub() as broker:
+        broker.fail_next = 2
+        publisher = Publisher(sink_from_url(broker.url), batch_size=20, flush_interval=0.05, policy=FAST)
+        publisher.publish_many(records(30) + records(30, mac="C0:FF:EE:00:00:02"))
+        publisher.close()
+        assert sorted(r["timestamp"] for r in broker.records()) == sorted(r["timestamp"] for r in records(30) * 2)
+        topics = {topic for topic, payload in broker.messages}
+        assert topics == {"atmotube/C0:FF:EE:00:00:01", "atmotube/C0:FF:EE:00:00:02"}
+        assert (publisher.written, publisher.failed) == (60, 0)
+
+
+def test_failed_after_retries(capsys):
+    with HttpCollectorStub() as collector:
+        collector.fail_next = 100
+        publisher = Publisher(sink_from_url(collector.url), batch_size=10, policy=RetryPolicy(2, 0.01, 0.01))
+        publisher.publish_many(records(25))
+        publisher.close()
+        assert (publisher.written, publisher.failed) == (0, 25)
+        assert "after retries" in capsys.readouterr().err
+
+
+def test_batches(tmp_path):
+    sink = GatedSink()
+    sink.release.set()
+    publisher = Publisher(sink, batch_size=10, flush_interval=60)
+    publisher.publish_many(records(25))
+    publisher.close()
+    # the rest is written on close, not after flush_interval
+    assert [len(batch) for batch in sink.batches] == [10, 10, 5]
+
+
+def test_flush_interval():
+    sink = GatedSink()
+    sink.release.set()
+    publisher = Publisher(sink, batch_size=100, flush_interval=0.05)
+    publisher.publish_many(records(3))
+    for _ in range(100):
+        if sink.batches:
+            break
+        threading.Event().wait(0.02)
+    assert sink.batches == [records(3)]
+    publisher.close()
+
+
+def test_backpressure_and_drops():
+    sink = GatedSink()
+    publisher = Publisher(sink, batch_size=1, flush_interval=0.01, queue_size=2)
+    publisher.publish({"timestamp": -1})
+    assert sink.writing.wait(2)
+    # one record in write_batch, two queued, the rest does not fit
+    assert publisher.publish_many(records(10), timeout=0) == 2
+    assert publisher.dropped == 8
+    assert not publisher.publish({"timestamp": 0}, timeout=0.05)
+    blocked = threading.Thread(target=publisher.publish, args=({"timestamp": 1},))
+    blocked.start()
+    blocked.join(0.1)
+    assert blocked.is_alive()
+    sink.release.set()
+    blocked.join(2)
+    assert not blocked.is_alive()
+    publisher.close()
+    assert (publisher.written, publisher.dropped) == (4, 9)
+
+
+def test_close_is_idempotent(tmp_path):
+    path = tmp_path / "out.ndjson"
+    publisher = Publisher(NdjsonSink(str(path)), flush_interval=60)
+    publisher.publish_many(records(5))
+    publisher.close()
+    publisher.close()
+    assert [json.loads(line) for line in path.read_text().splitlines()] == records(5)
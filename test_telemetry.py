@@ -0,0 +1,12 @@
+import mcumgr_wrapper
+from telemetry import DeviceStream
+
+
+def test_poll_without_cli(simulator, monkeypatch):
+    # readings go over SMP whatever the transport of shell commands, there is no ./mcumgr here
+    monkeypatch.setattr(mcumgr_wrapper, "USE_NATIVE_SMP", False)
+    stream = DeviceStream(simulator.port, interval=0.1)
+    sample = stream.poll()
+    assert sample is not None and stream.errors == 0
+    assert sample["mac"] == simulator.device.mac
+    assert stream.is_new_pm_format is not None
@@ -0,0 +1,183 @@
+import math
+import threading
+import time
+from array import array
+from datetime import datetime, timezone
+
+# column name and array typecode, float32 is plenty for the sensors, coordinates need doubles
+FIELDS = (
+    ("temperature_c", "f"),
+    ("humidity_percent", "f"),
+    ("pressure_mbar", "f"),
+    ("battery_percent", "f"),
+    ("voc_index", "f"),
+    ("voc_ppm", "f"),
+    ("nox_index", "f"),
+    ("co2_ppm", "f"),
+    ("pm1_ug_m3", "f"),
+    ("pm25_ug_m3", "f"),
+    ("pm10_ug_m3", "f"),
+    ("aqs", "f"),
+    ("latitude", "d"),
+    ("longitude", "d"),
+    ("altitude_m", "f"),
+)
+FIELD_NAMES = tuple(name for name, typecode in FIELDS)
+# one day of readings at one per second
+DEFAULT_CAPACITY = 86400
+
+
+def record_time(record: dict) -> float:
+    """Epoch seconds of a parsed or streamed record, its corrected "time" if it has one, else "timestamp" (UTC)."""
+    value = record.get("time") or record["timestamp"]
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def _number(value) -> float:
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else math.nan
+
+
+def _single(value: float) -> float:
+    """A float32 column value without the digits the conversion added, 1013.2999877 -> 1013.3."""
+    return float(f"{value:.7g}")
+
+
+class TimeSeries:
+    """
+    Ring buffer of the last capacity readings of one device, one preallocated array per field of FIELDS.
+
+    Memory is fixed at creation, append overwrites the oldest reading. Missing values are stored as NaN
+    and ignored by stats. Readings are kept in time order, a reading not newer than the last one is dropped.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.times = array("d", bytes(8 * capacity))
+        self.columns = {name: array(typecode, [math.nan]) * capacity for name, typecode in FIELDS}
+        self.count = 0
+        self._head = 0   # next slot to write
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def last_time(self) -> float | None:
+        return self.times[self._head - 1] if self.count else None
+
+    def append(self, record: dict, timestamp: float | None = None) -> bool:
+        """Store a reading, False when it is not newer than the last one."""
+        timestamp = record_time(record) if timestamp is None else timestamp
+        with self._lock:
+            if self.count and timestamp <= self.times[self._head - 1]:
+                return False
+            slot = self._head
+            self.times[slot] = timestamp
+            for name, column in self.columns.items():
+                column[slot] = _number(record.get(name))
+            self._head = (slot + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+        return True
+
+    def _slot(self, index: int) -> int:
+        """Ring slot of the index-th stored reading, 0 is the oldest."""
+        return (self._head - self.count + index) % self.capacity
+
+    def _first_since(self, since: float) -> int:
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.times[self._slot(middle)] < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _ranges(self, start: int) -> list[tuple[int, int]]:
+        """Slot ranges holding the readings from index start to the newest, at most two because of the wrap."""
+        if start >= self.count:
+            return []
+        first = self._slot(start)
+        end = first + self.count - start
+        if end <= self.capacity:
+            return [(first, end)]
+        return [(first, self.capacity), (0, end - self.capacity)]
+
+    def window(self, seconds: float | None = None, now: float | None = None) -> tuple[list[float], dict[str, list[float]]]:
+        """Times and column values of the readings of the last seconds, all readings if seconds is None."""
+        with self._lock:
+            start = 0 if seconds is None else self._first_since((now or time.time()) - seconds)
+            ranges = self._ranges(start)
+            times = [t for a, b in ranges for t in self.times[a:b]]
+            columns = {name: [v for a, b in ranges for v in column[a:b]] for name, column in self.columns.items()}
+        return times, columns
+
+    def stats(self, seconds: float | None = None, fields=FIELD_NAMES, now: float | None = None) -> dict[str, dict]:
+        """min / max / mean / count per field over the last seconds, fields without values are left out."""
+        result = {}
+        with self._lock:
+            ranges = self._ranges(0 if seconds is None else self._first_since((now or time.time()) - seconds))
+            for name in fields:
+                column = self.columns[name]
+                values = [v for a, b in ranges for v in column[a:b] if v == v]
+                if values:
+                    result[name] = {"min": _single(min(values)), "max": _single(max(values)),
+                                    "mean": sum(values) / len(values), "count": len(values)}
+        return result
+
+    def latest(self) -> dict | None:
+        """The newest reading as a dict, None when empty. NaN fields are left out."""
+        with self._lock:
+            if not self.count:
+                return None
+            slot = self._head - 1
+            reading = {"time": self.times[slot]}
+            for name, column in self.columns.items():
+                value = column[slot]
+                if value == value:
+                    reading[name] = _single(value) if column.typecode == "f" else value
+        return reading
+
+
+class TimeSeriesStore:
+    """A TimeSeries per device, created on first append."""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._series: dict[str, TimeSeries] = {}
+        self._lock = threading.Lock()
+
+    def series(self, device: str) -> TimeSeries:
+        with self._lock:
+            series = self._series.get(device)
+            if series is None:
+                series = self._series[device] = TimeSeries(self.capacity)
+        return series
+
+    def devices(self) -> list[str]:
+        with self._lock:
+            return list(self._series)
+
+    def append(self, device: str, record: dict, timestamp: float | None = None) -> bool:
+        return self.series(device).append(record, timestamp)
+
+    def forget(self, device: str):
+        with self._lock:
+            self._series.pop(device, None)
+
+
+STORE = TimeSeriesStore()
+
+
+def print_window_stats(series: TimeSeries, minutes: float, fields=("temperature_c", "humidity_percent", "co2_ppm",
+                                                                   "pm25_ug_m3", "aqs")):
+    stats = series.stats(minutes * 60, fields)
+    if not stats:
+        return
+    readings = max(s["count"] for s in stats.values())
+    print(f"Last {minutes:g} minutes ({readings} readings):")
+    for name, s in stats.items():
+        print(f"  {name:<18} min {s['min']:>8.1f}  max {s['max']:>8.1f}  mean {s['mean']:>8.1f}")
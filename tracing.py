@@ -0,0 +1,205 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable
+
+# Upper bounds in seconds, the last bucket is +Inf
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class CommandTrace:
+    """Timing of one wrapper call. Durations are seconds."""
+
+    __slots__ = ("command", "device", "started", "queue_s", "spawn_s", "transfer_s", "device_s", "wall_s",
+                 "bytes_sent", "bytes_received", "retries", "error", "timeout_reason")
+
+    def __init__(self, command: str, device: str):
+        self.command = command
+        self.device = device
+        self.started = time.time()
+        self.queue_s = 0.0      # waiting for the device scheduler
+        self.spawn_s = 0.0      # starting the mcumgr process
+        self.transfer_s = 0.0   # writing and reading serial frames
+        self.device_s = 0.0     # from the request written until the first response frame
+        self.wall_s = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        self.error = ""
+        self.timeout_reason = ""
+
+    def add_smp_stats(self, stats: dict):
+        self.transfer_s += stats.get("write_s", 0.0) + stats.get("read_s", 0.0)
+        self.device_s += stats.get("wait_s", 0.0)
+        self.bytes_sent += stats.get("bytes_sent", 0)
+        self.bytes_received += stats.get("bytes_received", 0)
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class LatencyHistogram:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        # recent samples for percentiles, the buckets are too coarse for that
+        self.recent = deque(maxlen=256)
+
+    def observe(self, value: float, sample: bool = True):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        if sample:
+            self.recent.append(value)
+
+    def percentile(self, q: float) -> float | None:
+        if not self.recent:
+            return None
+        values = sorted(self.recent)
+        index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+        return values[index]
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Tracer:
+    def __init__(self, keep: int = 10000):
+        self.traces = deque(maxlen=keep)
+        self.histograms: dict[str, LatencyHistogram] = {}
+        self.errors: dict[tuple[str, str], int] = {}
+        self.totals: dict[str, list[int]] = {}  # command -> [bytes sent, bytes received, retries]
+        self.hooks: list[Callable[[CommandTrace], None]] = []
+        self.json_lines_path = None
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: Callable[[CommandTrace], None]):
+        """Call hook(trace) after every traced command, e.g. to feed a profiler or a live view."""
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[CommandTrace], None]):
+        self.hooks.remove(hook)
+
+    def record(self, trace: CommandTrace):
+        with self._lock:
+            self.traces.append(trace)
+            histogram = self.histograms.get(trace.command)
+            if histogram is None:
+                histogram = self.histograms[trace.command] = LatencyHistogram()
+            failed = bool(trace.error or trace.timeout_reason)
+            # failures stay out of the percentile samples, a timed out call says nothing about latency
+            histogram.observe(trace.wall_s, sample=not failed)
+            totals = self.totals.setdefault(trace.command, [0, 0, 0])
+            totals[0] += trace.bytes_sent
+            totals[1] += trace.bytes_received
+            totals[2] += trace.retries
+            if failed:
+                reason = "timeout" if trace.timeout_reason else "error"
+                self.errors[(trace.command, reason)] = self.errors.get((trace.command, reason), 0) + 1
+            if self.json_lines_path:
+                with open(self.json_lines_path, "a") as f:
+                    f.write(json.dumps(trace.to_dict()) + "\n")
+        for hook in list(self.hooks):
+            try:
+                hook(trace)
+            except Exception as e:
+                print(f"Trace hook failed: {e}")
+
+    def percentile(self, command: str, q: float) -> float | None:
+        with self._lock:
+            histogram = self.histograms.get(command)
+            return histogram.percentile(q) if histogram else None
+
+    def sample_count(self, command: str) -> int:
+        with self._lock:
+            histogram = self.histograms.get(command)
+            return len(histogram.recent) if histogram else 0
+
+    def export_json_lines(self, path: str):
+        with self._lock:
+            traces = list(self.traces)
+        with open(path, "w") as f:
+            for trace in traces:
+                f.write(json.dumps(trace.to_dict()) + "\n")
+
+    def prometheus_text(self) -> str:
+        lines = [
+            "# HELP atmotube_command_duration_seconds Wall time of device commands.",
+            "# TYPE atmotube_command_duration_seconds histogram",
+        ]
+        with self._lock:
+            for command, histogram in sorted(self.histograms.items()):
+                label = _label(command)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'atmotube_command_duration_seconds_bucket{{command="{label}",le="{le}"}} {cumulative}')
+                lines.append(f'atmotube_command_duration_seconds_sum{{command="{label}"}} {histogram.sum}')
+                lines.append(f'atmotube_command_duration_seconds_count{{command="{label}"}} {histogram.count}')
+
+            lines.append("# HELP atmotube_command_bytes_total Bytes moved over the serial link.")
+            lines.append("# TYPE atmotube_command_bytes_total counter")
+            for command, (sent, received, retries) in sorted(self.totals.items()):
+                label = _label(command)
+                lines.append(f'atmotube_command_bytes_total{{command="{label}",direction="tx"}} {sent}')
+                lines.append(f'atmotube_command_bytes_total{{command="{label}",direction="rx"}} {received}')
+
+            lines.append("# HELP atmotube_command_retries_total Retries inside device commands.")
+            lines.append("# TYPE atmotube_command_retries_total counter")
+            for command, (sent, received, retries) in sorted(self.totals.items()):
+                lines.append(f'atmotube_command_retries_total{{command="{_label(command)}"}} {retries}')
+
+            lines.append("# HELP atmotube_command_failures_total Failed device commands by reason.")
+            lines.append("# TYPE atmotube_command_failures_total counter")
+            for (command, reason), count in sorted(self.errors.items()):
+                lines.append(f'atmotube_command_failures_total{{command="{_label(command)}",reason="{reason}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def export_prometheus(self, path: str):
+        """Write the metrics in Prometheus text format, atomically for the node exporter textfile collector."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+TRACER = Tracer()
+# set to stream every trace to a JSON lines file
+TRACER.json_lines_path = os.environ.get("ATMOTUBE_TRACE_JSONL")
+
+
+def export_from_env():
+    """Write the collected metrics to the files named by ATMOTUBE_METRICS_PROM and ATMOTUBE_METRICS_JSONL."""
+    prometheus_path = os.environ.get("ATMOTUBE_METRICS_PROM")
+    if prometheus_path:
+        TRACER.export_prometheus(prometheus_path)
+    json_lines_path = os.environ.get("ATMOTUBE_METRICS_JSONL")
+    if json_lines_path:
+        TRACER.export_json_lines(json_lines_path)
+
+
+@contextmanager
+def trace(command: str, device: str, tracer: Tracer | None = None):
+    """Time the enclosed block as one command and record it, even when the block raises."""
+    t = CommandTrace(command, device)
+    started = time.perf_counter()
+    try:
+        yield t
+    except BaseException as e:
+        t.error = t.error or str(e) or type(e).__name__
+        raise
+    finally:
+        t.wall_s = time.perf_counter() - started
+        (tracer or TRACER).record(t)